@@ -7,7 +7,22 @@ from flask import Flask, render_template, request, redirect, url_for
 from werkzeug.security import generate_password_hash
 
 from extensions import db, login_manager, mail, csrf
-from models import User, StoreSettings, CartItem, Product
+from models import User, StoreSettings, Product
+import caching
+import campaigns
+import inventory
+import invoice_cache
+import invoice_export
+import notifications
+import segments
+import sequences
+import migrations
+import scheduler
+from sql_instrumentation import sql_instrumentation
+from context_loader import lazy_context
+from cart_summary import get_cart_summary
+from search import search_index
+import suggest
 
 # Optional: nicer CSRF errors + CSRF cookie for AJAX
 from flask_wtf.csrf import CSRFError, generate_csrf
@@ -41,6 +56,50 @@ def create_app():
     app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD", "")
     app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_DEFAULT_SENDER", "")
 
+    # --- Caching ---
+    app.config["SETTINGS_CACHE_TTL"] = int(os.environ.get("SETTINGS_CACHE_TTL", "60"))
+    app.config["CATEGORY_IMAGE_CACHE_TTL"] = int(os.environ.get("CATEGORY_IMAGE_CACHE_TTL", "300"))
+
+    # --- Inventory ---
+    app.config["INVENTORY_RESERVATION_MINUTES"] = int(os.environ.get("INVENTORY_RESERVATION_MINUTES", "0"))
+
+    # --- Notification outbox worker ---
+    app.config["NOTIFICATION_CONCURRENCY"] = int(os.environ.get("NOTIFICATION_CONCURRENCY", "4"))
+    app.config["NOTIFICATION_BATCH_SIZE"] = int(os.environ.get("NOTIFICATION_BATCH_SIZE", "50"))
+    app.config["NOTIFICATION_MAX_ATTEMPTS"] = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", "5"))
+    app.config["NOTIFICATION_RETRY_SECONDS"] = int(os.environ.get("NOTIFICATION_RETRY_SECONDS", "60"))
+
+    # --- Campaign delivery ---
+    app.config["CAMPAIGN_BATCH_SIZE"] = int(os.environ.get("CAMPAIGN_BATCH_SIZE", "200"))
+    app.config["CAMPAIGN_RATE_PER_MINUTE"] = int(os.environ.get("CAMPAIGN_RATE_PER_MINUTE", "600"))
+    app.config["SEGMENT_INDEX_TTL"] = int(os.environ.get("SEGMENT_INDEX_TTL", "300"))
+
+    # --- Scheduler (periodic jobs; any number of processes may run it) ---
+    # On by default so a single-process deployment drains the outbox, renders
+    # exports and compacts inventory; set false where `python scheduler.py` runs instead
+    app.config["SCHEDULER_ENABLED"] = os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true"
+    app.config["CART_RETENTION_DAYS"] = int(os.environ.get("CART_RETENTION_DAYS", "30"))
+    app.config["SLOW_QUERY_RETENTION_DAYS"] = int(os.environ.get("SLOW_QUERY_RETENTION_DAYS", "30"))
+
+    # --- Invoice PDF cache (defaults to <instance>/invoice_cache) ---
+    app.config["INVOICE_CACHE_DIR"] = os.environ.get("INVOICE_CACHE_DIR", "")
+    app.config["INVOICE_CACHE_MAX_MB"] = int(os.environ.get("INVOICE_CACHE_MAX_MB", "200"))
+    app.config["INVOICE_EXPORT_PROCESSES"] = int(os.environ.get("INVOICE_EXPORT_PROCESSES", str(os.cpu_count() or 2)))
+
+    # --- Sequences (order numbers, SKUs) ---
+    app.config["SEQUENCE_BLOCK_SIZE"] = int(os.environ.get("SEQUENCE_BLOCK_SIZE", "20"))
+
+    # --- Product search ---
+    app.config["SEARCH_MAX_RESULTS"] = int(os.environ.get("SEARCH_MAX_RESULTS", "500"))
+    app.config["SEARCH_INDEX_TTL"] = int(os.environ.get("SEARCH_INDEX_TTL", "600"))
+    app.config["SEARCH_USE_FTS5"] = os.environ.get("SEARCH_USE_FTS5", "true").lower() == "true"
+    app.config["SUGGEST_INDEX_TTL"] = int(os.environ.get("SUGGEST_INDEX_TTL", "300"))
+
+    # --- SQL instrumentation ---
+    app.config["SQL_INSTRUMENTATION"] = os.environ.get("SQL_INSTRUMENTATION", "true").lower() == "true"
+    app.config["SQL_N_PLUS_ONE_THRESHOLD"] = int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+    app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", "200"))
+
     # --- CSRF config ---
     app.config["WTF_CSRF_HEADERS"] = ["X-CSRFToken", "X-CSRF-Token"]
 
@@ -49,6 +108,17 @@ def create_app():
     login_manager.init_app(app)
     mail.init_app(app)
     csrf.init_app(app)
+    sql_instrumentation.init_app(app)
+    caching.init_app(app)
+    inventory.init_app(app)
+    invoice_cache.init_app(app)
+    invoice_export.init_app(app)
+    sequences.init_app(app)
+    notifications.init_app(app)
+    campaigns.init_app(app)
+    segments.init_app(app)
+    search_index.init_app(app)
+    suggest.init_app(app)
 
     # Login manager config — point to the blueprint route (ensure main.login exists)
     login_manager.login_view = "main.login"
@@ -113,26 +183,25 @@ def create_app():
         except Exception:
             return f"CSRF Error: {e.description}", 400
 
-    # --- Context processors ---
-    @app.context_processor
-    def inject_cart_count():
+    # --- Template context (lazy, memoized per request) ---
+    lazy_context.init_app(app)
+
+    @lazy_context.lazy("cart_count")
+    def load_cart_count():
         from flask_login import current_user
-        cart_count = 0
         try:
             if getattr(current_user, "is_authenticated", False):
-                cart_count = CartItem.query.filter_by(user_id=current_user.id).count()
+                return get_cart_summary(current_user.id).item_count
         except Exception:
-            cart_count = 0
-        return dict(cart_count=cart_count)
+            pass
+        return 0
 
-    @app.context_processor
-    def inject_settings():
-        settings = None
+    @lazy_context.lazy("store_settings")
+    def load_store_settings():
         try:
-            settings = StoreSettings.query.first()
+            return caching.get_store_settings()
         except Exception:
-            settings = None
-        return dict(store_settings=settings)
+            return None
 
     # --- CSRF token cookie for AJAX ---
     @app.after_request
@@ -153,7 +222,9 @@ def create_app():
 
     # --- First-run DB setup / seed ---
     with app.app_context():
+        fresh = migrations.is_fresh_database()
         db.create_all()
+        migrations.upgrade(fresh=fresh)
 
         # Admin user
         if not User.query.filter_by(email="admin@thaavaram.com").first():
@@ -201,9 +272,13 @@ def create_app():
             db.session.add(settings)
 
         db.session.commit()
+        caching.settings_cache.invalidate()
         app.logger.setLevel(logging.INFO)
         app.logger.info("Database initialized successfully")
 
+    # Started last: the scheduler thread needs the tables above
+    scheduler.init_app(app)
+
     return app
 
 
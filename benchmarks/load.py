@@ -0,0 +1,335 @@
+"""
+Scripted load driver.
+
+Runs a weighted mix of storefront, cart, checkout and admin scenarios with
+N concurrent virtual users and reports latency percentiles and throughput
+per endpoint. Targets either an in-process app built by create_app() (no
+server needed; CSRF is disabled) or a running server over HTTP.
+
+    python -m benchmarks.seed --database sqlite:///bench.db --scale small
+    python -m benchmarks.load --manifest bench_manifest.json --concurrency 8 --duration 60
+    python -m benchmarks.load --url http://127.0.0.1:5000 --mix storefront=80,admin=20
+
+The manifest written by benchmarks.seed supplies the database URL (for the
+in-process target), id ranges, credentials and search terms. Use --json to
+keep the report for comparison between runs.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MIX = 'storefront=70,cart=15,checkout=5,admin=10'
+
+
+# =========================
+# Clients
+# =========================
+
+class InProcessClient:
+    """Flask test client; one per virtual user so cookies stay separate."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self._client.open(path, method=method, data=form, json=json_body)
+        status = response.status_code
+        response.close()
+        return status
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """urllib client with a cookie jar; sends the csrf_token cookie back as X-CSRFToken."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect())
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrf_token':
+                return cookie.value
+        return None
+
+    def request(self, method, path, form=None, json_body=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if method != 'GET':
+            if self._csrf_token() is None:
+                self.request('GET', '/login')
+            headers['X-CSRFToken'] = self._csrf_token() or ''
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+# =========================
+# Recording
+# =========================
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, name, elapsed_ms, status):
+        with self._lock:
+            self.samples[name].append(elapsed_ms)
+            self.statuses[name][status] += 1
+            if status is None or status >= 400:
+                self.errors[name] += 1
+
+    def report(self, wall_seconds):
+        rows = []
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            rows.append({
+                'endpoint': name,
+                'requests': len(values),
+                'errors': self.errors[name],
+                'rps': len(values) / wall_seconds if wall_seconds else 0.0,
+                'mean_ms': sum(values) / len(values),
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'p99_ms': percentile(values, 99),
+                'max_ms': values[-1],
+                'statuses': {str(k): v for k, v in sorted(self.statuses[name].items(), key=lambda kv: str(kv[0]))},
+            })
+        everything = sorted(v for values in self.samples.values() for v in values)
+        total = {
+            'endpoint': 'TOTAL',
+            'requests': len(everything),
+            'errors': sum(self.errors.values()),
+            'rps': len(everything) / wall_seconds if wall_seconds else 0.0,
+            'mean_ms': sum(everything) / len(everything) if everything else 0.0,
+            'p50_ms': percentile(everything, 50),
+            'p95_ms': percentile(everything, 95),
+            'p99_ms': percentile(everything, 99),
+            'max_ms': everything[-1] if everything else 0.0,
+        }
+        return {'wall_seconds': wall_seconds, 'endpoints': rows, 'total': total}
+
+
+def print_report(report):
+    header = f"{'endpoint':<28}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print('-' * len(header))
+    for row in report['endpoints'] + [report['total']]:
+        print(f"{row['endpoint']:<28}{row['requests']:>8}{row['errors']:>6}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+    print(f"\n{report['total']['requests']} requests in {report['wall_seconds']:.1f}s (latencies in ms)")
+
+
+# =========================
+# Scenarios
+# =========================
+
+class VirtualUser:
+    def __init__(self, client, manifest, recorder, rng):
+        self.client = client
+        self.m = manifest
+        self.recorder = recorder
+        self.rng = rng
+        self.logged_in_as = None
+
+    def hit(self, name, method, path, form=None, json_body=None):
+        started = time.perf_counter()
+        try:
+            status = self.client.request(method, path, form=form, json_body=json_body)
+        except Exception:
+            status = None
+        self.recorder.add(name, (time.perf_counter() - started) * 1000, status)
+        return status
+
+    def _pick(self, key):
+        low, high = self.m[key]
+        return self.rng.randint(low, high)
+
+    def login_customer(self):
+        if self.logged_in_as == 'customer':
+            return
+        email = self.m['user_email'].format(id=self._pick('user_ids'))
+        self.hit('POST /login', 'POST', '/login', form={'email': email, 'password': self.m['password']})
+        self.logged_in_as = 'customer'
+
+    def login_admin(self):
+        if self.logged_in_as == 'admin':
+            return
+        self.hit('GET /logout', 'GET', '/logout')
+        self.hit('POST /login', 'POST', '/login',
+                 form={'email': self.m['admin_email'], 'password': self.m['password']})
+        self.logged_in_as = 'admin'
+
+    def storefront(self):
+        self.hit('GET /', 'GET', '/')
+        self.hit('GET /products', 'GET', '/products')
+        self.hit('GET /products/<category>', 'GET', f"/products/{self._pick('category_ids')}")
+        term = self.rng.choice(self.m['search_terms'])
+        self.hit('GET /api/suggest', 'GET', '/api/suggest?' + urllib.parse.urlencode({'q': term[:3]}))
+        self.hit('GET /products?search', 'GET', '/products?' + urllib.parse.urlencode({'search': term}))
+        self.hit('GET /product/<id>', 'GET', f"/product/{self._pick('product_ids')}")
+
+    def cart(self):
+        if self.logged_in_as == 'admin':
+            self.hit('GET /logout', 'GET', '/logout')
+            self.logged_in_as = None
+        self.login_customer()
+        for _ in range(self.rng.randint(1, 3)):
+            self.hit('POST /add_to_cart', 'POST', '/add_to_cart',
+                     json_body={'product_id': self._pick('product_ids'), 'quantity': self.rng.choice((0.5, 1.0, 2.0))})
+        self.hit('GET /cart', 'GET', '/cart')
+
+    def checkout(self):
+        self.cart()
+        self.hit('GET /checkout', 'GET', '/checkout')
+        self.hit('POST /place_order', 'POST', '/place_order', form={
+            'delivery_name': 'Load Test',
+            'delivery_phone': '9000000000',
+            'delivery_address': '1, Gandhi Street',
+            'delivery_city': 'Chennai',
+            'delivery_state': 'Tamil Nadu',
+            'delivery_pincode': '600001',
+        })
+
+    def admin(self):
+        self.login_admin()
+        self.hit('GET /admin', 'GET', '/admin')
+        self.hit('GET /admin/products', 'GET', '/admin/products')
+        self.hit('GET /admin/orders', 'GET', '/admin/orders')
+        self.hit('GET /admin/orders?status', 'GET', '/admin/orders?status=pending')
+        self.hit('GET /admin/users', 'GET', '/admin/users')
+        self.hit('GET /admin/orders/<id>/view', 'GET', f"/admin/orders/{self._pick('order_ids')}/view")
+
+
+SCENARIOS = ('storefront', 'cart', 'checkout', 'admin')
+
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run(make_client, manifest, mix, concurrency=4, duration=None, iterations=None, seed=0):
+    """
+    Run scenarios until `duration` seconds pass or each virtual user has done
+    `iterations` scenarios. Returns the report dict.
+    """
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        user = VirtualUser(make_client(), manifest, recorder, rng)
+        done = 0
+        while True:
+            if iterations is not None and done >= iterations:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            getattr(user, rng.choices(names, weights)[0])()
+            done += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--url', help='target a running server instead of an in-process app')
+    parser.add_argument('--database', help='in-process target only; defaults to the manifest database')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'scenario weights (default {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, help='seconds to run')
+    parser.add_argument('--iterations', type=int, help='scenarios per virtual user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    mix = parse_mix(args.mix)
+    if args.duration is None and args.iterations is None:
+        args.iterations = 20
+
+    if args.url:
+        def make_client():
+            return HTTPClient(args.url)
+        target = args.url
+    else:
+        os.environ['DATABASE_URL'] = args.database or manifest['database']
+        os.environ.setdefault('SQL_INSTRUMENTATION', 'false')
+        from app import app
+        app.logger.setLevel(logging.WARNING)
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        def make_client():
+            return InProcessClient(app)
+        target = f"in-process ({os.environ['DATABASE_URL']})"
+
+    print(f"Target: {target}; mix: {args.mix}; concurrency: {args.concurrency}")
+    report = run(make_client, manifest, mix, concurrency=args.concurrency,
+                 duration=args.duration, iterations=args.iterations, seed=args.seed)
+    report.update(target=target, mix=mix, concurrency=args.concurrency)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
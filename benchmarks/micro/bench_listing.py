@@ -0,0 +1,44 @@
+"""Product listing assembly (queries, pagination, category images) and smart_url_for."""
+import pytest
+
+import routes
+
+
+@pytest.fixture
+def captured_render(monkeypatch):
+    """Stop at render_template so only the view's data assembly is timed."""
+    monkeypatch.setattr(routes, 'render_template', lambda template, **context: context)
+
+
+def bench_products_listing(bench, app, captured_render):
+    with app.test_request_context('/products'):
+        context = bench(routes.products)
+    assert len(context['products'].items) == 12
+
+
+def bench_products_listing_category(bench, app, captured_render):
+    from models import Category
+
+    with app.app_context():
+        category_id = Category.query.first().id
+    with app.test_request_context(f'/products/{category_id}'):
+        context = bench(routes.products, category_id)
+    assert context['selected_category'].id == category_id
+
+
+def bench_products_listing_search(bench, app, captured_render):
+    with app.test_request_context('/products?search=ragi'):
+        context = bench(routes.products)
+    assert context['search'] == 'ragi'
+
+
+@pytest.mark.parametrize('endpoint, values', [
+    ('main.products', {}),
+    ('products', {}),
+    ('admin.admin_products', {}),
+    ('main.product_detail', {'product_id': 1}),
+], ids=['blueprint', 'bare', 'admin-alias', 'with-args'])
+def bench_smart_url_for(bench, app, endpoint, values):
+    with app.test_request_context('/'):
+        url = bench(routes.smart_url_for, endpoint, **values)
+    assert url.startswith('/')
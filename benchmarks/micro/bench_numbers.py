@@ -0,0 +1,27 @@
+"""Order number and SKU generation (each issues queries against the seeded database)."""
+
+
+def bench_generate_order_number(bench, app):
+    from models import Order
+
+    with app.app_context():
+        number = bench(Order().generate_order_number)
+    assert number.startswith('THV')
+
+
+def bench_generate_sku(bench, app):
+    from models import Category, Product
+
+    with app.app_context():
+        product = Product(category_id=Category.query.first().id)
+        sku = bench(product.generate_sku)
+    assert sku.startswith('THV')
+
+
+def bench_allocate_skus_bulk(bench, app):
+    from models import Category, Product
+
+    with app.app_context():
+        category = Category.query.first()
+        skus = bench(Product.allocate_skus, category.id, 1000, category=category)
+    assert len(set(skus)) == 1000
@@ -0,0 +1,52 @@
+"""Cart subtotal / GST / delivery computation (pricing.py, used by cart, checkout and place_order)."""
+from types import SimpleNamespace
+
+import pytest
+
+from pricing import CartPricing
+
+
+def _cart(n):
+    return [
+        SimpleNamespace(
+            product=SimpleNamespace(id=i + 1, price=20.0 + (i * 37) % 900, gst_rate=(0, 5, 12, 18)[i % 4]),
+            quantity=(0.25, 0.5, 1.0, 2.0)[i % 4],
+        )
+        for i in range(n)
+    ]
+
+
+SETTINGS = SimpleNamespace(free_delivery_amount=500.0, delivery_charge=50.0)
+
+
+@pytest.mark.parametrize('size', [3, 25, 200])
+def bench_cart_totals(bench, size):
+    items = _cart(size)
+    pricing = bench(CartPricing, items, SETTINGS)
+    assert pricing.total == pytest.approx(pricing.subtotal + pricing.gst_amount + pricing.delivery_charge)
+
+
+def bench_price_cart(bench, app):
+    """Load a 25-line database cart with its products and price it."""
+    from extensions import db
+    from models import CartItem, Product
+    from pricing import price_cart
+
+    with app.app_context():
+        user_id = 2
+        for product in Product.query.filter_by(is_active=True).limit(25):
+            db.session.add(CartItem(user_id=user_id, product_id=product.id, quantity=1.0))
+        db.session.flush()
+        pricing = bench(price_cart, user_id, SETTINGS)
+        db.session.rollback()
+    assert len(pricing) == 25
+
+
+def bench_price_session_cart(bench, app):
+    from models import Product
+    from pricing import price_session_cart
+
+    with app.app_context():
+        ids = [p.id for p in Product.query.filter_by(is_active=True).limit(25)]
+        pricing = bench(price_session_cart, {str(pid): 1.0 for pid in ids}, SETTINGS)
+    assert len(pricing) == 25
@@ -0,0 +1,27 @@
+"""Full render (view and template) of the admin pages shipped in templates/, signed in as the seeded admin."""
+from contextlib import contextmanager
+
+from flask_login import login_user
+
+import routes
+
+
+@contextmanager
+def _as_admin(app, path):
+    from models import User
+
+    with app.test_request_context(path):
+        login_user(User.query.filter_by(role='admin').order_by(User.id).first())
+        yield
+
+
+def bench_render_admin_orders_html(bench, app):
+    with _as_admin(app, '/admin/orders'):
+        html = bench(routes.admin_orders)
+    assert 'Orders' in html
+
+
+def bench_render_admin_communications_html(bench, app):
+    with _as_admin(app, '/admin/communications'):
+        html = bench(routes.admin_communications)
+    assert 'id="audience-counts"' in html
@@ -0,0 +1,216 @@
+"""
+Micro-benchmark harness.
+
+Each `bench_*` function takes the `bench` fixture and hands it the callable
+to time. The fixture calibrates a loop count so one round takes at least
+MIN_ROUND_SECONDS, runs several rounds and records the best and median time
+per call. The best round (least disturbed by other processes) is compared
+with this runner's entry in baselines.json, and the benchmark fails when it
+is slower than the baseline by more than the tolerance.
+
+    pytest benchmarks/micro                        # compare with baselines
+    pytest benchmarks/micro --bench-save           # re-record this runner's baselines
+    pytest benchmarks/micro --bench-tolerance 0.5  # allow 50% slowdown
+    pytest benchmarks/micro --bench-runner ci-large
+
+Baselines are kept per runner (BENCH_RUNNER, or host/arch/Python version by
+default). A runner without baselines records them on its first run and only
+reports; benchmarks added since then are recorded the same way.
+
+Even on one machine timings are noisy: slower bursts (frequency scaling,
+noisy neighbours) come and go, so a benchmark over its limit is measured
+again up to RETRIES times, after a pause, and judged on its best round
+overall. Memory layout, though, is fixed per process, and small pure-Python
+benchmarks (bench_cart_totals) land in a fast or a ~1.7x slower mode from
+one process to the next. Hence the default tolerance of 2x, and 2.5x for the
+benchmarks on the seeded database (the `app` fixture, `db_tolerance`). The
+gate catches the large regressions these benchmarks exist for (an extra
+query per row, a lost cache). For finer comparisons, repeat the run and
+read the summary.
+"""
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_TOLERANCE = 1.0
+DEFAULT_DB_TOLERANCE = 1.5
+MIN_ROUND_SECONDS = 0.02
+ROUNDS = 7
+RETRIES = 2
+RETRY_PAUSE_SECONDS = 1.0
+
+DATASET = dict(categories=12, products=2_000, users=300, orders=3_000)
+
+_results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('bench')
+    group.addoption('--bench-save', action='store_true', help="overwrite this runner's baselines")
+    group.addoption('--bench-baseline', default=BASELINE_PATH, help='baseline file (default: baselines.json here)')
+    group.addoption('--bench-runner', default=os.environ.get('BENCH_RUNNER') or _default_runner(),
+                    help='baseline set to compare with (default: $BENCH_RUNNER or host/arch/Python)')
+    group.addoption('--bench-tolerance', type=float, default=None,
+                    help=f'allowed slowdown as a fraction (default: baselines.json or {DEFAULT_TOLERANCE}; '
+                         f'database benchmarks {DEFAULT_DB_TOLERANCE})')
+    group.addoption('--bench-rounds', type=int, default=ROUNDS)
+
+
+def _default_runner():
+    return f"{platform.node()}/{platform.machine()}/py{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def _load_baselines(path):
+    if not os.path.exists(path):
+        return {'tolerance': DEFAULT_TOLERANCE, 'db_tolerance': DEFAULT_DB_TOLERANCE, 'runners': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _measure(call, loops, rounds):
+    """Seconds per call for each round, with the cyclic GC off while timing (as timeit does)."""
+    per_call = []
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(loops):
+                call()
+            per_call.append((time.perf_counter() - started) / loops)
+    finally:
+        if enabled:
+            gc.enable()
+    return per_call
+
+
+def _calibrate(fn):
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - started >= MIN_ROUND_SECONDS or loops >= 1 << 20:
+            return loops
+        loops *= 2
+
+
+class Bench:
+    def __init__(self, name, config, uses_db):
+        baselines = config._bench_baselines
+        self.name = name
+        self.rounds = config.getoption('--bench-rounds')
+        self.save = config.getoption('--bench-save')
+        self.tolerance = config.getoption('--bench-tolerance')
+        if self.tolerance is None:
+            key = 'db_tolerance' if uses_db else 'tolerance'
+            self.tolerance = baselines.get(key, DEFAULT_DB_TOLERANCE if uses_db else DEFAULT_TOLERANCE)
+        self.baseline = config._bench_runner.get('benchmarks', {}).get(name)
+
+    def _over_limit(self, per_call):
+        return min(per_call) * 1e6 > self.baseline['min_us'] * (1 + self.tolerance)
+
+    def __call__(self, fn, *args, **kwargs):
+        call = (lambda: fn(*args, **kwargs)) if args or kwargs else fn
+        result = call()  # warm-up, and the value is returned to the benchmark
+        loops = _calibrate(call)
+        per_call = _measure(call, loops, self.rounds)
+        check = self.baseline and not self.save
+        for _ in range(RETRIES if check else 0):
+            if not self._over_limit(per_call):
+                break
+            # Give a passing burst of load on the machine time to clear, then keep the best of all rounds
+            time.sleep(RETRY_PAUSE_SECONDS)
+            per_call += _measure(call, loops, self.rounds)
+        _results[self.name] = {
+            'median_us': round(statistics.median(per_call) * 1e6, 3),
+            'min_us': round(min(per_call) * 1e6, 3),
+            'loops': loops,
+        }
+        if check and self._over_limit(per_call):
+            pytest.fail(
+                f"{self.name} regressed: {min(per_call) * 1e6:.1f}us per call, baseline "
+                f"{self.baseline['min_us']:.1f}us (+{self.tolerance:.0%} allowed)",
+                pytrace=False,
+            )
+        return result
+
+
+@pytest.fixture
+def bench(request):
+    return Bench(request.node.name, request.config, 'app' in request.fixturenames)
+
+
+def pytest_configure(config):
+    baselines = _load_baselines(config.getoption('--bench-baseline'))
+    config._bench_baselines = baselines
+    config._bench_runner = baselines.setdefault('runners', {}).get(config.getoption('--bench-runner'), {})
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _results:
+        return
+    runner_name = config.getoption('--bench-runner')
+    recorded = config._bench_runner.get('benchmarks', {})
+    terminalreporter.section(f'micro-benchmarks ({runner_name})')
+    for name, result in sorted(_results.items()):
+        base = recorded.get(name)
+        delta = f"{(result['min_us'] / base['min_us'] - 1):+.1%}" if base else 'new'
+        terminalreporter.write_line(
+            f"{name:<48}{result['min_us']:>10.1f}us best {result['median_us']:>10.1f}us median  {delta}")
+
+    save = config.getoption('--bench-save')
+    new = {name: result for name, result in _results.items() if save or name not in recorded}
+    if not new:
+        return
+    data = config._bench_baselines
+    data.setdefault('tolerance', DEFAULT_TOLERANCE)
+    data.setdefault('db_tolerance', DEFAULT_DB_TOLERANCE)
+    runner = data['runners'].setdefault(runner_name, {})
+    runner['benchmarks'] = dict(sorted({**runner.get('benchmarks', {}), **new}.items()))
+    data['runners'] = dict(sorted(data['runners'].items()))
+    path = config.getoption('--bench-baseline')
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+    terminalreporter.write_line(f"Baselines for {len(new)} benchmarks written to {path} ({runner_name})")
+
+
+# =========================
+# Application fixtures
+# =========================
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """create_app() over a small seeded SQLite database."""
+    from benchmarks import seed
+
+    url = 'sqlite:///' + str(tmp_path_factory.mktemp('bench') / 'micro.db')
+    seed_app = seed.make_app(url)
+    with seed_app.app_context():
+        import migrations
+        from extensions import db
+        # Stamp the tables create_all() builds so create_app() does not migrate them again
+        fresh = migrations.is_fresh_database()
+        db.create_all()
+        migrations.upgrade(fresh=fresh)
+        seed.seed(DATASET, seed_value=7)
+
+    os.environ['DATABASE_URL'] = url
+    os.environ['SQL_INSTRUMENTATION'] = 'false'
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+    from app import app as application
+    application.config['WTF_CSRF_ENABLED'] = False
+    return application
+
@@ -0,0 +1,398 @@
+"""
+Deterministic benchmark dataset generator.
+
+Seeds categories, products, users (with an address each), orders and order
+items into the database named by --database (or DATABASE_URL). The same
+--seed and --scale always produce the same rows, so runs on different
+machines and branches are comparable.
+
+    python -m benchmarks.seed --database sqlite:///bench.db --scale large --reset
+    python -m benchmarks.seed --database postgresql://localhost/bench --scale medium
+
+Scales (categories / products / users / orders):
+
+    small    10 /   1,000 /   2,000 /    20,000
+    medium   30 /  20,000 /  40,000 /   400,000
+    large    50 / 100,000 / 200,000 / 2,000,000
+
+Every order gets 1-4 items. All benchmark users share one password
+(--password) so the load driver can log in as any of them. A manifest with
+the id ranges and credentials is written to --manifest for benchmarks.load.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import func, insert, text  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from extensions import db  # noqa: E402
+from models import (  # noqa: E402
+    Address, Category, Order, OrderItem, Product, StoreSettings, User,
+)
+import inventory  # noqa: E402
+import migrations  # noqa: E402
+import segments  # noqa: E402
+
+SCALES = {
+    'small': dict(categories=10, products=1_000, users=2_000, orders=20_000),
+    'medium': dict(categories=30, products=20_000, users=40_000, orders=400_000),
+    'large': dict(categories=50, products=100_000, users=200_000, orders=2_000_000),
+}
+
+BATCH_SIZE = 5_000
+EPOCH = datetime(2024, 1, 1)
+HISTORY_DAYS = 540
+
+ADMIN_EMAIL = 'admin@bench.local'
+
+CATEGORY_NAMES = [
+    ('Rice', 'அரிசி'), ('Millets', 'சிறுதானியங்கள்'), ('Pulses', 'பருப்பு வகைகள்'),
+    ('Spices', 'மசாலா'), ('Oils', 'எண்ணெய்'), ('Vegetables', 'காய்கறிகள்'),
+    ('Fruits', 'பழங்கள்'), ('Sweeteners', 'இனிப்பு'), ('Flours', 'மாவு'),
+    ('Dry Fruits', 'உலர் பழங்கள்'), ('Herbal Powders', 'மூலிகைப் பொடிகள்'),
+    ('Snacks', 'தின்பண்டங்கள்'), ('Pickles', 'ஊறுகாய்'), ('Seeds', 'விதைகள்'),
+    ('Ghee', 'நெய்'),
+]
+
+PRODUCT_WORDS = [
+    ('Ponni', 'பொன்னி'), ('Seeraga Samba', 'சீரக சம்பா'), ('Mappillai Samba', 'மாப்பிள்ளை சம்பா'),
+    ('Karuppu Kavuni', 'கருப்பு கவுனி'), ('Thooyamalli', 'தூயமல்லி'), ('Kambu', 'கம்பு'),
+    ('Ragi', 'கேழ்வரகு'), ('Thinai', 'தினை'), ('Varagu', 'வரகு'), ('Samai', 'சாமை'),
+    ('Kuthiraivali', 'குதிரைவாலி'), ('Toor Dal', 'துவரம் பருப்பு'), ('Urad Dal', 'உளுத்தம் பருப்பு'),
+    ('Moong Dal', 'பாசிப் பருப்பு'), ('Turmeric', 'மஞ்சள்'), ('Pepper', 'மிளகு'),
+    ('Cumin', 'சீரகம்'), ('Coriander', 'கொத்தமல்லி'), ('Groundnut Oil', 'கடலை எண்ணெய்'),
+    ('Sesame Oil', 'நல்லெண்ணெய்'), ('Coconut Oil', 'தேங்காய் எண்ணெய்'), ('Tomato', 'தக்காளி'),
+    ('Drumstick', 'முருங்கைக்காய்'), ('Brinjal', 'கத்தரிக்காய்'), ('Banana', 'வாழைப்பழம்'),
+    ('Jaggery', 'வெல்லம்'), ('Palm Jaggery', 'கருப்பட்டி'), ('Honey', 'தேன்'),
+    ('Moringa Powder', 'முருங்கைப் பொடி'), ('Amla', 'நெல்லிக்காய்'),
+]
+ADJECTIVES = ['Organic', 'Hand-pounded', 'Cold-pressed', 'Stone-ground', 'Farm Fresh', 'Traditional', 'Premium']
+
+CITIES = [
+    ('Chennai', '600'), ('Coimbatore', '641'), ('Madurai', '625'), ('Tiruchirappalli', '620'),
+    ('Salem', '636'), ('Tirunelveli', '627'), ('Erode', '638'), ('Vellore', '632'),
+]
+FIRST_NAMES = ['Arun', 'Divya', 'Karthik', 'Lakshmi', 'Murugan', 'Priya', 'Senthil', 'Meena', 'Vijay', 'Anitha']
+LAST_NAMES = ['Kumar', 'Raman', 'Subramanian', 'Natarajan', 'Pillai', 'Krishnan', 'Sundaram', 'Velu']
+ORDER_STATUSES = ['delivered'] * 6 + ['shipped', 'packed', 'accepted', 'pending', 'cancelled']
+GST_RATES = [0, 0, 5, 5, 12, 18]
+
+
+def _batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(model, rows, label):
+    started = time.perf_counter()
+    total = 0
+    for batch in _batched(rows):
+        db.session.execute(insert(model.__table__), batch)
+        db.session.commit()
+        total += len(batch)
+        print(f"\r  {label}: {total:,}", end='', flush=True)
+    print(f"\r  {label}: {total:,} in {time.perf_counter() - started:.1f}s")
+    return total
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def _timestamp(rng, start=EPOCH, days=HISTORY_DAYS):
+    return start + timedelta(seconds=rng.randrange(days * 86400))
+
+
+# =========================
+# Row generators
+# =========================
+
+def category_rows(count, first_id):
+    for i in range(count):
+        name, name_tamil = CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+        suffix = f" {i // len(CATEGORY_NAMES) + 1}" if i >= len(CATEGORY_NAMES) else ''
+        yield {
+            'id': first_id + i,
+            'name': name + suffix,
+            'name_tamil': name_tamil + suffix,
+            'description': f"{name} sourced directly from Tamil Nadu farms",
+            'is_active': True,
+            'sort_order': i,
+            'created_at': EPOCH,
+        }
+
+
+def product_rows(rng, count, first_id, category_ids):
+    for i in range(count):
+        product_id = first_id + i
+        word, word_tamil = PRODUCT_WORDS[rng.randrange(len(PRODUCT_WORDS))]
+        adjective = ADJECTIVES[rng.randrange(len(ADJECTIVES))]
+        pack = rng.choice([250, 500, 1000, 2000])
+        yield {
+            'id': product_id,
+            'sku': f"BEN{product_id:08d}",
+            'name': f"{adjective} {word} {pack}g",
+            'name_tamil': f"{word_tamil} {pack} கிராம்",
+            'description': f"{adjective} {word.lower()} packed in {pack}g pouches",
+            'category_id': category_ids[rng.randrange(len(category_ids))],
+            'price': round(rng.uniform(20, 1500), 2),
+            'stock_kg': float(rng.randrange(0, 500)),
+            'min_quantity_kg': 0.25,
+            'max_quantity_kg': 5.0,
+            'quantity_step_kg': 0.25,
+            'unit': 'kg',
+            'unit_tamil': 'கிலோ',
+            'stock_quantity': float(rng.randrange(0, 500)),
+            'min_order_quantity': 0.5,
+            'max_order_quantity': 10,
+            'weight_options': '[]',
+            'image_url': f"/static/uploads/bench/{product_id % 500}.jpg" if rng.random() < 0.8 else None,
+            'is_active': rng.random() < 0.95,
+            'is_featured': rng.random() < 0.02,
+            'gst_rate': float(rng.choice(GST_RATES)),
+            'created_at': _timestamp(rng),
+            'updated_at': EPOCH,
+        }
+
+
+def user_rows(rng, count, first_id, password_hash):
+    for i in range(count):
+        user_id = first_id + i
+        yield {
+            'id': user_id,
+            'username': f"bench{user_id}",
+            'email': f"bench{user_id}@bench.local",
+            'password_hash': password_hash,
+            'first_name': FIRST_NAMES[rng.randrange(len(FIRST_NAMES))],
+            'last_name': LAST_NAMES[rng.randrange(len(LAST_NAMES))],
+            'phone': f"9{rng.randrange(10**9):09d}",
+            'role': 'customer',
+            'is_active': True,
+            'created_at': _timestamp(rng),
+        }
+
+
+def address_rows(rng, user_ids, first_id):
+    for i, user_id in enumerate(user_ids):
+        city, pin_prefix = CITIES[user_id % len(CITIES)]
+        yield {
+            'id': first_id + i,
+            'user_id': user_id,
+            'name': f"Bench User {user_id}",
+            'phone': f"9{rng.randrange(10**9):09d}",
+            'address_line1': f"{rng.randrange(1, 300)}, {rng.choice(['Gandhi', 'Nehru', 'Kamarajar', 'Anna'])} Street",
+            'city': city,
+            'state': 'Tamil Nadu',
+            'pincode': f"{pin_prefix}{rng.randrange(1000):03d}",
+            'is_default': True,
+            'created_at': EPOCH,
+        }
+
+
+def order_and_item_rows(rng, count, first_order_id, first_item_id, user_ids, products, delivery):
+    """Yield (order_row, [item_rows]); totals are computed the way place_order does."""
+    free_above, charge = delivery
+    item_id = first_item_id
+    for i in range(count):
+        order_id = first_order_id + i
+        user_id = user_ids[rng.randrange(len(user_ids))]
+        city, pin_prefix = CITIES[user_id % len(CITIES)]
+        created_at = _timestamp(rng)
+        items = []
+        subtotal = gst = 0.0
+        for _ in range(rng.choice((1, 1, 2, 2, 3, 4))):
+            product_id, name, name_tamil, sku, price, gst_rate = products[rng.randrange(len(products))]
+            quantity = rng.choice((0.25, 0.5, 1.0, 1.0, 2.0))
+            subtotal += price * quantity
+            gst += price * quantity * gst_rate / 100
+            items.append({
+                'id': item_id,
+                'order_id': order_id,
+                'product_id': product_id,
+                'product_name': name,
+                'product_name_tamil': name_tamil,
+                'product_sku': sku,
+                'price': price,
+                'quantity': quantity,
+                'unit': 'kg',
+                'gst_rate': gst_rate,
+            })
+            item_id += 1
+        delivery_charge = 0 if subtotal >= free_above else charge
+        status = ORDER_STATUSES[rng.randrange(len(ORDER_STATUSES))]
+        yield {
+            'id': order_id,
+            'order_number': f"BEN{order_id:010d}",
+            'user_id': user_id,
+            'subtotal': round(subtotal, 2),
+            'gst_amount': round(gst, 2),
+            'delivery_charge': delivery_charge,
+            'total_amount': round(subtotal + gst + delivery_charge, 2),
+            'delivery_name': f"Bench User {user_id}",
+            'delivery_phone': '9000000000',
+            'delivery_address': '1, Gandhi Street',
+            'delivery_city': city,
+            'delivery_state': 'Tamil Nadu',
+            'delivery_pincode': f"{pin_prefix}001",
+            'status': status,
+            'payment_status': 'paid' if status in ('delivered', 'shipped', 'packed') else 'pending',
+            'payment_method': 'upi',
+            'created_at': created_at,
+            'updated_at': created_at,
+            'delivered_at': created_at + timedelta(days=3) if status == 'delivered' else None,
+        }, items
+
+
+# =========================
+# Driver
+# =========================
+
+def _fast_sqlite():
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text('PRAGMA journal_mode=WAL'))
+        db.session.execute(text('PRAGMA synchronous=OFF'))
+
+
+def _ensure_store(password):
+    if not StoreSettings.query.first():
+        db.session.add(StoreSettings(
+            store_name='Thaavaram', store_name_tamil='தாவரம்',
+            free_delivery_amount=500.0, delivery_charge=50.0,
+        ))
+    if not User.query.filter_by(email=ADMIN_EMAIL).first():
+        admin = User(username='bench-admin', email=ADMIN_EMAIL, role='admin', is_active=True)
+        admin.set_password(password)
+        db.session.add(admin)
+    db.session.commit()
+
+
+def seed(counts, seed_value=42, password='bench-pass'):
+    """Insert the dataset and return the manifest dict."""
+    rng = random.Random(seed_value)
+    _fast_sqlite()
+    _ensure_store(password)
+    settings = StoreSettings.query.first()
+    delivery = (settings.free_delivery_amount or 0, settings.delivery_charge or 0)
+
+    first_category = _next_id(Category)
+    _insert(Category, category_rows(counts['categories'], first_category), 'categories')
+    category_ids = list(range(first_category, first_category + counts['categories']))
+
+    first_product = _next_id(Product)
+    products = []
+
+    def collect_products():
+        for row in product_rows(random.Random(rng.random()), counts['products'], first_product, category_ids):
+            if row['is_active']:
+                products.append((row['id'], row['name'], row['name_tamil'], row['sku'], row['price'], row['gst_rate']))
+            yield row
+    _insert(Product, collect_products(), 'products')
+    inventory.track_existing()
+    db.session.commit()
+
+    first_user = _next_id(User)
+    password_hash = generate_password_hash(password)
+    _insert(User, user_rows(random.Random(rng.random()), counts['users'], first_user, password_hash), 'users')
+    user_ids = list(range(first_user, first_user + counts['users']))
+    _insert(Address, address_rows(random.Random(rng.random()), user_ids, _next_id(Address)), 'addresses')
+
+    # Orders and their items are generated together (totals depend on items) but
+    # inserted in two passes, chunk by chunk, so memory stays bounded.
+    first_order = _next_id(Order)
+    first_item = _next_id(OrderItem)
+    generator = order_and_item_rows(
+        random.Random(rng.random()), counts['orders'], first_order, first_item, user_ids, products, delivery)
+    started = time.perf_counter()
+    orders_done = items_done = 0
+    for chunk in _batched(generator):
+        order_rows = [order for order, _ in chunk]
+        item_rows = [item for _, items in chunk for item in items]
+        db.session.execute(insert(Order.__table__), order_rows)
+        for item_batch in _batched(item_rows):
+            db.session.execute(insert(OrderItem.__table__), item_batch)
+        db.session.commit()
+        orders_done += len(order_rows)
+        items_done += len(item_rows)
+        print(f"\r  orders: {orders_done:,} / items: {items_done:,}", end='', flush=True)
+    print(f"\r  orders: {orders_done:,} / items: {items_done:,} in {time.perf_counter() - started:.1f}s")
+    segments.rebuild_customer_activity()
+    db.session.commit()
+
+    return {
+        'seed': seed_value,
+        'counts': dict(counts, order_items=items_done),
+        'category_ids': [category_ids[0], category_ids[-1]] if category_ids else [],
+        'product_ids': [first_product, first_product + counts['products'] - 1],
+        'user_ids': [first_user, first_user + counts['users'] - 1],
+        'order_ids': [first_order, first_order + counts['orders'] - 1],
+        'user_email': 'bench{id}@bench.local',
+        'password': password,
+        'admin_email': ADMIN_EMAIL,
+        'search_terms': sorted({w.split()[0].lower() for w, _ in PRODUCT_WORDS}),
+    }
+
+
+def make_app(database_url):
+    """A bare app with only the database bound; create_app() is not needed to seed."""
+    app = Flask('benchmarks')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.environ.get('DATABASE_URL', 'sqlite:///bench.db'))
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for name in ('categories', 'products', 'users', 'orders'):
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='bench-pass')
+    parser.add_argument('--reset', action='store_true', help='drop all tables first')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    args = parser.parse_args(argv)
+
+    counts = dict(SCALES[args.scale])
+    for name in counts:
+        if getattr(args, name) is not None:
+            counts[name] = getattr(args, name)
+
+    app = make_app(args.database)
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            migrations.schema_version.drop(db.engine, checkfirst=True)
+        fresh = migrations.is_fresh_database()
+        db.create_all()
+        migrations.upgrade(fresh=fresh)
+
+        print(f"Seeding {args.database} ({args.scale}, seed={args.seed})")
+        started = time.perf_counter()
+        manifest = seed(counts, seed_value=args.seed, password=args.password)
+        manifest['database'] = args.database
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        print(f"Done in {time.perf_counter() - started:.1f}s")
+
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Manifest written to {args.manifest}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Process-local caches for rows that are read on nearly every request.
+
+Each cache holds one value, reloads it when its TTL expires, and can be
+invalidated explicitly by the code paths that write the underlying rows.
+"""
+import threading
+import time
+from types import MappingProxyType
+
+from sqlalchemy import inspect, func
+
+
+class CachedValue:
+    """
+    Lazily loaded value with a TTL and a version counter.
+
+    `invalidate()` bumps the version so the next `get()` reloads. A load that
+    raced with an invalidation is returned to its caller but not stored.
+    """
+
+    def __init__(self, loader, ttl=60):
+        self._loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_version = -1
+        self._expires_at = 0.0
+        self._value = None
+
+    def get(self):
+        with self._lock:
+            if self._loaded_version == self._version and time.monotonic() < self._expires_at:
+                return self._value
+            version = self._version
+
+        value = self._loader()
+
+        with self._lock:
+            if version == self._version:
+                self._value = value
+                self._loaded_version = version
+                self._expires_at = time.monotonic() + self.ttl
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._value = None
+
+    @property
+    def version(self):
+        return self._version
+
+
+class SettingsSnapshot:
+    """Read-only copy of a StoreSettings row (attribute access, like the model)."""
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', MappingProxyType(dict(values)))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls({attr.key: getattr(row, attr.key) for attr in inspect(row).mapper.column_attrs})
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError('StoreSettings snapshot is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('StoreSettings snapshot is read-only')
+
+    def __repr__(self):
+        return f"<SettingsSnapshot id={self._values.get('id')}>"
+
+
+def _load_store_settings():
+    from models import StoreSettings
+    row = StoreSettings.query.first()
+    return SettingsSnapshot.from_row(row) if row else None
+
+
+settings_cache = CachedValue(_load_store_settings)
+
+
+def get_store_settings():
+    """Cached, read-only StoreSettings (or None). Admin writes must call settings_cache.invalidate()."""
+    return settings_cache.get()
+
+
+def _load_category_images():
+    from extensions import db
+    from models import Product
+    first_with_image = (
+        db.session.query(Product.category_id, func.min(Product.id).label('product_id'))
+        .filter(Product.is_active.is_(True), Product.image_url.isnot(None))
+        .group_by(Product.category_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(first_with_image.c.category_id, Product.image_url)
+        .join(Product, Product.id == first_with_image.c.product_id)
+        .all()
+    )
+    return MappingProxyType(dict(rows))
+
+
+# category_id -> image_url of a representative active product
+category_image_cache = CachedValue(_load_category_images, ttl=300)
+
+
+def get_category_images():
+    """Cached category->image index. Product writes must call category_image_cache.invalidate()."""
+    return category_image_cache.get()
+
+
+def init_app(app):
+    settings_cache.ttl = app.config.get('SETTINGS_CACHE_TTL', 60)
+    settings_cache.invalidate()
+    category_image_cache.ttl = app.config.get('CATEGORY_IMAGE_CACHE_TTL', 300)
+    category_image_cache.invalidate()
@@ -0,0 +1,199 @@
+"""
+Campaign delivery.
+
+A campaign queued for delivery has status `sending`. A worker takes it with
+a lease (`lease_until`) and walks the `target_audience` segment in id
+order, CAMPAIGN_BATCH_SIZE recipients at a time: the next page of ids comes
+from the segment index (segments.members after `last_recipient_id`) and
+the users are loaded with the segment's SQL condition re-checked, so no
+cursor is held open while the batch is being sent. Each batch goes out through one pooled SMTP
+connection (mail_delivery.deliver) and/or the WhatsApp API, then the
+checkpoint (`last_recipient_id`, `sent_count`, `failed_count`) is committed
+together with a renewed lease. A worker that crashes loses at most the
+batch in flight; the next worker resumes after the checkpoint once the
+lease expires. Sending is throttled to CAMPAIGN_RATE_PER_MINUTE messages.
+
+    python campaigns.py run         # send campaigns that are waiting, then exit
+    python campaigns.py send 12     # send one campaign
+"""
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+import mail_delivery
+import segments
+from extensions import db
+from mail_delivery import OutgoingMail
+from models import Campaign, User
+
+LEASE_SECONDS = 300
+
+_config = {
+    'batch_size': 200,
+    'rate_per_minute': 600,
+}
+
+
+# target_audience values a campaign may use (see segments.py)
+AUDIENCES = segments.SEGMENTS
+UnknownAudience = segments.UnknownSegment
+
+
+def audience_condition(target_audience):
+    return segments.condition(target_audience)
+
+
+def count_recipients(target_audience):
+    return segments.count(target_audience)
+
+
+def _claim(campaign_id, now):
+    """Take the campaign's lease; returns the lease value or None if another worker holds it."""
+    lease = now + timedelta(seconds=LEASE_SECONDS)
+    result = db.session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status == 'sending',
+               or_(Campaign.lease_until.is_(None), Campaign.lease_until < now))
+        .values(lease_until=lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return lease if result.rowcount else None
+
+
+def _checkpoint(campaign_id, lease, values):
+    """Store progress if we still hold the lease; returns the new lease or None."""
+    renewed = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    result = db.session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.lease_until == lease)
+        .values({'lease_until': renewed, **values})
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return renewed if result.rowcount else None
+
+
+def _send_batch(campaign_id, channel, recipients, subject, body, settings):
+    """Deliver one batch. Returns (recipients reached, recipients failed, messages attempted)."""
+    from notifications import send_whatsapp
+
+    reached = set()
+    attempted = set()
+    messages = 0
+    if channel in ('email', 'both'):
+        outgoing = []
+        for r in recipients:
+            context = {'first_name': r.first_name or '', 'last_name': r.last_name or '', 'email': r.email}
+            outgoing.append(OutgoingMail(r.id, r.email, subject.render(**context), body.render(**context)))
+        results = mail_delivery.deliver(outgoing)
+        attempted.update(results)
+        reached.update(rid for rid, error in results.items() if error is None)
+        messages += len(outgoing)
+    if channel in ('whatsapp', 'both'):
+        for r in recipients:
+            if not r.phone:
+                continue
+            attempted.add(r.id)
+            messages += 1
+            try:
+                send_whatsapp(r.phone, body.render(first_name=r.first_name or '', last_name=r.last_name or ''),
+                              settings)
+                reached.add(r.id)
+            except Exception as e:
+                logging.debug(f"Campaign {campaign_id}: WhatsApp to user {r.id} failed: {e}")
+    return len(reached), len(attempted - reached), messages
+
+
+def send_campaign(campaign_id):
+    """
+    Deliver a `sending` campaign from its checkpoint. Returns True when it is
+    finished, False if another worker holds it or the lease was lost.
+    """
+    from caching import get_store_settings
+
+    lease = _claim(campaign_id, datetime.utcnow())
+    if lease is None:
+        return False
+    campaign = db.session.get(Campaign, campaign_id)
+    channel, audience, last_id = campaign.type, campaign.target_audience, campaign.last_recipient_id or 0
+    subject = mail_delivery.compile_template(campaign.subject or campaign.name)
+    body = mail_delivery.compile_template(campaign.message)
+    try:
+        condition = audience_condition(audience)
+    except UnknownAudience as e:
+        logging.error(f"Campaign {campaign_id}: {e}")
+        _checkpoint(campaign_id, lease, {'status': 'failed', 'lease_until': None})
+        return True
+
+    if not last_id:
+        lease = _checkpoint(campaign_id, lease, {'recipients_count': count_recipients(audience)})
+    settings = get_store_settings()
+    seconds_per_message = 60.0 / _config['rate_per_minute'] if _config['rate_per_minute'] else 0
+
+    while lease is not None:
+        page = segments.members(audience, after_id=last_id, limit=_config['batch_size'])
+        if not page:
+            db.session.commit()
+            _checkpoint(campaign_id, lease, {'status': 'sent', 'sent_at': datetime.utcnow(), 'lease_until': None})
+            return True
+        # The index may lag behind deactivations; the condition is checked on the rows themselves
+        recipients = db.session.execute(
+            select(User.id, User.email, User.phone, User.first_name, User.last_name)
+            .where(User.id.in_(page), condition)
+            .order_by(User.id)
+        ).all()
+        db.session.commit()
+
+        started = time.monotonic()
+        reached, failed, messages = _send_batch(campaign_id, channel, recipients, subject, body, settings)
+        last_id = page[-1]
+        lease = _checkpoint(campaign_id, lease, {
+            'last_recipient_id': last_id,
+            'sent_count': Campaign.sent_count + reached,
+            'failed_count': Campaign.failed_count + failed,
+        })
+        # Throttle: a batch of n messages takes at least n * seconds_per_message
+        pause = messages * seconds_per_message - (time.monotonic() - started)
+        if pause > 0 and lease is not None:
+            time.sleep(pause)
+
+    logging.warning(f"Campaign {campaign_id}: lease lost, another worker continues")
+    return False
+
+
+def run_pending():
+    """Send every campaign waiting in `sending` whose lease is free. Returns the ids finished."""
+    now = datetime.utcnow()
+    ids = list(db.session.execute(
+        select(Campaign.id)
+        .where(Campaign.status == 'sending', or_(Campaign.lease_until.is_(None), Campaign.lease_until < now))
+        .order_by(Campaign.id)
+    ).scalars())
+    db.session.commit()
+    return [campaign_id for campaign_id in ids if send_campaign(campaign_id)]
+
+
+def init_app(app):
+    _config.update(
+        batch_size=max(1, app.config.get('CAMPAIGN_BATCH_SIZE', _config['batch_size'])),
+        rate_per_minute=app.config.get('CAMPAIGN_RATE_PER_MINUTE', _config['rate_per_minute']),
+    )
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    with app.app_context():
+        if command == 'run':
+            print(f"Finished campaigns: {run_pending()}")
+        elif command == 'send' and len(sys.argv) > 2:
+            print('finished' if send_campaign(int(sys.argv[2])) else 'not finished (held by another worker?)')
+        else:
+            print(__doc__)
+            sys.exit(2)
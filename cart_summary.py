@@ -0,0 +1,126 @@
+"""
+Maintained per-user cart summary (item count, subtotal, version).
+
+Cart write paths apply deltas with a single atomic UPDATE in the same
+transaction as the CartItem change, so header badges and AJAX responses read
+one row instead of walking the cart. A missing row is rebuilt with one
+aggregate query.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update, delete, insert, type_coerce
+
+from extensions import db
+from money import Money
+from models import CartItem, CartSummary, Product
+
+CartTotals = namedtuple('CartTotals', 'item_count subtotal version')
+
+EMPTY = CartTotals(0, 0.0, 0)
+
+# Per-line total in paise, rounded like money.line_paise
+_line_paise = func.round(CartItem.quantity * Product.price)
+
+
+def _aggregate(user_id):
+    count, subtotal = db.session.execute(
+        select(func.count(CartItem.id), type_coerce(func.coalesce(func.sum(_line_paise), 0), Money))
+        .join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == user_id)
+    ).one()
+    return count, float(subtotal)
+
+
+def get_cart_summary(user_id):
+    """Return CartTotals for a user. Reads the summary row, falling back to one aggregate query."""
+    row = db.session.execute(
+        select(CartSummary.item_count, CartSummary.subtotal, CartSummary.version)
+        .where(CartSummary.user_id == user_id)
+    ).first()
+    if row is not None:
+        return CartTotals(row.item_count, row.subtotal, row.version)
+    count, subtotal = _aggregate(user_id)
+    return CartTotals(count, subtotal, 0)
+
+
+def apply_cart_delta(user_id, count_delta=0, amount_delta=0.0):
+    """
+    Adjust a user's summary after a cart change. Call after mutating the
+    CartItem rows and before commit; if the user has no summary row yet it
+    is created from the (flushed) cart state instead.
+    """
+    result = db.session.execute(
+        update(CartSummary)
+        .where(CartSummary.user_id == user_id)
+        .values(
+            item_count=CartSummary.item_count + count_delta,
+            subtotal=CartSummary.subtotal + amount_delta,
+            version=CartSummary.version + 1,
+            updated_at=datetime.utcnow(),
+        )
+    )
+    if result.rowcount == 0:
+        db.session.flush()
+        count, subtotal = _aggregate(user_id)
+        db.session.add(CartSummary(user_id=user_id, item_count=count, subtotal=subtotal, version=1))
+
+
+def clear_cart_summary(user_id):
+    """Reset a user's summary to empty (e.g. after the cart became an order)."""
+    result = db.session.execute(
+        update(CartSummary)
+        .where(CartSummary.user_id == user_id)
+        .values(item_count=0, subtotal=0.0, version=CartSummary.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.session.add(CartSummary(user_id=user_id, item_count=0, subtotal=0.0, version=1))
+
+
+def invalidate_for_product(product_id):
+    """Drop summaries of every cart holding a product whose price changed or which was deleted."""
+    holders = select(CartItem.user_id).where(CartItem.product_id == product_id)
+    db.session.execute(
+        delete(CartSummary).where(CartSummary.user_id.in_(holders)).execution_options(synchronize_session=False)
+    )
+
+
+def rebuild_cart_summaries():
+    """Recompute every summary from CartItem in one INSERT ... SELECT (backfill / repair)."""
+    db.session.execute(delete(CartSummary))
+    db.session.execute(
+        insert(CartSummary).from_select(
+            ['user_id', 'item_count', 'subtotal', 'version', 'updated_at'],
+            select(
+                CartItem.user_id,
+                func.count(CartItem.id),
+                func.sum(_line_paise),
+                1,
+                func.current_timestamp(),
+            )
+            .join(Product, Product.id == CartItem.product_id)
+            .group_by(CartItem.user_id)
+        )
+    )
+
+
+def expire_stale_carts(days):
+    """
+    Empty carts whose newest line is older than `days` days and drop their
+    summaries. Returns the number of carts emptied.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stale = (
+        select(CartItem.user_id)
+        .group_by(CartItem.user_id)
+        .having(func.max(CartItem.created_at) < cutoff)
+    )
+    user_ids = list(db.session.execute(stale).scalars())
+    for start in range(0, len(user_ids), 500):
+        batch = user_ids[start:start + 500]
+        db.session.execute(
+            delete(CartItem).where(CartItem.user_id.in_(batch)).execution_options(synchronize_session=False))
+        db.session.execute(
+            delete(CartSummary).where(CartSummary.user_id.in_(batch)).execution_options(synchronize_session=False))
+        db.session.commit()
+    return len(user_ids)
@@ -0,0 +1,62 @@
+"""
+Request-scoped, lazily evaluated template context.
+
+Values registered here are exposed to every template as proxies. The loader
+behind a value only runs when a template actually reads it, and the result is
+memoized on `flask.g` for the rest of the request.
+"""
+import threading
+from collections import Counter
+from functools import partial
+
+from flask import g
+from werkzeug.local import LocalProxy
+
+
+class LazyContextLoader:
+    def __init__(self, app=None):
+        self._loaders = {}
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.context_processor(self._context_processor)
+
+    def lazy(self, name):
+        """Decorator: register `fn` as the loader for template variable `name`."""
+        def decorator(fn):
+            self._loaders[name] = fn
+            return fn
+        return decorator
+
+    def _context_processor(self):
+        self._count('renders')
+        return {name: LocalProxy(partial(self._resolve, name)) for name in self._loaders}
+
+    def _resolve(self, name):
+        cache = g.setdefault('_lazy_context', {})
+        if name not in cache:
+            cache[name] = self._loaders[name]()
+            self._count(name)
+        return cache[name]
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self):
+        """
+        Process-wide counters: `renders` is how many templates asked for the
+        context, each other key is how many times that value was really loaded.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+
+lazy_context = LazyContextLoader()
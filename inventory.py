@@ -0,0 +1,369 @@
+"""
+Stock ledger.
+
+Every stock change is appended to `inventory_movement` as a signed delta
+with a reason: sales from place_order, returns when an order is cancelled,
+admin adjustments from the product form, imports for new products, and
+reserve/release pairs for checkout reservations. Movements are never
+updated or deleted, so the history of a product is a plain indexed range
+scan.
+
+Current stock is served from `stock_snapshot`:
+
+    stock = snapshot.quantity + SUM(delta of movements after snapshot.movement_id)
+
+`compact()` (run periodically: `python inventory.py compact`) folds the tail
+of movements into the snapshot and mirrors the result onto Product.stock_kg
+for listings and exports. Sales therefore only insert ledger rows; the
+product row is written once per compaction instead of once per order.
+
+Writers of a product's movements first lock its snapshot row (FOR UPDATE,
+in id order; on SQLite the write lock is taken up front), then read the
+level and append only if it covers the request, so concurrent checkouts can
+never oversell. If any line is short InsufficientStock is raised and the
+caller rolls back the whole transaction.
+
+Optionally (INVENTORY_RESERVATION_MINUTES > 0) checkout reserves the cart:
+a `reserve` movement holds the quantity and a StockReservation row records
+it with an expiry. place_order releases the user's reservations and takes
+the sale in the same transaction; expired reservations are released by
+`release_expired()`.
+
+Products without a snapshot row are untracked (never short).
+"""
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, update
+
+from extensions import db
+from models import InventoryMovement, Product, StockReservation, StockSnapshot
+
+SALE = 'sale'
+RETURN = 'return'
+ADJUSTMENT = 'adjustment'
+IMPORT = 'import'
+RESERVE = 'reserve'
+RELEASE = 'release'
+
+COMPACT_BATCH_SIZE = 500
+
+# Minutes a checkout reservation holds stock (0 = reservations off)
+_reservation_minutes = 0
+
+
+class InsufficientStock(Exception):
+    """Raised with the lines that could not be taken; the caller must roll back."""
+
+    def __init__(self, shortages):
+        # shortages: [(product_id, name, requested, available)]
+        self.shortages = shortages
+        product_id, name, requested, available = shortages[0]
+        super().__init__(f"Insufficient stock for {name}: requested {requested}, available {available}")
+
+    @property
+    def first(self):
+        return self.shortages[0]
+
+
+def _merge(lines):
+    """{product_id: quantity} from an iterable of (product_id, quantity), dropping non-positive totals."""
+    merged = {}
+    for product_id, quantity in lines:
+        merged[product_id] = merged.get(product_id, 0) + (quantity or 0)
+    return {pid: qty for pid, qty in merged.items() if qty > 0}
+
+
+def _lock(product_ids):
+    """Lock the snapshot rows of `product_ids` for the rest of the transaction."""
+    ids = sorted(product_ids)
+    if not ids:
+        return
+    if db.engine.dialect.name == 'sqlite':
+        # No row locks: a no-op write takes the database write lock now, before the levels are read
+        db.session.execute(
+            update(StockSnapshot).where(StockSnapshot.product_id.in_(ids))
+            .values(movement_id=StockSnapshot.movement_id)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        # In id order so two multi-line orders cannot deadlock each other
+        db.session.execute(
+            select(StockSnapshot.product_id).where(StockSnapshot.product_id.in_(ids))
+            .order_by(StockSnapshot.product_id).with_for_update()
+        )
+
+
+def _append(amounts, reason, reference=None, user_id=None, sign=1):
+    """Insert one movement per {product_id: quantity} entry."""
+    if not amounts:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(InventoryMovement), [
+        {'product_id': pid, 'delta': sign * qty, 'reason': reason,
+         'reference': reference, 'user_id': user_id, 'created_at': now}
+        for pid, qty in sorted(amounts.items())
+    ])
+
+
+def _take(lines, reason, reference=None, user_id=None, partial=False):
+    """
+    Append negative movements for {product_id: quantity} where stock covers
+    them. Returns the ids that were taken. With partial=False raises
+    InsufficientStock if any line could not be taken (nothing is appended).
+    """
+    if not lines:
+        return set()
+    _lock(lines)
+    levels = stock_levels(lines)
+    taken = {pid for pid, qty in lines.items() if pid not in levels or levels[pid] >= qty}
+
+    if len(taken) != len(lines) and not partial:
+        short = sorted(pid for pid in lines if pid not in taken)
+        names = dict(db.session.execute(select(Product.id, Product.name).where(Product.id.in_(short))).all())
+        raise InsufficientStock([(pid, names.get(pid, f'#{pid}'), lines[pid], levels[pid]) for pid in short])
+    _append({pid: lines[pid] for pid in taken}, reason, reference, user_id, sign=-1)
+    return taken
+
+
+def _delete_reservations(condition):
+    """Delete reservations matching `condition`; return {product_id: quantity} actually deleted."""
+    if db.engine.dialect.delete_returning:
+        rows = db.session.execute(
+            delete(StockReservation).where(condition)
+            .returning(StockReservation.product_id, StockReservation.quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+    else:
+        rows = db.session.execute(
+            select(StockReservation.id, StockReservation.product_id, StockReservation.quantity)
+            .where(condition).with_for_update()
+        ).all()
+        if rows:
+            db.session.execute(
+                delete(StockReservation).where(StockReservation.id.in_([r.id for r in rows]))
+                .execution_options(synchronize_session=False)
+            )
+    return _merge((row.product_id, row.quantity) for row in rows)
+
+
+def _release(condition, reference=None):
+    released = _delete_reservations(condition)
+    if released:
+        _lock(released)
+        _append(released, RELEASE, reference)
+    return released
+
+
+# =========================
+# Reading stock
+# =========================
+
+def stock_levels(product_ids):
+    """{product_id: current stock} for the tracked products among `product_ids`, in one query."""
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    tail = (
+        select(func.coalesce(func.sum(InventoryMovement.delta), 0))
+        .where(InventoryMovement.product_id == StockSnapshot.product_id,
+               InventoryMovement.id > StockSnapshot.movement_id)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        select(StockSnapshot.product_id, StockSnapshot.quantity + tail).where(StockSnapshot.product_id.in_(ids))
+    ).all()
+    return {pid: round(quantity, 3) for pid, quantity in rows}
+
+
+def stock_level(product_id):
+    """Current stock of one product, or None if it is untracked."""
+    return stock_levels([product_id]).get(product_id)
+
+
+def history(product_id, limit=100, before_id=None):
+    """A product's movements, newest first; pass the last id seen as `before_id` for the next page."""
+    query = InventoryMovement.query.filter(InventoryMovement.product_id == product_id)
+    if before_id:
+        query = query.filter(InventoryMovement.id < before_id)
+    return query.order_by(InventoryMovement.id.desc()).limit(limit).all()
+
+
+def stock_at(product_id, when):
+    """Stock of a product at a past moment: current level minus the movements since."""
+    current = stock_level(product_id)
+    if current is None:
+        return None
+    since = db.session.execute(
+        select(func.coalesce(func.sum(InventoryMovement.delta), 0))
+        .where(InventoryMovement.product_id == product_id, InventoryMovement.created_at > when)
+    ).scalar()
+    return round(current - since, 3)
+
+
+# =========================
+# Public API
+# =========================
+
+def reservations_enabled():
+    return _reservation_minutes > 0
+
+
+def commit_stock(user_id, lines, reference=None):
+    """
+    Take stock for an order. `lines` is an iterable of (product_id, quantity).
+    The user's reservations are released first, in the same transaction, so
+    reserved stock is available to the sale. Raises InsufficientStock (caller
+    rolls back, which also restores the reservations).
+    """
+    needed = _merge(lines)
+    _release(StockReservation.user_id == user_id, reference)
+    _take(needed, SALE, reference, user_id)
+
+
+def reserve_cart(user_id, lines, minutes=None):
+    """
+    Replace the user's reservations with the given cart lines. Lines that
+    cannot be reserved in full are skipped; their product ids are returned.
+    """
+    minutes = _reservation_minutes if minutes is None else minutes
+    release_for_user(user_id)
+    wanted = _merge(lines)
+    taken = _take(wanted, RESERVE, user_id=user_id, partial=True)
+    expires_at = datetime.utcnow() + timedelta(minutes=minutes)
+    db.session.add_all([
+        StockReservation(user_id=user_id, product_id=pid, quantity=wanted[pid], expires_at=expires_at)
+        for pid in sorted(taken)
+    ])
+    return [pid for pid in sorted(wanted) if pid not in taken]
+
+
+def release_for_user(user_id):
+    _release(StockReservation.user_id == user_id)
+
+
+def release_expired(now=None):
+    """Return stock held by expired reservations. Returns the number of products restocked."""
+    return len(_release(StockReservation.expires_at < (now or datetime.utcnow())))
+
+
+def record(lines, reason, reference=None, user_id=None):
+    """Append unconditional increases (returns, imports) for (product_id, quantity) lines."""
+    amounts = _merge(lines)
+    _lock(amounts)
+    _append(amounts, reason, reference, user_id)
+
+
+def take(lines, reason=SALE, reference=None, user_id=None):
+    """Append decreases for (product_id, quantity) lines; raises InsufficientStock if any is short."""
+    _take(_merge(lines), reason, reference, user_id)
+
+
+def set_stock(product, quantity, user_id=None, reason=ADJUSTMENT, reference=None):
+    """
+    Record the movement that brings `product` to `quantity` (a stock count
+    from the admin form). Starts tracking the product if it was untracked.
+    Returns the delta recorded.
+    """
+    _lock([product.id])
+    current = stock_level(product.id)
+    if current is None:
+        db.session.add(StockSnapshot(product_id=product.id, quantity=0, movement_id=0))
+        db.session.flush()
+        current = 0
+    delta = round(quantity - current, 3)
+    if delta:
+        _append({product.id: abs(delta)}, reason, reference, user_id, sign=1 if delta > 0 else -1)
+    product.stock_kg = product.stock_quantity = quantity
+    return delta
+
+
+def forget(product_ids):
+    """Stop tracking deleted products. Their movements stay in the ledger."""
+    if product_ids:
+        db.session.execute(
+            delete(StockSnapshot).where(StockSnapshot.product_id.in_(list(product_ids)))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def track_existing():
+    """Snapshot Product.stock_kg for products with stock and no snapshot yet (migration, bulk loads)."""
+    has_snapshot = select(StockSnapshot.product_id).where(StockSnapshot.product_id == Product.id).exists()
+    db.session.execute(
+        insert(StockSnapshot).from_select(
+            ['product_id', 'quantity', 'movement_id', 'updated_at'],
+            select(Product.id, Product.stock_kg, 0, func.now())
+            .where(Product.stock_kg.isnot(None), ~has_snapshot)
+        )
+    )
+
+
+def compact(batch_size=COMPACT_BATCH_SIZE):
+    """
+    Fold movements into the snapshots and mirror the levels onto
+    Product.stock_kg / stock_quantity. Commits per batch so checkouts are
+    only held up for one batch at a time. Returns the number of products
+    compacted.
+    """
+    pending = (
+        select(StockSnapshot.product_id)
+        .where(select(InventoryMovement.id)
+               .where(InventoryMovement.product_id == StockSnapshot.product_id,
+                      InventoryMovement.id > StockSnapshot.movement_id)
+               .exists())
+        .order_by(StockSnapshot.product_id)
+    )
+    ids = list(db.session.execute(pending).scalars())
+    db.session.commit()
+
+    tail = (
+        select(func.coalesce(func.sum(InventoryMovement.delta), 0))
+        .where(InventoryMovement.product_id == StockSnapshot.product_id,
+               InventoryMovement.id > StockSnapshot.movement_id)
+        .scalar_subquery()
+    )
+    last_id = (
+        select(func.coalesce(func.max(InventoryMovement.id), StockSnapshot.movement_id))
+        .where(InventoryMovement.product_id == StockSnapshot.product_id)
+        .scalar_subquery()
+    )
+    level = select(StockSnapshot.quantity).where(StockSnapshot.product_id == Product.id).scalar_subquery()
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        _lock(batch)
+        # Both SET expressions see the old movement_id
+        db.session.execute(
+            update(StockSnapshot)
+            .where(StockSnapshot.product_id.in_(batch))
+            .values(quantity=StockSnapshot.quantity + tail, movement_id=last_id, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Product).where(Product.id.in_(batch))
+            .values(stock_kg=level, stock_quantity=level)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    return len(ids)
+
+
+def init_app(app):
+    global _reservation_minutes
+    _reservation_minutes = app.config.get('INVENTORY_RESERVATION_MINUTES', 0)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'compact'
+    with app.app_context():
+        if command == 'compact':
+            print(f"Compacted {compact()} products")
+        elif command == 'release-expired':
+            released = release_expired()
+            db.session.commit()
+            print(f"Released reservations on {released} products")
+        else:
+            print(__doc__)
+            sys.exit(2)
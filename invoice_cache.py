@@ -0,0 +1,213 @@
+"""
+Content-addressed cache of invoice PDFs.
+
+An invoice is a function of the order (its columns and items) and of the
+store settings printed on it. Both are hashed; the PDF is stored on local
+disk as `<INVOICE_CACHE_DIR>/<settings hash>/<order hash>.pdf` and served
+with the two hashes as its ETag, so a repeat download is a file send (or a
+304) instead of a render. Any change to the order or to a printed setting
+gives a new key; directories for superseded settings are removed the first
+time a process sees the new settings hash.
+
+Files are written to a temporary name and renamed into place, so several
+workers may fill the cache at once. When the cache grows past
+INVOICE_CACHE_MAX_MB the least recently used files (by mtime, refreshed on
+every hit) are removed until it is back under 90% of the limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from flask import current_app, request, send_file
+from sqlalchemy import inspect
+
+# StoreSettings columns that appear on an invoice
+INVOICE_SETTINGS = (
+    'store_name', 'store_name_tamil', 'tagline', 'logo_url', 'address', 'phone', 'email', 'website',
+    'gst_number', 'bank_name', 'bank_account_name', 'bank_account_number', 'bank_ifsc',
+    'upi_id', 'upi_qr_image_url', 'invoice_header', 'invoice_prefix', 'invoice_footer',
+    'invoice_logo_url', 'invoice_logo_position', 'invoice_logo_size',
+    'invoice_upi_logo_url', 'invoice_upi_logo_position', 'invoice_upi_logo_size',
+)
+
+# Order columns that change without changing the invoice
+IGNORED_ORDER_COLUMNS = ('updated_at',)
+
+_config = {
+    'directory': 'invoice_cache',
+    'max_bytes': 200 * 1024 * 1024,
+}
+
+_lock = threading.Lock()
+_state = {
+    'size': None,          # bytes on disk, None until the first scan
+    'settings_key': None,  # settings hash this process last served
+}
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _columns(row, ignored=()):
+    return {attr.key: getattr(row, attr.key) for attr in inspect(row).mapper.column_attrs
+            if attr.key not in ignored}
+
+
+def settings_key(settings):
+    return _digest({name: getattr(settings, name, None) for name in INVOICE_SETTINGS})[:16]
+
+
+def order_key(order):
+    return _digest({
+        'order': _columns(order, IGNORED_ORDER_COLUMNS),
+        'items': sorted((_columns(item) for item in order.items), key=lambda item: item['id']),
+    })[:40]
+
+
+def cache_key(order, settings):
+    """(settings hash, order hash) of the invoice for `order` as printed with `settings`."""
+    return settings_key(settings), order_key(order)
+
+
+def _path(key):
+    return os.path.join(_config['directory'], key[0], f"{key[1]}.pdf")
+
+
+def etag(key):
+    return f"{key[0]}-{key[1]}"
+
+
+def _prune_settings(current):
+    """Remove the directories of invoices printed with other settings."""
+    try:
+        entries = list(os.scandir(_config['directory']))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir() and entry.name != current:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    with _lock:
+        _state['size'] = None
+
+
+def _note_settings(key):
+    with _lock:
+        changed = _state['settings_key'] != key[0]
+        _state['settings_key'] = key[0]
+    if changed:
+        _prune_settings(key[0])
+
+
+def lookup(key):
+    """Path of the cached PDF for `key`, or None. A hit counts as a use for eviction."""
+    path = _path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def store(key, data):
+    """Write the PDF bytes for `key` and return its path."""
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    with _lock:
+        if _state['size'] is not None:
+            _state['size'] += len(data)
+        over = _state['size'] is None or _state['size'] > _config['max_bytes']
+    if over:
+        evict()
+    return path
+
+
+def evict():
+    """Delete least recently used PDFs until the cache is under 90% of INVOICE_CACHE_MAX_MB."""
+    files = []
+    for root, _, names in os.walk(_config['directory']):
+        for name in names:
+            if name.endswith('.pdf'):
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    size = sum(f[1] for f in files)
+    if size > _config['max_bytes']:
+        target = _config['max_bytes'] * 0.9
+        for _, file_size, path in sorted(files):
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+    with _lock:
+        _state['size'] = size
+
+
+def render(order, settings):
+    """PDF bytes for `order` as printed with `settings` (see invoice_pdf.py)."""
+    from invoice_pdf import render_invoice
+
+    return render_invoice(order, settings)
+
+
+def _ensure(key, order, settings):
+    _note_settings(key)
+    path = lookup(key)
+    if path is None:
+        path = store(key, render(order, settings))
+    return path
+
+
+def invoice_path(order, settings=None):
+    """(path, key) of the invoice PDF for `order`, rendering it on a cache miss."""
+    from caching import get_store_settings
+
+    settings = settings or get_store_settings()
+    key = cache_key(order, settings)
+    return _ensure(key, order, settings), key
+
+
+def send_invoice(order, download_name):
+    """Response for an invoice download: 304 when the client has it, else the cached file."""
+    from caching import get_store_settings
+
+    settings = get_store_settings()
+    key = cache_key(order, settings)
+    if etag(key) in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag(key))
+        return response
+    for _ in range(2):
+        path = _ensure(key, order, settings)
+        try:
+            return send_file(path, mimetype='application/pdf', as_attachment=True,
+                             download_name=download_name, etag=etag(key), conditional=True, max_age=0)
+        except FileNotFoundError:
+            # Evicted between lookup and send; render it again
+            logging.info(f"Invoice {key[1]} evicted during send, re-rendering")
+    raise FileNotFoundError(f"Invoice for order {order.id} could not be cached")
+
+
+def init_app(app):
+    _config.update(
+        directory=app.config.get('INVOICE_CACHE_DIR') or os.path.join(app.instance_path, 'invoice_cache'),
+        max_bytes=int(app.config.get('INVOICE_CACHE_MAX_MB', 200)) * 1024 * 1024,
+    )
@@ -0,0 +1,272 @@
+"""
+Bulk invoice export.
+
+An admin queues an export (a created_at date range and/or an order status);
+the request only inserts an InvoiceExport row. A worker (the scheduler's
+`invoice_exports` job, or `python invoice_export.py run`) takes it with a
+lease, hashes every matching order (invoice_cache.cache_key) and renders
+only the invoices missing from the PDF cache, on INVOICE_EXPORT_PROCESSES
+worker processes so the web worker's threads are never competing with the
+renderer. `done` / `failed` out of `total` are committed about once a
+second; the admin orders page polls them until the export is ready.
+
+Nothing else renders exports: if every app process runs with
+SCHEDULER_ENABLED=false and `python scheduler.py` is not running, run
+`python invoice_export.py run` (e.g. from cron) or queued exports stay pending.
+
+The finished export keeps a manifest of cache keys. Downloading it streams
+a ZIP built on the fly from the cached files, one chunk at a time, so
+neither the archive nor a whole PDF is ever held in memory.
+
+    python invoice_export.py run        # render exports that are waiting, then exit
+    python invoice_export.py render 3   # render one export
+"""
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, time as day_time, timedelta
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import selectinload
+
+import invoice_cache
+from caching import SettingsSnapshot
+from extensions import db
+from models import InvoiceExport, Order
+
+LEASE_SECONDS = 300
+LOAD_BATCH = 200
+CHUNK_BYTES = 64 * 1024
+PROGRESS_SECONDS = 1.0
+
+_config = {
+    'processes': 2,
+}
+
+
+def matching_order_ids(export):
+    query = select(Order.id).order_by(Order.id)
+    if export.date_from:
+        query = query.where(Order.created_at >= datetime.combine(export.date_from, day_time.min))
+    if export.date_to:
+        query = query.where(Order.created_at < datetime.combine(export.date_to + timedelta(days=1), day_time.min))
+    if export.order_status:
+        query = query.where(Order.status == export.order_status)
+    return list(db.session.execute(query).scalars())
+
+
+def _file_name(order_number):
+    return f"invoice_{order_number}.pdf"
+
+
+def _claim(export_id, now):
+    """Take the export's lease; returns the lease value or None if another worker holds it."""
+    lease = now + timedelta(seconds=LEASE_SECONDS)
+    result = db.session.execute(
+        update(InvoiceExport)
+        .where(InvoiceExport.id == export_id, InvoiceExport.status.in_(['pending', 'rendering']),
+               or_(InvoiceExport.lease_until.is_(None), InvoiceExport.lease_until < now))
+        .values(status='rendering', lease_until=lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return lease if result.rowcount else None
+
+
+def _progress(export_id, lease, values):
+    """Store progress if we still hold the lease; returns the new lease or None."""
+    renewed = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    result = db.session.execute(
+        update(InvoiceExport)
+        .where(InvoiceExport.id == export_id, InvoiceExport.lease_until == lease)
+        .values({'lease_until': renewed, **values})
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return renewed if result.rowcount else None
+
+
+# =========================
+# Worker processes
+# =========================
+
+def _init_worker():
+    """Process pool initializer: an app context and a connection pool of this process's own."""
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+    from app import app
+
+    app.app_context().push()
+    # Connections inherited from the parent (fork) belong to the parent
+    db.engine.dispose(close=False)
+
+
+def _render_in_worker(order_id, settings_values):
+    """Render one invoice into the PDF cache; returns its key."""
+    try:
+        order = db.session.get(Order, order_id)
+        if order is None:
+            raise LookupError(f"Order {order_id} no longer exists")
+        settings = SettingsSnapshot(settings_values)
+        key = invoice_cache.cache_key(order, settings)
+        if invoice_cache.lookup(key) is None:
+            invoice_cache.store(key, invoice_cache.render(order, settings))
+        return key
+    finally:
+        db.session.rollback()
+
+
+# =========================
+# Rendering
+# =========================
+
+def render_export(export_id):
+    """
+    Fill the PDF cache for an export and store its manifest. Returns True
+    when it is finished, False if another worker holds it or the lease was lost.
+    """
+    from caching import get_store_settings
+
+    lease = _claim(export_id, datetime.utcnow())
+    if lease is None:
+        return False
+    export = db.session.get(InvoiceExport, export_id)
+    order_ids = matching_order_ids(export)
+    settings = get_store_settings()
+    lease = _progress(export_id, lease, {'total': len(order_ids), 'done': 0, 'failed': 0, 'error_message': None})
+
+    # Hash every order; only cache misses go to the pool
+    order_numbers = {}
+    keys = {}
+    missing = []
+    for start in range(0, len(order_ids), LOAD_BATCH):
+        orders = (Order.query.options(selectinload(Order.items))
+                  .filter(Order.id.in_(order_ids[start:start + LOAD_BATCH])).all())
+        for order in orders:
+            order_numbers[order.id] = order.order_number
+            key = invoice_cache.cache_key(order, settings)
+            if invoice_cache.lookup(key) is not None:
+                keys[order.id] = key
+            else:
+                missing.append(order.id)
+        db.session.commit()
+
+    failed = 0
+    first_error = None
+    if missing and lease is not None:
+        lease = _progress(export_id, lease, {'done': len(keys)})
+        settings_values = {name: getattr(settings, name, None) for name in invoice_cache.INVOICE_SETTINGS}
+        workers = max(1, min(_config['processes'], len(missing)))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(_render_in_worker, order_id, settings_values): order_id for order_id in missing}
+            reported = time.monotonic()
+            for future in as_completed(futures):
+                try:
+                    keys[futures[future]] = tuple(future.result())
+                except Exception as e:
+                    failed += 1
+                    first_error = first_error or f"Order {futures[future]}: {type(e).__name__}: {e}"
+                if time.monotonic() - reported >= PROGRESS_SECONDS:
+                    reported = time.monotonic()
+                    lease = _progress(export_id, lease, {'done': len(keys), 'failed': failed})
+                    if lease is None:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        break
+
+    if lease is None:
+        logging.warning(f"Invoice export {export_id}: lease lost, another worker continues")
+        return False
+
+    manifest = [[_file_name(order_numbers[order_id]), *keys[order_id], order_id] for order_id in sorted(keys)]
+    _progress(export_id, lease, {
+        'status': 'failed' if failed and not keys else 'ready',
+        'done': len(keys),
+        'failed': failed,
+        'manifest': json.dumps(manifest),
+        'error_message': first_error,
+        'finished_at': datetime.utcnow(),
+        'lease_until': None,
+    })
+    return True
+
+
+def run_pending():
+    """Render every export waiting whose lease is free. Returns the ids finished."""
+    now = datetime.utcnow()
+    ids = list(db.session.execute(
+        select(InvoiceExport.id)
+        .where(InvoiceExport.status.in_(['pending', 'rendering']),
+               or_(InvoiceExport.lease_until.is_(None), InvoiceExport.lease_until < now))
+        .order_by(InvoiceExport.id)
+    ).scalars())
+    db.session.commit()
+    return [export_id for export_id in ids if render_export(export_id)]
+
+
+# =========================
+# Download
+# =========================
+
+class _Chunks:
+    """Write-only, unseekable sink for zipfile; the generator drains it between writes."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def stream_zip(export):
+    """Generator of ZIP bytes for a ready export (run it under stream_with_context)."""
+    entries = json.loads(export.manifest or '[]')
+    out = _Chunks()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, settings_key, order_key, order_id in entries:
+            path = invoice_cache.lookup((settings_key, order_key))
+            if path is None:
+                # Evicted since the export was rendered: render the order as it is now
+                order = db.session.get(Order, order_id)
+                if order is None:
+                    continue
+                path, _ = invoice_cache.invoice_path(order)
+            with open(path, 'rb') as pdf, archive.open(name, 'w') as member:
+                while True:
+                    chunk = pdf.read(CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    member.write(chunk)
+                    yield out.take()
+            yield out.take()
+    yield out.take()
+
+
+def init_app(app):
+    _config.update(processes=max(1, app.config.get('INVOICE_EXPORT_PROCESSES', _config['processes'])))
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    with app.app_context():
+        if command == 'run':
+            print(f"Finished exports: {run_pending()}")
+        elif command == 'render' and len(sys.argv) > 2:
+            print('finished' if render_export(int(sys.argv[2])) else 'not finished (held by another worker?)')
+        else:
+            print(__doc__)
+            sys.exit(2)
@@ -0,0 +1,177 @@
+"""
+Invoice PDF rendering (reportlab).
+
+`render_invoice(order, settings)` returns the PDF bytes for an order: the
+store header from StoreSettings, the bill-to address, one table row per
+OrderItem with its GST, the order totals, bank / UPI payment details and
+the invoice footer. Only settings listed in invoice_cache.INVOICE_SETTINGS
+are printed, so the cache key covers everything on the page. Logos are
+drawn when their URL points into the app's static folder; remote images
+are never fetched while rendering.
+
+Amounts are computed in paise with the pricing helpers (money.py), so the
+lines add up to the stored order totals. The built-in PDF fonts have no
+Tamil glyphs, so the invoice prints the English names.
+
+The output is byte-for-byte reproducible (reportlab's invariant mode), so
+rendering the same order twice gives the same file.
+"""
+import io
+import os
+
+from flask import current_app
+
+from money import format_rupees, line_paise, percent_paise, to_paise
+
+PAGE_MARGIN_MM = 15
+
+
+def _require_reportlab():
+    try:
+        import reportlab  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError('Invoice PDFs need reportlab: pip install -r requirements.txt') from e
+
+
+def _money(paise):
+    # The standard PDF fonts have no rupee sign
+    return format_rupees(paise).replace('₹', 'Rs. ')
+
+
+def _static_image(url, size):
+    """A flowable for a logo served from the static folder, or None."""
+    from reportlab.platypus import Image
+
+    if not url or not url.startswith('/static/'):
+        return None
+    path = os.path.join(current_app.static_folder or '', url[len('/static/'):])
+    if not os.path.isfile(path):
+        return None
+    try:
+        image = Image(path)
+    except Exception:
+        return None
+    scale = size / max(image.imageWidth, image.imageHeight, 1)
+    image.drawWidth, image.drawHeight = image.imageWidth * scale, image.imageHeight * scale
+    return image
+
+
+def _invoice_number(order, settings):
+    return f"{getattr(settings, 'invoice_prefix', None) or 'INV'}-{order.order_number}"
+
+
+def render_invoice(order, settings):
+    """PDF bytes of the invoice for `order` as printed with `settings`."""
+    _require_reportlab()
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    from xml.sax.saxutils import escape
+
+    def setting(name):
+        return getattr(settings, name, None) or ''
+
+    styles = getSampleStyleSheet()
+    body, small = styles['BodyText'], styles['Normal']
+
+    def para(text, style=body):
+        return Paragraph(escape(str(text)).replace('\n', '<br/>'), style)
+
+    story = []
+
+    # Store header
+    logo = _static_image(setting('invoice_logo_url') or setting('logo_url'),
+                         (getattr(settings, 'invoice_logo_size', None) or 80) * 0.75)
+    store_lines = [setting('store_name') or 'Invoice', setting('tagline'), setting('address'),
+                   ' | '.join(filter(None, [setting('phone'), setting('email'), setting('website')]))]
+    if setting('gst_number'):
+        store_lines.append(f"GSTIN: {setting('gst_number')}")
+    header = [para(line) for line in store_lines[1:] if line]
+    header.insert(0, Paragraph(escape(store_lines[0]), styles['Title']))
+    if logo is not None:
+        right = setting('invoice_logo_position') == 'right'
+        cells = [header, logo] if right else [logo, header]
+        widths = [None, logo.drawWidth + 4 * mm] if right else [logo.drawWidth + 4 * mm, None]
+        story.append(Table([cells], colWidths=widths, style=[('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+    else:
+        story.extend(header)
+    if setting('invoice_header'):
+        story.append(para(setting('invoice_header')))
+    story.append(Spacer(1, 6 * mm))
+
+    # Invoice and customer details
+    placed = order.created_at.strftime('%d %b %Y') if order.created_at else ''
+    details = [
+        [para(f"Invoice: {_invoice_number(order, settings)}"), para('Bill to:')],
+        [para(f"Order: {order.order_number}"), para(order.delivery_name)],
+        [para(f"Date: {placed}"), para(order.delivery_address)],
+        [para(f"Payment: {(order.payment_method or '').upper()} ({order.payment_status or 'pending'})"),
+         para(f"{order.delivery_city}, {order.delivery_state} {order.delivery_pincode}")],
+        ['', para(f"Phone: {order.delivery_phone}")],
+    ]
+    story.append(Table(details, colWidths=['50%', '50%'], style=[('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+    story.append(Spacer(1, 6 * mm))
+
+    # Items
+    rows = [['#', 'Item', 'SKU', 'Qty', 'Price', 'GST', 'Amount']]
+    for n, item in enumerate(sorted(order.items, key=lambda item: item.id), 1):
+        price = to_paise(item.price or 0)
+        amount = line_paise(price, item.quantity or 0)
+        gst = percent_paise(amount, item.gst_rate or 0)
+        quantity = f"{item.quantity:g} {item.unit or ''}".strip()
+        rows.append([str(n), para(item.product_name, small), item.product_sku or '', quantity, _money(price),
+                     f"{item.gst_rate or 0:g}% {_money(gst)}", _money(amount)])
+    items = Table(rows, repeatRows=1, colWidths=[8 * mm, None, 22 * mm, 20 * mm, 24 * mm, 30 * mm, 26 * mm])
+    items.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8f5e8')),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    story.append(items)
+    story.append(Spacer(1, 4 * mm))
+
+    # Totals, as stored on the order
+    totals = [
+        ['Subtotal', _money(to_paise(order.subtotal or 0))],
+        ['GST', _money(to_paise(order.gst_amount or 0))],
+        ['Delivery', _money(to_paise(order.delivery_charge or 0))],
+        ['Total', _money(to_paise(order.total_amount or 0))],
+    ]
+    story.append(Table(totals, colWidths=[40 * mm, 30 * mm], hAlign='RIGHT', style=[
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('LINEABOVE', (0, -1), (-1, -1), 0.5, colors.black),
+    ]))
+    story.append(Spacer(1, 8 * mm))
+
+    # Payment details
+    payment = []
+    if setting('bank_account_number'):
+        payment += [f"Bank: {setting('bank_name')}", f"Account name: {setting('bank_account_name')}",
+                    f"Account number: {setting('bank_account_number')}", f"IFSC: {setting('bank_ifsc')}"]
+    if setting('upi_id'):
+        payment.append(f"UPI: {setting('upi_id')}")
+    if payment:
+        story.append(Paragraph('Payment details', styles['Heading4']))
+        story.extend(para(line, small) for line in payment)
+    upi_logo = _static_image(setting('invoice_upi_logo_url') or setting('upi_qr_image_url'),
+                             (getattr(settings, 'invoice_upi_logo_size', None) or 150) * 0.75)
+    if upi_logo is not None:
+        upi_logo.hAlign = {'left': 'LEFT', 'right': 'RIGHT'}.get(setting('invoice_upi_logo_position'), 'CENTER')
+        story.append(upi_logo)
+
+    if setting('invoice_footer'):
+        story.append(Spacer(1, 8 * mm))
+        story.append(para(setting('invoice_footer'), small))
+
+    buffer = io.BytesIO()
+    margin = PAGE_MARGIN_MM * mm
+    document = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=margin, rightMargin=margin, topMargin=margin,
+                                 bottomMargin=margin, title=_invoice_number(order, settings), invariant=1)
+    document.build(story)
+    return buffer.getvalue()
@@ -0,0 +1,88 @@
+"""
+Batched SMTP delivery.
+
+`deliver()` sends a batch of messages through one SMTP connection
+(Flask-Mail's `mail.connect()`), so the batch pays for the TCP/TLS handshake
+and login once instead of once per message; MAIL_MAX_EMAILS still rotates
+the connection for servers that cap messages per session. A rejected
+message only fails itself. If the server drops the connection, the batch
+reconnects and resumes from the message that was interrupted.
+
+Subjects and bodies are Jinja templates compiled once per source string
+(`render()`); a broadcast renders its body once, not once per recipient.
+
+Nothing here should run on a request thread: the notification worker
+(notifications.py) calls `deliver()`. Point MAIL_SERVER / MAIL_PORT at a
+local stand-in (e.g. `python -m aiosmtpd -n -l 127.0.0.1:8025`) to try it.
+"""
+import smtplib
+from collections import namedtuple
+from functools import lru_cache
+
+from flask_mail import Message
+from jinja2.sandbox import SandboxedEnvironment
+
+from extensions import mail
+
+# One message; `id` is the caller's key in the result of deliver()
+OutgoingMail = namedtuple('OutgoingMail', 'id recipient subject text html', defaults=(None,))
+
+# Errors after which the SMTP session is unusable (rejections of a single message are SMTPResponseException)
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+MAX_RECONNECTS = 2
+
+# Sandboxed: campaign subjects and bodies are written by admins in the browser
+_text_env = SandboxedEnvironment(autoescape=False, keep_trailing_newline=True)
+_html_env = SandboxedEnvironment(autoescape=True, keep_trailing_newline=True)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source, html=False):
+    return (_html_env if html else _text_env).from_string(source)
+
+
+def render(source, html=False, **context):
+    """Render a template string; the compiled template is cached by source."""
+    if not source:
+        return source
+    return compile_template(source, html).render(**context)
+
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+def deliver(messages):
+    """
+    Send OutgoingMail items over one SMTP connection (reconnecting at most
+    MAX_RECONNECTS times). Returns {id: None if sent, else the error text}.
+    Needs an app context.
+    """
+    messages = list(messages)
+    results = {}
+    position = 0
+    reconnects = 0
+    while position < len(messages):
+        try:
+            with mail.connect() as conn:
+                while position < len(messages):
+                    item = messages[position]
+                    try:
+                        conn.send(Message(item.subject or '', recipients=[item.recipient],
+                                          body=item.text or '', html=item.html))
+                        results[item.id] = None
+                    except _CONNECTION_ERRORS:
+                        raise
+                    except Exception as e:
+                        results[item.id] = _error(e)
+                    position += 1
+        except Exception as e:
+            if position >= len(messages):
+                break  # everything was handed over; only QUIT failed
+            if isinstance(e, _CONNECTION_ERRORS) and reconnects < MAX_RECONNECTS:
+                reconnects += 1
+                continue
+            for item in messages[position:]:
+                results[item.id] = _error(e)
+            break
+    return results
@@ -0,0 +1,310 @@
+"""
+Versioned schema migrations.
+
+`db.create_all()` only creates missing tables; it never adds indexes or
+columns to tables that already exist. Each migration here is a numbered
+step recorded in the `schema_version` table, so existing SQLite and Postgres
+databases are brought up to the current models exactly once. A database
+created from scratch by `create_all()` already matches the models and is
+simply stamped with the latest version.
+
+    python migrations.py upgrade   # apply pending steps
+    python migrations.py current   # print the applied version
+    python migrations.py check     # EXPLAIN the hot queries, report index use
+"""
+import logging
+import sys
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, inspect
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+
+_meta = MetaData()
+
+schema_version = Table(
+    'schema_version', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200)),
+    Column('applied_at', DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration step. Steps run in version order inside one transaction each."""
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _create_indexes(*models):
+    """Create the models' missing indexes, except those on columns a later step adds."""
+    conn = db.session.connection()
+    for model in models:
+        existing = {c['name'] for c in inspect(conn).get_columns(model.__table__.name)}
+        for index in model.__table__.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+@migration(1, 'Composite indexes for hot query shapes')
+def _hot_path_indexes():
+    from models import User, Address, Product, CartItem, Order, OrderItem
+    _create_indexes(User, Address, Product, CartItem, Order, OrderItem)
+
+
+# Frozen copies of cart_summary.rebuild_cart_summaries() for the schema each
+# step runs against; the live function assumes the current (paise) schema.
+_CART_SUMMARY_BACKFILL = (
+    "INSERT INTO cart_summary (user_id, item_count, subtotal, version, updated_at) "
+    "SELECT cart_item.user_id, COUNT(cart_item.id), SUM({line_total}), 1, CURRENT_TIMESTAMP "
+    "FROM cart_item JOIN product ON product.id = cart_item.product_id "
+    "GROUP BY cart_item.user_id"
+)
+
+
+def _backfill_cart_summary_table(line_total):
+    conn = db.session.connection()
+    conn.exec_driver_sql("DELETE FROM cart_summary")
+    conn.exec_driver_sql(_CART_SUMMARY_BACKFILL.format(line_total=line_total))
+
+
+@migration(2, 'Backfill cart summaries')
+def _backfill_cart_summaries():
+    # Prices are still float rupees here
+    _backfill_cart_summary_table('ROUND(cart_item.quantity * product.price, 2)')
+
+
+# Columns converted from float rupees to integer paise (money.Money)
+MONEY_COLUMNS = [
+    ('product', 'price'),
+    ('order', 'subtotal'),
+    ('order', 'gst_amount'),
+    ('order', 'delivery_charge'),
+    ('order', 'total_amount'),
+    ('order_item', 'price'),
+    ('cart_summary', 'subtotal'),
+]
+
+
+@migration(3, 'Store money columns as integer paise')
+def _money_to_paise():
+    conn = db.session.connection()
+    quote = conn.dialect.identifier_preparer.quote
+    inspector = inspect(conn)
+    for table, column in MONEY_COLUMNS:
+        declared = {c['name']: c['type'] for c in inspector.get_columns(table)}
+        if isinstance(declared.get(column), Integer):
+            # Created by create_all() from the Money models: already paise
+            continue
+        t, c = quote(table), quote(column)
+        if conn.dialect.name == 'postgresql':
+            conn.exec_driver_sql(f"ALTER TABLE {t} ALTER COLUMN {c} TYPE BIGINT USING ROUND({c} * 100)::bigint")
+        else:
+            conn.exec_driver_sql(f"UPDATE {t} SET {c} = CAST(ROUND({c} * 100) AS INTEGER) WHERE {c} IS NOT NULL")
+    # Summaries are derived data: recompute them from the converted prices
+    _backfill_cart_summary_table('ROUND(cart_item.quantity * product.price)')
+
+
+@migration(4, 'Inventory ledger: snapshot current stock')
+def _snapshot_stock():
+    import inventory
+    inventory.track_existing()
+
+
+def _rebuild_sqlite_table(model):
+    """
+    Recreate a table from its model, copying the rows (SQLite cannot alter
+    column constraints in place). Columns missing from the old table get
+    their server defaults or NULL.
+    """
+    conn = db.session.connection()
+    table = model.__table__
+    quote = conn.dialect.identifier_preparer.quote
+    inspector = inspect(conn)
+    old_columns = {c['name'] for c in inspector.get_columns(table.name)}
+    for index in inspector.get_indexes(table.name):
+        conn.exec_driver_sql(f"DROP INDEX {quote(index['name'])}")
+    old_name = f"{table.name}__old"
+    conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(old_name)}")
+    table.create(conn)
+    columns = ', '.join(quote(c.name) for c in table.columns if c.name in old_columns)
+    conn.exec_driver_sql(
+        f"INSERT INTO {quote(table.name)} ({columns}) SELECT {columns} FROM {quote(old_name)}")
+    conn.exec_driver_sql(f"DROP TABLE {quote(old_name)}")
+
+
+@migration(5, 'Notification outbox: nullable order, retry columns')
+def _notification_outbox():
+    from models import NotificationLog
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(NotificationLog)
+    else:
+        conn.exec_driver_sql('ALTER TABLE notification_log ALTER COLUMN order_id DROP NOT NULL')
+        conn.exec_driver_sql('ALTER TABLE notification_log ADD COLUMN attempts INTEGER DEFAULT 0')
+        conn.exec_driver_sql('ALTER TABLE notification_log ADD COLUMN next_attempt_at TIMESTAMP')
+        _create_indexes(NotificationLog)
+    conn.exec_driver_sql("UPDATE notification_log SET attempts = 0 WHERE attempts IS NULL")
+
+
+def _add_columns(model, *names):
+    """ALTER TABLE .. ADD COLUMN for model columns missing from an existing table."""
+    conn = db.session.connection()
+    table = model.__table__
+    quote = conn.dialect.identifier_preparer.quote
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        conn.exec_driver_sql(
+            f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(name)} {column.type.compile(conn.dialect)}")
+
+
+@migration(6, 'Campaign delivery progress columns')
+def _campaign_progress():
+    from models import Campaign
+    _add_columns(Campaign, 'failed_count', 'last_recipient_id', 'lease_until')
+    db.session.execute(db.text(
+        "UPDATE campaign SET failed_count = 0, last_recipient_id = 0 WHERE last_recipient_id IS NULL"))
+
+
+@migration(7, 'Index for due scheduled campaigns')
+def _campaign_schedule_index():
+    from models import Campaign
+    _create_indexes(Campaign)
+
+
+@migration(8, 'Backfill customer activity for segments')
+def _backfill_customer_activity():
+    from segments import rebuild_customer_activity
+    rebuild_customer_activity()
+
+
+@migration(9, 'User updated_at for segment catch-up')
+def _user_updated_at():
+    from models import User
+    _add_columns(User, 'updated_at')
+    conn = db.session.connection()
+    user = conn.dialect.identifier_preparer.quote('user')
+    conn.exec_driver_sql(f"UPDATE {user} SET updated_at = created_at WHERE updated_at IS NULL")
+    _create_indexes(User)
+
+
+@migration(10, 'HTML body for outbox emails')
+def _notification_html():
+    from models import NotificationLog
+    _add_columns(NotificationLog, 'html_message')
+
+
+def current_version():
+    schema_version.create(db.engine, checkfirst=True)
+    return db.session.execute(select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def _record(version, description):
+    db.session.execute(schema_version.insert().values(
+        version=version, description=description, applied_at=datetime.utcnow()))
+
+
+def upgrade(fresh=False):
+    """
+    Apply pending migrations. With `fresh=True` (tables were just created by
+    create_all) nothing is run and every step is recorded as applied.
+    """
+    applied = current_version()
+    for version, description, fn in MIGRATIONS:
+        if version <= applied:
+            continue
+        try:
+            if not fresh:
+                logging.info(f"Applying migration {version}: {description}")
+                fn()
+            _record(version, description)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker applied the same step concurrently
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def is_fresh_database():
+    """True before create_all() on an empty database."""
+    from models import User
+    return not inspect(db.engine).has_table(User.__tablename__)
+
+
+# =========================
+# Query plan check
+# =========================
+
+def hot_queries():
+    """(name, expected index, statement) for the query shapes the indexes exist for."""
+    from models import Address, Product, CartItem, Order, OrderItem, InventoryMovement
+    return [
+        ('orders by user', 'ix_order_user_id_created_at',
+         select(Order.id).where(Order.user_id == 1).order_by(Order.created_at.desc())),
+        ('orders by status', 'ix_order_status_created_at',
+         select(Order.id).where(Order.status == 'pending').order_by(Order.created_at.desc())),
+        ('cart line lookup', 'ix_cart_item_user_id_product_id',
+         select(CartItem.id).where(CartItem.user_id == 1, CartItem.product_id == 1)),
+        ('active products in category', 'ix_product_is_active_category_id',
+         select(Product.id).where(Product.is_active.is_(True), Product.category_id == 1)),
+        ('featured products', 'ix_product_is_active_is_featured',
+         select(Product.id).where(Product.is_active.is_(True), Product.is_featured.is_(True))),
+        ('default address', 'ix_address_user_id_is_default',
+         select(Address.id).where(Address.user_id == 1, Address.is_default.is_(True))),
+        ('order items', 'ix_order_item_order_id',
+         select(OrderItem.id).where(OrderItem.order_id == 1)),
+        ('stock ledger tail', 'ix_inventory_movement_product_id_id',
+         select(InventoryMovement.delta).where(InventoryMovement.product_id == 1, InventoryMovement.id > 0)),
+    ]
+
+
+def explain(statement):
+    """Plan text for a statement: EXPLAIN QUERY PLAN on SQLite, EXPLAIN elsewhere."""
+    dialect = db.engine.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(db.text(prefix + sql)).fetchall()
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def check_query_plans():
+    """[(name, expected index, uses index?, plan)] for every hot query."""
+    results = []
+    for name, index_name, statement in hot_queries():
+        plan = explain(statement)
+        results.append((name, index_name, index_name in plan, plan))
+    return results
+
+
+if __name__ == '__main__':
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            upgrade()
+            print(f"Schema at version {current_version()}")
+        elif command == 'current':
+            print(current_version())
+        elif command == 'check':
+            failures = 0
+            for name, index_name, used, plan in check_query_plans():
+                failures += not used
+                print(f"[{'ok' if used else 'MISSING'}] {name}: expected {index_name}")
+                if not used:
+                    print('    ' + plan.replace('\n', '\n    '))
+            sys.exit(1 if failures else 0)
+        else:
+            print(__doc__)
+            sys.exit(2)
@@ -1,9 +1,8 @@
 from extensions import db
+from money import Money
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-import string
-import random
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,6 +15,12 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), default='customer')  # customer, storekeeper, admin
     _is_active = db.Column('is_active', db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # segment catch-up
+
+    __table_args__ = (
+        db.Index('ix_user_created_at_id', 'created_at', 'id'),
+        db.Index('ix_user_updated_at', 'updated_at'),
+    )
     
     @property
     def is_active(self):
@@ -61,6 +66,10 @@ class Address(db.Model):
     is_default = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_address_user_id_is_default', 'user_id', 'is_default'),
+    )
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -81,7 +90,7 @@ class Product(db.Model):
     description = db.Column(db.Text)
     description_tamil = db.Column(db.Text)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
-    price = db.Column(db.Float, nullable=False)  # Price per kg
+    price = db.Column(Money, nullable=False)  # Price per kg
     stock_kg = db.Column(db.Float, default=100.0)  # Stock in kg
     min_quantity_kg = db.Column(db.Float, default=0.25)  # Minimum 250g
     max_quantity_kg = db.Column(db.Float, default=5.0)   # Maximum 5kg
@@ -98,21 +107,35 @@ class Product(db.Model):
     gst_rate = db.Column(db.Float, default=0)  # GST percentage
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_product_is_active_category_id', 'is_active', 'category_id'),
+        db.Index('ix_product_is_active_is_featured', 'is_active', 'is_featured'),
+        db.Index('ix_product_created_at_id', 'created_at', 'id'),
+    )
     
     def generate_sku(self):
         """Generate unique SKU for product"""
+        return Product.allocate_skus(self.category_id, 1)[0]
+
+    @staticmethod
+    def sku_prefix(category):
         prefix = 'THV'
-        category = Category.query.get(self.category_id)
         if category:
             cat_code = ''.join([c.upper() for c in category.name.split()[:2]])[:3]
             prefix += cat_code
-        
-        # Generate random number
-        while True:
-            random_num = ''.join(random.choices(string.digits, k=4))
-            sku = f"{prefix}{random_num}"
-            if not Product.query.filter_by(sku=sku).first():
-                return sku
+        return prefix
+
+    @staticmethod
+    def allocate_skus(category_id, count, category=None):
+        """`count` unique SKUs for products in a category, from one sequence reservation"""
+        import sequences
+
+        if category is None and category_id is not None:
+            category = db.session.get(Category, category_id)
+        prefix = Product.sku_prefix(category)
+        values = sequences.allocate(f'sku:{prefix}', count, start=sequences.next_after(Product.sku, prefix))
+        return [f"{prefix}{value:04d}" for value in values]
 
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -125,16 +148,36 @@ class CartItem(db.Model):
     user = db.relationship('User', backref='cart_items')
     product = db.relationship('Product', backref='cart_items')
 
+    __table_args__ = (
+        db.Index('ix_cart_item_user_id_product_id', 'user_id', 'product_id'),
+    )
+
+class CartSummary(db.Model):
+    """Denormalized per-user cart totals, kept in step with CartItem writes (see cart_summary.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    subtotal = db.Column(Money, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CustomerActivity(db.Model):
+    """Per-customer order history summary, kept in step with order placement (see segments.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    first_order_at = db.Column(db.DateTime)
+    last_order_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(20), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
     # Order details
-    subtotal = db.Column(db.Float, nullable=False)
-    gst_amount = db.Column(db.Float, default=0)
-    delivery_charge = db.Column(db.Float, default=0)
-    total_amount = db.Column(db.Float, nullable=False)
+    subtotal = db.Column(Money, nullable=False)
+    gst_amount = db.Column(Money, default=0)
+    delivery_charge = db.Column(Money, default=0)
+    total_amount = db.Column(Money, nullable=False)
     
     # Delivery details
     delivery_name = db.Column(db.String(100), nullable=False)
@@ -164,17 +207,23 @@ class Order(db.Model):
     
     # Relationships
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_order_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+        db.Index('ix_order_created_at_id', 'created_at', 'id'),
+    )
     
     def generate_order_number(self):
-        """Generate unique order number"""
+        """Generate unique order number from the day's sequence"""
+        import sequences
+
         prefix = 'THV'
         date_str = datetime.now().strftime('%Y%m%d')
-        
-        # Get count of orders today
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_count = Order.query.filter(Order.created_at >= today_start).count()
-        
-        return f"{prefix}{date_str}{today_count + 1:04d}"
+        seq = sequences.next_value(
+            f'order:{date_str}', start=sequences.next_after(Order.order_number, prefix + date_str))
+
+        return f"{prefix}{date_str}{seq:04d}"
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -185,13 +234,17 @@ class OrderItem(db.Model):
     product_name = db.Column(db.String(200), nullable=False)
     product_name_tamil = db.Column(db.String(200))
     product_sku = db.Column(db.String(20))
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(Money, nullable=False)
     quantity = db.Column(db.Float, nullable=False)
     unit = db.Column(db.String(50))
     gst_rate = db.Column(db.Float, default=0)
     
     product = db.relationship('Product', backref='order_items')
 
+    __table_args__ = (
+        db.Index('ix_order_item_order_id', 'order_id'),
+    )
+
 class StoreSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     
@@ -278,9 +331,12 @@ class Campaign(db.Model):
     target_audience = db.Column(db.String(50), nullable=False)
     subject = db.Column(db.String(200))
     message = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(20), default='draft')  # draft, sent, scheduled
+    status = db.Column(db.String(20), default='draft')  # draft, scheduled, sending, sent, failed
     recipients_count = db.Column(db.Integer, default=0)
     sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    last_recipient_id = db.Column(db.Integer, default=0)  # delivery checkpoint (campaigns.py)
+    lease_until = db.Column(db.DateTime)  # held by the worker sending it
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     scheduled_time = db.Column(db.DateTime)
     sent_at = db.Column(db.DateTime)
@@ -295,16 +351,126 @@ class Campaign(db.Model):
     
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_campaign_status_scheduled_time', 'status', 'scheduled_time'),
+    )
+
 class NotificationLog(db.Model):
+    """Notification outbox: rows are written with the change that triggers them and sent by notifications.py"""
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))  # NULL for notifications not about an order
     notification_type = db.Column(db.String(20), nullable=False)  # email, whatsapp
     recipient = db.Column(db.String(120), nullable=False)
     subject = db.Column(db.String(200))
     message = db.Column(db.Text)
+    html_message = db.Column(db.Text)  # HTML alternative for emails
     status = db.Column(db.String(20), default='pending')  # pending, sent, failed
     error_message = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)  # retry time, or lease expiry while a worker is sending
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     sent_at = db.Column(db.DateTime)
     
     order = db.relationship('Order', backref='notifications')
+
+    __table_args__ = (
+        db.Index('ix_notification_log_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+class SlowQueryLog(db.Model):
+    """Statements that exceeded SLOW_QUERY_MS, written by sql_instrumentation"""
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(40), nullable=False)  # sha1 of the normalized statement shape
+    statement = db.Column(db.Text, nullable=False)
+    params_shape = db.Column(db.String(255))
+    endpoint = db.Column(db.String(100))
+    duration_ms = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_slow_query_log_fingerprint_created_at', 'fingerprint', 'created_at'),
+        db.Index('ix_slow_query_log_created_at', 'created_at'),
+    )
+
+class StockReservation(db.Model):
+    """Stock held for a user's cart between checkout and place_order (see inventory.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_stock_reservation_user_id', 'user_id'),
+        db.Index('ix_stock_reservation_expires_at', 'expires_at'),
+    )
+
+class InventoryMovement(db.Model):
+    """Append-only stock ledger. Current stock = StockSnapshot.quantity + later movements (see inventory.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)  # no FK: history outlives deleted products
+    delta = db.Column(db.Float, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # sale, return, adjustment, import, reserve, release
+    reference = db.Column(db.String(50))  # e.g. order number
+    user_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_inventory_movement_product_id_id', 'product_id', 'id'),
+    )
+
+class StockSnapshot(db.Model):
+    """Compacted stock per product: the sum of all movements up to movement_id"""
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0)
+    movement_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SequenceCounter(db.Model):
+    """Next free value of a named sequence, handed out in blocks (see sequences.py)"""
+    name = db.Column(db.String(100), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ScheduledJob(db.Model):
+    """Durable state of a periodic job; rows are claimed with a lease (see scheduler.py)"""
+    name = db.Column(db.String(100), primary_key=True)
+    interval_seconds = db.Column(db.Integer, nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=False, index=True)
+    lease_until = db.Column(db.DateTime)
+    leased_by = db.Column(db.String(100))
+    last_started_at = db.Column(db.DateTime)
+    last_finished_at = db.Column(db.DateTime)
+    last_status = db.Column(db.String(20))  # ok, error
+    last_error = db.Column(db.Text)
+    run_count = db.Column(db.Integer, default=0)
+
+class DailySales(db.Model):
+    """Per-day order rollup maintained by stats.rollup()"""
+    day = db.Column(db.Date, primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    paid_orders_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(Money, nullable=False, default=0)  # paid orders
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class InvoiceExport(db.Model):
+    """Bulk invoice download, rendered in the background by invoice_export.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    date_from = db.Column(db.Date)
+    date_to = db.Column(db.Date)  # inclusive
+    order_status = db.Column(db.String(20))  # None: any status
+    status = db.Column(db.String(20), default='pending')  # pending, rendering, ready, failed
+    total = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    manifest = db.Column(db.Text)  # JSON [[file name, settings hash, order hash, order id], ...]
+    error_message = db.Column(db.Text)
+    lease_until = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_invoice_export_status', 'status'),
+    )
@@ -0,0 +1,75 @@
+"""
+Fixed-point money stored as integer paise.
+
+`Money` is a column type: the database holds whole paise in a BIGINT, Python
+code keeps seeing rupees as floats (so templates, forms and JSON are
+unchanged). SQL arithmetic and aggregates on Money columns (SUM, +, -) run
+on exact integers; results typed as Money come back as rupees.
+
+Totals that are built in Python should be computed on paise with the helpers
+below and converted once at the end, instead of summing floats.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from math import floor
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+_ONE = Decimal(1)
+
+
+def to_paise(rupees):
+    """Rupees (float, int, Decimal or numeric string) to whole paise, rounding half up."""
+    if rupees is None:
+        return None
+    if isinstance(rupees, float):
+        rupees = repr(rupees)
+    return int((Decimal(rupees) * 100).quantize(_ONE, rounding=ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    """Whole paise to rupees as a float (exact to two decimals)."""
+    if paise is None:
+        return None
+    return int(round(paise)) / 100
+
+
+def round_half_up(value):
+    """Round an amount in paise to a whole paisa, halves away from zero (refunds mirror charges)."""
+    return int(floor(value + 0.5)) if value >= 0 else -int(floor(-value + 0.5))
+
+
+def line_paise(price_paise, quantity):
+    """Line total in paise for a unit price in paise and a (possibly fractional) quantity."""
+    return round_half_up(price_paise * quantity)
+
+
+def percent_paise(paise, rate):
+    """`rate` percent of an amount in paise (e.g. GST on a line), rounded to a paisa."""
+    return round_half_up(paise * rate / 100)
+
+
+def line_total(price, quantity):
+    """Line total in rupees, computed on paise (same rounding as the pricing engine)."""
+    return from_paise(line_paise(to_paise(price), quantity))
+
+
+def format_rupees(paise):
+    return f"₹{paise // 100:,}.{paise % 100:02d}" if paise >= 0 else '-' + format_rupees(-paise)
+
+
+class Money(TypeDecorator):
+    """Rupee amount stored as integer paise."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_paise(value)
+
+    def process_result_value(self, value, dialect):
+        return from_paise(value)
+
+    @property
+    def python_type(self):
+        return float
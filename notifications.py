@@ -0,0 +1,398 @@
+"""
+Notification outbox.
+
+Routes never talk to mail or WhatsApp providers. They call the `queue_*`
+helpers, which add NotificationLog rows to the current session, so a
+notification is stored if and only if the order or address change that
+caused it commits. Checkout latency no longer depends on SMTP.
+
+A separate worker drains the outbox:
+
+    python notifications.py worker          # poll forever
+    python notifications.py worker --once   # send what is due, then exit
+
+Each pass claims up to NOTIFICATION_BATCH_SIZE due rows by pushing their
+`next_attempt_at` forward by a lease (so other workers skip them), sends
+them on NOTIFICATION_CONCURRENCY threads (emails in batches sharing one
+SMTP connection per thread, see mail_delivery.py) and records the outcome: `sent`
+with `sent_at`, or the error in `error_message` and a retry after
+NOTIFICATION_RETRY_SECONDS * 2^(attempts - 1). After
+NOTIFICATION_MAX_ATTEMPTS failures the row is marked `failed`. A worker
+that dies mid-send leaves its rows pending; they are picked up again when
+the lease runs out.
+"""
+import argparse
+import base64
+import json
+import logging
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, has_request_context, request
+from sqlalchemy import insert, or_, select, update
+
+import mail_delivery
+from extensions import db
+from mail_delivery import OutgoingMail
+from models import NotificationLog, User
+
+LEASE_SECONDS = 300
+TWILIO_MESSAGES_URL = 'https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json'
+
+_config = {
+    'concurrency': 4,
+    'batch_size': 50,
+    'max_attempts': 5,
+    'retry_seconds': 60,
+    'poll_seconds': 5,
+}
+
+SETTINGS_UPDATE_TEXT = """{{ section }} Settings Updated
+
+Changed by: {{ user_name }}
+
+Store Name: {{ settings.store_name or 'Not set' }}
+Store Name (Tamil): {{ settings.store_name_tamil or 'Not set' }}
+Tagline: {{ settings.tagline or 'Not set' }}
+Hero Subtitle: {{ settings.hero_subtitle or 'Not set' }}
+
+Payment Settings:
+UPI ID: {{ settings.upi_id or 'Not set' }}
+UPI QR Image URL: {{ settings.upi_qr_image_url or 'Not set' }}
+
+Delivery Settings:
+Free Delivery Above: ₹{{ settings.free_delivery_amount or 500 }}
+Standard Delivery Charge: ₹{{ settings.delivery_charge or 50 }}
+
+Contact Information:
+Phone: {{ settings.phone or 'Not set' }}
+Email: {{ settings.email or 'Not set' }}
+Address: {{ settings.address or 'Not set' }}
+
+Updated at: {{ changed_at }} UTC
+{% if store_url %}
+Visit your store: {{ store_url }}
+Admin Panel: {{ store_url }}admin
+{% endif %}"""
+
+SETTINGS_UPDATE_HTML = """<!DOCTYPE html>
+<html>
+<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+        <h2 style="color: #4CAF50; border-bottom: 2px solid #4CAF50; padding-bottom: 10px;">
+            {{ section }} Settings Updated
+        </h2>
+        <p>Changed by {{ user_name }}.</p>
+
+        <div style="background-color: #f9f9f9; padding: 15px; border-radius: 5px; margin: 20px 0;">
+            <h3 style="color: #333; margin-top: 0;">Store Information</h3>
+            <p><strong>Store Name:</strong> {{ settings.store_name or 'Not set' }}</p>
+            <p><strong>Store Name (Tamil):</strong> {{ settings.store_name_tamil or 'Not set' }}</p>
+            <p><strong>Tagline:</strong> {{ settings.tagline or 'Not set' }}</p>
+            <p><strong>Hero Subtitle:</strong> {{ settings.hero_subtitle or 'Not set' }}</p>
+        </div>
+
+        <div style="background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin: 20px 0;">
+            <h3 style="color: #333; margin-top: 0;">Payment Settings</h3>
+            <p><strong>UPI ID:</strong> {{ settings.upi_id or 'Not set' }}</p>
+            <p><strong>UPI QR Image URL:</strong> {{ settings.upi_qr_image_url or 'Not set' }}</p>
+        </div>
+
+        <div style="background-color: #fff3e0; padding: 15px; border-radius: 5px; margin: 20px 0;">
+            <h3 style="color: #333; margin-top: 0;">Delivery Settings</h3>
+            <p><strong>Free Delivery Above:</strong> ₹{{ settings.free_delivery_amount or 500 }}</p>
+            <p><strong>Standard Delivery Charge:</strong> ₹{{ settings.delivery_charge or 50 }}</p>
+        </div>
+
+        <div style="background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin: 20px 0;">
+            <h3 style="color: #333; margin-top: 0;">Contact Information</h3>
+            <p><strong>Phone:</strong> {{ settings.phone or 'Not set' }}</p>
+            <p><strong>Email:</strong> {{ settings.email or 'Not set' }}</p>
+            <p><strong>Address:</strong> {{ settings.address or 'Not set' }}</p>
+        </div>
+        {% if store_url %}
+        <div style="margin: 30px 0; text-align: center;">
+            <a href="{{ store_url }}" style="background-color: #4CAF50; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; margin-right: 10px;">View Store</a>
+            <a href="{{ store_url }}admin" style="background-color: #2196F3; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">Admin Panel</a>
+        </div>
+        {% endif %}
+        <p style="color: #666; font-size: 12px; text-align: center; margin-top: 30px;">
+            Updated at: {{ changed_at }} UTC
+        </p>
+    </div>
+</body>
+</html>"""
+
+# (subject, text body, HTML body or None) Jinja templates, rendered once per event for all admin recipients
+ADMIN_EVENTS = {
+    'new_order': ('New order {{ order_number }}',
+                  'New order {{ order_number }} from {{ customer_name }}: ₹{{ total_amount }}', None),
+    'address_change': ('Customer address updated',
+                       '{{ customer_name }} added a delivery address.', None),
+    'settings_update': ("{{ section }} Settings Updated - {{ settings.store_name or 'Thaavaram' }}",
+                        SETTINGS_UPDATE_TEXT, SETTINGS_UPDATE_HTML),
+}
+
+
+def _settings():
+    from caching import get_store_settings
+    return get_store_settings()
+
+
+def _fill(template, **values):
+    """str.format that leaves unknown placeholders empty (templates are edited by admins)."""
+    return template.format_map(defaultdict(str, values))
+
+
+def _order_values(order):
+    user = order.user
+    return {
+        'order_id': order.order_number,
+        'order_number': order.order_number,
+        'customer_name': order.delivery_name or (user.first_name if user else ''),
+        'total_amount': f"{order.total_amount:.2f}",
+        'status': order.status,
+        'tracking_url': order.tracking_url or '',
+        'website_url': '',
+    }
+
+
+def _outbox_row(notification_type, recipient, subject, message, order=None, html_message=None):
+    now = datetime.utcnow()
+    return {
+        'order_id': order.id if order is not None else None,
+        'notification_type': notification_type,
+        'recipient': recipient,
+        'subject': subject,
+        'message': message,
+        'html_message': html_message,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now,
+    }
+
+
+def _queue(notification_type, recipient, subject, message, order=None):
+    if recipient:
+        db.session.add(NotificationLog(**_outbox_row(notification_type, recipient, subject, message, order)))
+
+
+def _admin_recipients(settings):
+    """The store email (if set) and every active admin, each address once."""
+    recipients = [settings.email] if settings and settings.email else []
+    recipients += db.session.execute(
+        select(User.email).where(User.role == 'admin', User._is_active.is_(True)).order_by(User.id)).scalars()
+    return list(dict.fromkeys(r for r in recipients if r))
+
+
+# =========================
+# Queueing (call before the route commits)
+# =========================
+
+def queue_order_confirmation(order):
+    """Confirmation email (and WhatsApp message when enabled) for a new order. `order` must have an id."""
+    settings = _settings()
+    values = _order_values(order)
+    if settings is None or settings.email_notifications_enabled:
+        subject_template = (settings.order_email_subject if settings else None) or 'Order Confirmation - #{order_id}'
+        body = (f"Hi {values['customer_name']},\n\nThank you for your order {order.order_number}.\n"
+                f"Total: ₹{values['total_amount']}\n")
+        _queue('email', order.user.email if order.user else None, _fill(subject_template, **values), body, order)
+    if settings and settings.whatsapp_enabled and settings.order_whatsapp_template:
+        _queue('whatsapp', order.delivery_phone, None, _fill(settings.order_whatsapp_template, **values), order)
+
+
+def queue_status_update(order, old_status, new_status):
+    settings = _settings()
+    values = _order_values(order)
+    if settings is None or settings.email_notifications_enabled:
+        _queue('email', order.user.email if order.user else None,
+               f"Order {order.order_number} is {new_status}",
+               f"Hi {values['customer_name']},\n\nYour order {order.order_number} is now {new_status}.\n", order)
+    if settings and settings.whatsapp_enabled and settings.delivery_whatsapp_template:
+        _queue('whatsapp', order.delivery_phone, None, _fill(settings.delivery_whatsapp_template, **values), order)
+
+
+def queue_admin_notification(order, event, user=None, settings=None, **context):
+    """
+    Email the store address and every active admin about `event` (see
+    ADMIN_EVENTS). `order` may be None; `settings` defaults to the cached
+    StoreSettings (pass the row being saved to print the new values).
+    """
+    settings = settings or _settings()
+    values = _order_values(order) if order is not None else {}
+    if user is not None:
+        values['user_name'] = f"{user.first_name or ''} {user.last_name or ''}".strip() or user.email
+        values.setdefault('customer_name', values['user_name'])
+    values.update(context, settings=settings)
+    subject, text, html = ADMIN_EVENTS[event]
+    subject = mail_delivery.render(subject, **values)
+    text = mail_delivery.render(text, **values)
+    html = mail_delivery.render(html, html=True, **values)
+    rows = [_outbox_row('email', recipient, subject, text, order, html)
+            for recipient in _admin_recipients(settings)]
+    if rows:
+        db.session.execute(insert(NotificationLog), rows)
+
+
+def queue_settings_update(section, user, settings=None):
+    """Tell every admin that a settings section was changed, by whom, and what the settings are now."""
+    queue_admin_notification(None, 'settings_update', user=user, settings=settings, section=section,
+                             changed_at=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                             store_url=request.host_url if has_request_context() else '')
+
+
+# =========================
+# Delivery
+# =========================
+
+def send_whatsapp(recipient, body, settings):
+    """Send one WhatsApp message through the Twilio API configured in StoreSettings."""
+    if not (settings and settings.twilio_account_sid and settings.twilio_auth_token and settings.whatsapp_number):
+        raise RuntimeError('WhatsApp settings not configured')
+    data = urllib.parse.urlencode({
+        'From': f"whatsapp:{settings.whatsapp_number}",
+        'To': f"whatsapp:{recipient}",
+        'Body': body or '',
+    }).encode()
+    token = base64.b64encode(f"{settings.twilio_account_sid}:{settings.twilio_auth_token}".encode()).decode()
+    request = urllib.request.Request(
+        TWILIO_MESSAGES_URL.format(sid=settings.twilio_account_sid), data=data, method='POST',
+        headers={'Authorization': f'Basic {token}'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        json.load(response)
+
+
+# Channels sent one message at a time; email goes through mail_delivery in batches
+SENDERS = {
+    'whatsapp': lambda job, settings: send_whatsapp(job['recipient'], job['message'], settings),
+}
+
+
+def _deliver(app, job, settings):
+    """Runs on a worker thread. Returns {id: None on success or the error text}."""
+    with app.app_context():
+        try:
+            SENDERS[job['notification_type']](job, settings)
+            return {job['id']: None}
+        except Exception as e:
+            return {job['id']: f"{type(e).__name__}: {e}"}
+
+
+def _deliver_emails(app, jobs):
+    """Runs on a worker thread: one SMTP connection for the whole chunk."""
+    with app.app_context():
+        return mail_delivery.deliver(
+            OutgoingMail(job['id'], job['recipient'], job['subject'], job['message'], job['html_message'])
+            for job in jobs)
+
+
+def _claim(now, limit):
+    """Lease up to `limit` due rows to this worker; returns them as dicts."""
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    due = (
+        select(NotificationLog.id)
+        .where(NotificationLog.status == 'pending',
+               or_(NotificationLog.next_attempt_at.is_(None), NotificationLog.next_attempt_at <= now))
+        .order_by(NotificationLog.id)
+        .limit(limit)
+    )
+    if db.engine.dialect.name != 'sqlite':
+        due = due.with_for_update(skip_locked=True)
+    columns = (NotificationLog.id, NotificationLog.notification_type, NotificationLog.recipient,
+               NotificationLog.subject, NotificationLog.message, NotificationLog.html_message,
+               NotificationLog.attempts)
+    lease = (
+        update(NotificationLog)
+        .values(next_attempt_at=lease_until)
+        .execution_options(synchronize_session=False)
+    )
+    if db.engine.dialect.update_returning:
+        rows = db.session.execute(lease.where(NotificationLog.id.in_(due)).returning(*columns)).all()
+    else:
+        ids = list(db.session.execute(due).scalars())
+        rows = []
+        if ids:
+            db.session.execute(lease.where(NotificationLog.id.in_(ids)))
+            rows = db.session.execute(select(*columns).where(NotificationLog.id.in_(ids))).all()
+    db.session.commit()
+    return sorted((row._asdict() for row in rows), key=lambda job: job['id'])
+
+
+def drain(limit=None):
+    """Send one batch of due notifications. Returns (sent, failed attempts)."""
+    app = current_app._get_current_object()
+    jobs = _claim(datetime.utcnow(), limit or _config['batch_size'])
+    if not jobs:
+        return 0, 0
+
+    settings = _settings()
+    emails = [job for job in jobs if job['notification_type'] == 'email']
+    others = [job for job in jobs if job['notification_type'] != 'email']
+    workers = min(_config['concurrency'], len(jobs))
+    # Spread the emails over at most `workers` connections
+    chunks = [emails[i::workers] for i in range(min(workers, len(emails)))]
+    outcome = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_deliver_emails, app, chunk) for chunk in chunks]
+        futures += [pool.submit(_deliver, app, job, settings) for job in others]
+        for future in futures:
+            outcome.update(future.result())
+    errors = [outcome.get(job['id'], 'Not sent') for job in jobs]
+
+    finished = datetime.utcnow()
+    outcomes = []
+    for job, error in zip(jobs, errors):
+        attempts = (job['attempts'] or 0) + 1
+        if error is None:
+            outcomes.append({'id': job['id'], 'status': 'sent', 'sent_at': finished, 'attempts': attempts,
+                             'error_message': None, 'next_attempt_at': None})
+        elif attempts >= _config['max_attempts']:
+            outcomes.append({'id': job['id'], 'status': 'failed', 'attempts': attempts,
+                             'error_message': error, 'next_attempt_at': None})
+        else:
+            retry_at = finished + timedelta(seconds=_config['retry_seconds'] * 2 ** (attempts - 1))
+            outcomes.append({'id': job['id'], 'status': 'pending', 'attempts': attempts,
+                             'error_message': error, 'next_attempt_at': retry_at})
+    db.session.execute(update(NotificationLog), outcomes)
+    db.session.commit()
+    sent = sum(1 for error in errors if error is None)
+    return sent, len(errors) - sent
+
+
+def run_worker(once=False):
+    while True:
+        sent, failed = drain()
+        if sent or failed:
+            logging.info(f"Notifications: {sent} sent, {failed} failed attempts")
+        if once and not (sent or failed):
+            return
+        if not (sent or failed):
+            time.sleep(_config['poll_seconds'])
+
+
+def init_app(app):
+    _config.update(
+        concurrency=max(1, app.config.get('NOTIFICATION_CONCURRENCY', _config['concurrency'])),
+        batch_size=max(1, app.config.get('NOTIFICATION_BATCH_SIZE', _config['batch_size'])),
+        max_attempts=max(1, app.config.get('NOTIFICATION_MAX_ATTEMPTS', _config['max_attempts'])),
+        retry_seconds=app.config.get('NOTIFICATION_RETRY_SECONDS', _config['retry_seconds']),
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send queued notifications')
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('--once', action='store_true', help='exit when nothing is due')
+    args = parser.parse_args()
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        run_worker(once=args.once)
@@ -0,0 +1,236 @@
+"""
+Keyset (cursor) pagination.
+
+`keyset_paginate()` returns a `KeysetPagination` that quacks like
+Flask-SQLAlchemy's Pagination (items, page, pages, total, has_next,
+next_num, iter_pages(), ...), so existing templates keep working. The
+difference is that `next_num`/`prev_num` are opaque cursor tokens instead of
+page numbers: templates that build `url_for(..., page=obj.next_num)` links
+send the token back in `?page=`, and the next page is fetched with
+`WHERE (key) < (last key) ORDER BY key LIMIT n` instead of OFFSET. Plain
+integer `?page=N` links (e.g. from iter_pages()) still work through OFFSET.
+
+Totals are optional: `count='exact'` runs COUNT(*) every time,
+`count='estimate'` (default) caches it per query for COUNT_TTL seconds and
+`count=None` skips it.
+"""
+import base64
+import json
+import threading
+import time
+from datetime import datetime, date
+from decimal import Decimal
+from math import ceil
+
+from sqlalchemy import and_, or_
+
+COUNT_TTL = 60
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def _coerce(key, value):
+    """`value` as the Python type of column `key`; raises ValueError/TypeError if it isn't one."""
+    try:
+        python_type = key.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if python_type is datetime:
+        ok = isinstance(value, datetime)
+    elif python_type is date:
+        ok = isinstance(value, date) and not isinstance(value, datetime)
+    elif python_type is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    elif python_type in (float, Decimal):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        value = python_type(value) if ok else value
+    elif python_type is str:
+        ok = isinstance(value, str)
+    else:
+        ok = isinstance(value, (str, int, float))
+    if not ok:
+        raise TypeError(f"cursor value {value!r} does not fit {key}")
+    return value
+
+
+def encode_cursor(direction, page, values):
+    payload = json.dumps([direction, page, [_encode_value(v) for v in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, keys=None):
+    """
+    Return (direction, page, values) or None if the token is not a valid cursor.
+
+    With `keys`, the token must also carry one value of the right type per
+    key, so a hand-edited token falls back to the first page instead of
+    failing in the query.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, page, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('n', 'p') or not isinstance(values, list):
+            return None
+        values = [_decode_value(v) for v in values]
+        if keys is not None:
+            if len(values) != len(keys):
+                return None
+            values = [_coerce(key, value) for key, value in zip(keys, values)]
+        return direction, int(page), values
+    except (ValueError, TypeError):
+        return None
+
+
+def _after(keys, values, descending):
+    """Row-value comparison (k1, k2, ...) > / < (v1, v2, ...) spelled out for portability."""
+    clauses = []
+    for i, key in enumerate(keys):
+        cmp = key < values[i] if descending else key > values[i]
+        clauses.append(and_(*[keys[j] == values[j] for j in range(i)], cmp))
+    return or_(*clauses)
+
+
+def _estimated_count(query, exact):
+    if exact:
+        return query.order_by(None).count()
+    compiled = query.statement.compile()
+    cache_key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+    with _count_lock:
+        hit = _count_cache.get(cache_key)
+        if hit and hit[1] > now:
+            return hit[0]
+    total = query.order_by(None).count()
+    with _count_lock:
+        if len(_count_cache) > 1024:
+            _count_cache.clear()
+        _count_cache[cache_key] = (total, now + COUNT_TTL)
+    return total
+
+
+class KeysetPagination:
+    def __init__(self, items, page, per_page, total, has_prev, has_next, prev_cursor, next_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def prev_num(self):
+        return self.prev_cursor if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.next_cursor if self.has_next else None
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return self.page + (1 if self.has_next else 0)
+        return max(ceil(self.total / self.per_page), 1) if self.per_page else 0
+
+    @property
+    def first(self):
+        return (self.page - 1) * self.per_page + 1 if self.items else 0
+
+    @property
+    def last(self):
+        return self.first + len(self.items) - 1 if self.items else 0
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        """
+        Same shape as Flask-SQLAlchemy: page numbers with None for gaps.
+
+        These are plain page numbers, so following one is an OFFSET query;
+        only the prev/next cursors avoid scanning the skipped rows.
+        """
+        pages = self.pages
+        left_end = min(1 + left_edge, pages + 1)
+        yield from range(1, left_end)
+        if left_end == pages + 1:
+            return
+        mid_start = max(left_end, self.page - left_current)
+        mid_end = min(self.page + right_current + 1, pages + 1)
+        if mid_start - left_end > 0:
+            yield None
+        yield from range(mid_start, mid_end)
+        if mid_end == pages + 1:
+            return
+        right_start = max(mid_end, pages - right_edge + 1)
+        if right_start - mid_end > 0:
+            yield None
+        yield from range(right_start, pages + 1)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, keys, page=None, per_page=20, descending=True, count='estimate'):
+    """
+    Paginate `query` on the unique column tuple `keys` (e.g. (Order.created_at, Order.id)).
+
+    `page` is the raw `?page=` argument: empty for the first page, a cursor
+    token from a previous page, or a legacy integer page number.
+    """
+    keys = list(keys)
+    order = [k.desc() for k in keys] if descending else [k.asc() for k in keys]
+    reverse = [k.asc() for k in keys] if descending else [k.desc() for k in keys]
+
+    cursor = decode_cursor(page, keys) if page and not str(page).isdigit() else None
+    page_number = int(page) if page and str(page).isdigit() else 1
+    page_number = max(page_number, 1)
+
+    if cursor and cursor[0] == 'p':
+        _, page_number, values = cursor
+        rows = query.filter(_after(keys, values, not descending)).order_by(*reverse).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if cursor:
+            _, page_number, values = cursor
+            rows = query.filter(_after(keys, values, descending)).order_by(*order).limit(per_page + 1).all()
+        else:
+            rows = query.order_by(*order).offset((page_number - 1) * per_page).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = page_number > 1
+
+    page_number = max(page_number, 1)
+
+    def key_of(item):
+        return [getattr(item, k.key) for k in keys]
+
+    prev_cursor = encode_cursor('p', page_number - 1, key_of(items[0])) if items and has_prev else None
+    next_cursor = encode_cursor('n', page_number + 1, key_of(items[-1])) if items and has_next else None
+
+    total = None
+    if count:
+        total = _estimated_count(query, exact=(count == 'exact'))
+
+    return KeysetPagination(items, page_number, per_page, total, has_prev, has_next, prev_cursor, next_cursor)
@@ -0,0 +1,106 @@
+"""
+Cart pricing.
+
+One engine for the subtotal, GST and delivery charge shown by cart,
+checkout, place_order and the add_to_cart JSON response. A cart's products
+are loaded with a single query (joined for database carts, one IN query for
+guest session carts) and the numbers are copied into parallel arrays
+(price in paise, quantity, GST rate), so the totals are exact integer sums
+computed without touching ORM attributes again.
+"""
+from array import array
+from collections import namedtuple
+
+from sqlalchemy.orm import contains_eager
+
+from models import CartItem, Product
+from money import to_paise, from_paise, line_paise, percent_paise
+
+DEFAULT_DELIVERY_CHARGE = 50
+
+# Cart line for a guest cart kept in the session ({product_id: quantity})
+GuestCartItem = namedtuple('GuestCartItem', 'id product quantity')
+
+
+def delivery_charge_for(subtotal, settings):
+    """Free above the store's threshold, otherwise the configured charge."""
+    if settings:
+        return 0 if subtotal >= (settings.free_delivery_amount or 0) else (settings.delivery_charge or 0)
+    return DEFAULT_DELIVERY_CHARGE
+
+
+class CartPricing:
+    """
+    Priced cart. `items` are the cart lines (with `.product` loaded) for
+    templates and order creation; the arrays are aligned with them. Amounts
+    are computed in integer paise (line totals and per-line GST rounded to a
+    paisa) and exposed both as `*_paise` and as rupees.
+    """
+
+    __slots__ = ('items', 'product_ids', 'prices', 'quantities', 'gst_rates', 'line_totals', 'line_gst',
+                 'subtotal_paise', 'gst_paise', 'delivery_paise', 'total_paise')
+
+    def __init__(self, items, settings):
+        self.items = items
+        products = [item.product for item in items]
+        self.product_ids = array('q', [product.id for product in products])
+        self.prices = array('q', [to_paise(product.price or 0) for product in products])
+        self.quantities = array('d', [item.quantity or 0 for item in items])
+        self.gst_rates = array('d', [product.gst_rate or 0 for product in products])
+        self.line_totals = array('q', map(line_paise, self.prices, self.quantities))
+        self.line_gst = array('q', map(percent_paise, self.line_totals, self.gst_rates))
+        self.subtotal_paise = sum(self.line_totals)
+        self.gst_paise = sum(self.line_gst)
+        self.delivery_paise = to_paise(delivery_charge_for(from_paise(self.subtotal_paise), settings))
+        self.total_paise = self.subtotal_paise + self.gst_paise + self.delivery_paise
+
+    @property
+    def subtotal(self):
+        return from_paise(self.subtotal_paise)
+
+    @property
+    def gst_amount(self):
+        return from_paise(self.gst_paise)
+
+    @property
+    def delivery_charge(self):
+        return from_paise(self.delivery_paise)
+
+    @property
+    def total(self):
+        return from_paise(self.total_paise)
+
+    @property
+    def item_count(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def price_cart(user_id, settings):
+    """Price a logged-in user's cart: cart lines and products in one joined query."""
+    items = (
+        CartItem.query
+        .join(CartItem.product)
+        .options(contains_eager(CartItem.product))
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+    return CartPricing(items, settings)
+
+
+def price_session_cart(session_cart, settings):
+    """Price a guest cart ({product_id: quantity}) with one IN query; unknown products are dropped."""
+    product_ids = [int(pid) for pid in session_cart]
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))} if product_ids else {}
+    items = [
+        GuestCartItem(int(pid), products[int(pid)], quantity)
+        for pid, quantity in session_cart.items()
+        if int(pid) in products
+    ]
+    return CartPricing(items, settings)
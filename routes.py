@@ -1,13 +1,27 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, make_response, \
-    send_file, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, \
+    Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from extensions import db, mail, csrf  # initialized extensions
+from extensions import db, csrf  # initialized extensions
+from caching import settings_cache, get_store_settings, category_image_cache, get_category_images
+from search import search_index
+import suggest as typeahead
+from pagination import keyset_paginate
+from pricing import price_cart, price_session_cart
+from money import line_total
+import campaigns as campaign_engine
+import inventory
+import invoice_cache
+import invoice_export
+import segments
+import stats
+import notifications
+from cart_summary import get_cart_summary, apply_cart_delta, clear_cart_summary, invalidate_for_product
 from models import *
 from datetime import datetime
-import logging
 import json
 import os
 from werkzeug.utils import secure_filename
+from sqlalchemy import case
 
 main_bp = Blueprint('main', __name__)
 
@@ -21,7 +35,7 @@ def admin_invoice_logos():
     if current_user.role not in ['admin', 'storekeeper']:
         flash('Access denied', 'error')
         return redirect(url_for('main.index'))
-    settings = StoreSettings.query.first()
+    settings = get_store_settings()
     return render_template('admin/invoice_settings.html', settings=settings)
 
 
@@ -43,6 +57,7 @@ def admin_update_invoice_logos():
     settings.invoice_upi_logo_position = request.form.get('invoice_upi_logo_position')
     settings.invoice_upi_logo_size = int(request.form.get('invoice_upi_logo_size') or 0)
     db.session.commit()
+    settings_cache.invalidate()
     flash('Invoice logo settings updated successfully', 'success')
     return redirect(url_for('main.admin_invoice_logos'))
 
@@ -53,7 +68,7 @@ def index():
     _ = any(x in user_agent for x in ['mobile', 'android', 'iphone', 'ipad'])  # reserved
 
     categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order).all()
-    settings = StoreSettings.query.first()
+    settings = get_store_settings()
 
     featured_products = Product.query.filter_by(is_active=True, is_featured=True).limit(12).all()
     all_products = Product.query.filter_by(is_active=True).limit(20).all()
@@ -79,25 +94,28 @@ def products(category_id=None):
         query = query.filter_by(category_id=category_id)
 
     if search:
-        query = query.filter(Product.name.contains(search) | Product.name_tamil.contains(search))
+        ranked_ids = search_index.search(search, category_id=category_id)
+        query = query.filter(Product.id.in_(ranked_ids))
+        if ranked_ids:
+            query = query.order_by(case({pid: rank for rank, pid in enumerate(ranked_ids)}, value=Product.id))
+        # Ranked results are bounded by SEARCH_MAX_RESULTS, so OFFSET paging stays cheap here
+        products = query.paginate(page=page, per_page=12, error_out=False)
+    else:
+        products = keyset_paginate(query, (Product.id,), request.args.get('page'), per_page=12, descending=False)
 
-    products = query.paginate(page=page, per_page=12, error_out=False)
     categories = Category.query.filter_by(is_active=True).all()
     selected_category = Category.query.get(category_id) if category_id else None
 
-    categories_with_images = []
-    for category in categories:
-        sample_product = (
-            Product.query.filter_by(category_id=category.id, is_active=True)
-            .filter(Product.image_url.isnot(None)).first()
-        )
-
-        categories_with_images.append({
+    category_images = get_category_images()
+    categories_with_images = [
+        {
             'id': category.id,
             'name': category.name,
             'name_tamil': category.name_tamil,
-            'image_url': sample_product.image_url if sample_product else '/static/images/placeholder.jpg'
-        })
+            'image_url': category_images.get(category.id, '/static/images/placeholder.jpg')
+        }
+        for category in categories
+    ]
 
     return render_template(
         'products.html',
@@ -108,6 +126,27 @@ def products(category_id=None):
     )
 
 
+@main_bp.route('/api/suggest')
+def suggest():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 8, type=int)
+    return jsonify({
+        'query': query,
+        'suggestions': [
+            {
+                'id': s.id,
+                'name': s.name,
+                'name_tamil': s.name_tamil,
+                'price': s.price,
+                'unit': s.unit,
+                'image_url': s.image_url,
+                'url': url_for('main.product_detail', product_id=s.id),
+            }
+            for s in typeahead.suggest(query, limit)
+        ]
+    })
+
+
 @main_bp.route('/product/<int:product_id>')
 def product_detail(product_id):
     product = Product.query.get_or_404(product_id)
@@ -232,10 +271,7 @@ def add_to_cart():
 
     product = Product.query.get_or_404(product_id)
 
-    # Resolve field aliases safely
-    stock = getattr(product, 'stock_kg', None)
-    if stock is None:
-        stock = getattr(product, 'stock_quantity', None)
+    stock = inventory.stock_level(product.id)
 
     min_qty_cfg = (
         getattr(product, 'min_quantity_kg', None)
@@ -285,10 +321,14 @@ def add_to_cart():
                     return jsonify({'success': False, 'message': message})
                 flash(message, 'error')
                 return redirect(url_for('main.product_detail', product_id=product_id))
+            old_quantity = cart_item.quantity
             cart_item.quantity = new_total
+            apply_cart_delta(current_user.id, 0,
+                             line_total(product.price, new_total) - line_total(product.price, old_quantity))
         else:
             cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity)
             db.session.add(cart_item)
+            apply_cart_delta(current_user.id, 1, line_total(product.price, quantity))
 
         db.session.commit()
     else:
@@ -316,17 +356,13 @@ def add_to_cart():
     # Return JSON response for AJAX requests
     if request.is_json:
         if current_user.is_authenticated:
-            cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-            cart_count = len(cart_items)
-            cart_total = sum(item.quantity * item.product.price for item in cart_items)
+            summary = get_cart_summary(current_user.id)
+            cart_count = summary.item_count
+            cart_total = summary.subtotal
         else:
             cart = session.get('cart', {})
             cart_count = len(cart)
-            cart_total = 0
-            for prod_id_str, qty in cart.items():
-                prod = Product.query.get(int(prod_id_str))
-                if prod:
-                    cart_total += qty * prod.price
+            cart_total = price_session_cart(cart, None).subtotal
 
         qty_display = f'{quantity}kg' if quantity >= 1 else f'{int(quantity * 1000)}g'
         return jsonify({
@@ -342,40 +378,18 @@ def add_to_cart():
 
 @main_bp.route('/cart')
 def cart():
-    cart_items = []
-    total = 0
-
+    settings = get_store_settings()
     if current_user.is_authenticated:
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        for item in cart_items:
-            item_price = item.product.price * item.quantity
-            total += item_price
-    else:
-        session_cart = session.get('cart', {})
-        for product_id_str, quantity in session_cart.items():
-            product = Product.query.get(int(product_id_str))
-            if product:
-                cart_item = type('CartItem', (), {
-                    'product': product,
-                    'quantity': quantity,
-                    'id': int(product_id_str)
-                })()
-                cart_items.append(cart_item)
-                total += product.price * quantity
-
-    settings = StoreSettings.query.first()
-    if settings:
-        delivery_charge = 0 if total >= (settings.free_delivery_amount or 0) else (settings.delivery_charge or 0)
+        pricing = price_cart(current_user.id, settings)
     else:
-        delivery_charge = 50
-    grand_total = total + delivery_charge
+        pricing = price_session_cart(session.get('cart', {}), settings)
 
     return render_template(
         'cart.html',
-        cart_items=cart_items,
-        total=total,
-        delivery_charge=delivery_charge,
-        grand_total=grand_total,
+        cart_items=pricing.items,
+        total=pricing.subtotal,
+        delivery_charge=pricing.delivery_charge,
+        grand_total=pricing.subtotal + pricing.delivery_charge,
         settings=settings
     )
 
@@ -390,14 +404,18 @@ def update_cart():
     if cart_item and quantity is not None:
         if quantity <= 0:
             db.session.delete(cart_item)
+            apply_cart_delta(current_user.id, -1, -line_total(cart_item.product.price, cart_item.quantity))
         else:
             # re-check stock if available
             product = cart_item.product
-            stock = getattr(product, 'stock_kg', None) or getattr(product, 'stock_quantity', None)
+            stock = inventory.stock_level(product.id)
             if stock is not None and quantity > stock:
                 flash(f'Not enough stock available (max {stock}).', 'error')
                 return redirect(url_for('main.cart'))
+            old_quantity = cart_item.quantity
             cart_item.quantity = quantity
+            apply_cart_delta(current_user.id, 0,
+                             line_total(product.price, quantity) - line_total(product.price, old_quantity))
         db.session.commit()
 
     return redirect(url_for('main.cart'))
@@ -409,6 +427,7 @@ def remove_from_cart(item_id):
     cart_item = CartItem.query.filter_by(id=item_id, user_id=current_user.id).first()
     if cart_item:
         db.session.delete(cart_item)
+        apply_cart_delta(current_user.id, -1, -line_total(cart_item.product.price, cart_item.quantity))
         db.session.commit()
         flash('Item removed from cart', 'info')
 
@@ -426,6 +445,12 @@ def checkout():
     # Transfer session cart to DB
     if 'cart' in session and session['cart']:
         session_cart = session['cart']
+        prices = dict(
+            db.session.query(Product.id, Product.price)
+            .filter(Product.id.in_([int(pid) for pid in session_cart]))
+            .all()
+        )
+        added_count, added_amount = 0, 0.0
         for product_id_str, quantity in session_cart.items():
             product_id = int(product_id_str)
 
@@ -434,40 +459,45 @@ def checkout():
                 product_id=product_id
             ).first()
 
+            price = prices.get(product_id) or 0
             if cart_item:
+                added_amount += line_total(price, cart_item.quantity + quantity) - line_total(price, cart_item.quantity)
                 cart_item.quantity += quantity
             else:
                 cart_item = CartItem(user_id=current_user.id, product_id=product_id, quantity=quantity)
                 db.session.add(cart_item)
+                added_count += 1
+                added_amount += line_total(price, quantity)
 
+        apply_cart_delta(current_user.id, added_count, added_amount)
         session.pop('cart', None)
         db.session.commit()
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    settings = get_store_settings()
+    pricing = price_cart(current_user.id, settings)
 
-    if not cart_items:
+    if not pricing:
         flash('Your cart is empty', 'warning')
         return redirect(url_for('main.cart'))
 
-    subtotal = sum(item.product.price * item.quantity for item in cart_items)
-    gst_amount = sum((item.product.price * item.quantity * (item.product.gst_rate or 0) / 100) for item in cart_items)
-
-    settings = StoreSettings.query.first()
-    if settings:
-        delivery_charge = 0 if subtotal >= (settings.free_delivery_amount or 0) else (settings.delivery_charge or 0)
-    else:
-        delivery_charge = 50
-    total_amount = subtotal + gst_amount + delivery_charge
+    if inventory.reservations_enabled():
+        inventory.release_expired()
+        short = inventory.reserve_cart(
+            current_user.id, zip(pricing.product_ids, pricing.quantities))
+        db.session.commit()
+        if short:
+            names = ', '.join(item.product.name for item in pricing.items if item.product_id in short)
+            flash(f'Some items could not be reserved and may be out of stock: {names}', 'warning')
 
     default_address = Address.query.filter_by(user_id=current_user.id, is_default=True).first()
 
     return render_template(
         'checkout.html',
-        cart_items=cart_items,
-        subtotal=subtotal,
-        gst_amount=gst_amount,
-        delivery_charge=delivery_charge,
-        total_amount=total_amount,
+        cart_items=pricing.items,
+        subtotal=pricing.subtotal,
+        gst_amount=pricing.gst_amount,
+        delivery_charge=pricing.delivery_charge,
+        total_amount=pricing.total,
         default_address=default_address,
         settings=settings
     )
@@ -476,7 +506,9 @@ def checkout():
 @main_bp.route('/place_order', methods=['POST'])
 @login_required
 def place_order():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    settings = get_store_settings()
+    pricing = price_cart(current_user.id, settings)
+    cart_items = pricing.items
 
     if not cart_items:
         flash('Your cart is empty', 'warning')
@@ -490,22 +522,12 @@ def place_order():
     delivery_state = request.form.get('delivery_state')
     delivery_pincode = request.form.get('delivery_pincode')
 
-    subtotal = sum(item.product.price * item.quantity for item in cart_items)
-    gst_amount = sum((item.product.price * item.quantity * (item.product.gst_rate or 0) / 100) for item in cart_items)
-
-    settings = StoreSettings.query.first()
-    if settings:
-        delivery_charge = 0 if subtotal >= (settings.free_delivery_amount or 0) else (settings.delivery_charge or 0)
-    else:
-        delivery_charge = 50
-    total_amount = subtotal + gst_amount + delivery_charge
-
     order = Order(
         user_id=current_user.id,
-        subtotal=subtotal,
-        gst_amount=gst_amount,
-        delivery_charge=delivery_charge,
-        total_amount=total_amount,
+        subtotal=pricing.subtotal,
+        gst_amount=pricing.gst_amount,
+        delivery_charge=pricing.delivery_charge,
+        total_amount=pricing.total,
         delivery_name=delivery_name,
         delivery_phone=delivery_phone,
         delivery_address=delivery_address,
@@ -515,50 +537,45 @@ def place_order():
     )
     order.order_number = order.generate_order_number()
 
+    try:
+        # Sale movements for all lines; nothing is written if any line is short
+        inventory.commit_stock(current_user.id, zip(pricing.product_ids, pricing.quantities), order.order_number)
+    except inventory.InsufficientStock as e:
+        db.session.rollback()
+        _, name, _, available = e.first
+        flash(f'Insufficient stock for {name}. Only {available or 0}kg available.', 'error')
+        return redirect(url_for('main.cart'))
+
     db.session.add(order)
     db.session.flush()  # get order.id
+    segments.record_order(current_user.id, order.created_at)
 
-    # Create order items & reduce stock
+    # Create order items
     for cart_item in cart_items:
         product = cart_item.product
-        stock = getattr(product, 'stock_kg', None)
-        if stock is None:
-            stock = getattr(product, 'stock_quantity', None)
-
-        if stock is not None:
-            if cart_item.quantity > stock:
-                flash(f'Insufficient stock for {product.name}. Only {stock}kg available.', 'error')
-                return redirect(url_for('main.cart'))
-            # persist back to correct field
-            if hasattr(product, 'stock_kg'):
-                product.stock_kg = stock - cart_item.quantity
-            else:
-                product.stock_quantity = stock - cart_item.quantity
-
         order_item = OrderItem(
             order_id=order.id,
             product_id=cart_item.product_id,
-            product_name=cart_item.product.name,
-            product_name_tamil=cart_item.product.name_tamil,
-            product_sku=cart_item.product.sku,
-            unit_price=cart_item.product.price,
-            price=cart_item.product.price,
+            product_name=product.name,
+            product_name_tamil=product.name_tamil,
+            product_sku=product.sku,
+            price=product.price,
             quantity=cart_item.quantity,
-            weight_option=getattr(cart_item, 'weight_option', None),
-            gst_rate=cart_item.product.gst_rate,
-            total_price=cart_item.product.price * cart_item.quantity
+            unit=product.unit,
+            gst_rate=product.gst_rate
         )
         db.session.add(order_item)
 
     # Clear cart
     for cart_item in cart_items:
         db.session.delete(cart_item)
+    clear_cart_summary(current_user.id)
 
-    db.session.commit()
+    # Notifications go out from the outbox worker, not this request
+    notifications.queue_order_confirmation(order)
+    notifications.queue_admin_notification(order, 'new_order')
 
-    # Notifications
-    EmailService.send_order_confirmation(order)
-    EmailService.send_admin_notification(order, 'new_order')
+    db.session.commit()
 
     flash('Order placed successfully!', 'success')
     return redirect(url_for('main.order_confirmation', order_id=order.id))
@@ -614,10 +631,9 @@ def add_address():
     )
 
     db.session.add(address)
+    notifications.queue_admin_notification(None, 'address_change', user=current_user)
     db.session.commit()
 
-    EmailService.send_admin_notification(None, 'address_change')
-
     flash('Address added successfully!', 'success')
     return redirect(url_for('main.profile'))
 
@@ -625,9 +641,9 @@ def add_address():
 @main_bp.route('/orders')
 @login_required
 def orders():
-    page = request.args.get('page', 1, type=int)
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False)
+    orders = keyset_paginate(
+        Order.query.filter_by(user_id=current_user.id),
+        (Order.created_at, Order.id), request.args.get('page'), per_page=10)
     return render_template('orders.html', orders=orders)
 
 
@@ -650,16 +666,13 @@ def invoice(order_id):
 def invoice_pdf(order_id):
     order = Order.query.filter_by(id=order_id, user_id=current_user.id).first_or_404()
 
-    pdf_data = InvoiceGenerator.generate_invoice_pdf(order)
-    if not pdf_data:
+    try:
+        return invoice_cache.send_invoice(order, f'invoice_{order.order_number}.pdf')
+    except Exception as e:
+        current_app.logger.error(f"Invoice PDF for order {order.id} failed: {e}")
         flash('Error generating invoice PDF', 'error')
         return redirect(url_for('main.invoice', order_id=order_id))
 
-    response = make_response(pdf_data)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=invoice_{order.order_number}.pdf'
-    return response
-
 # =========================
 # Admin Routes
 # =========================
@@ -671,7 +684,7 @@ def admin_dashboard():
         flash('Access denied', 'error')
         return redirect(url_for('main.index'))
 
-    total_orders = Order.query.count()
+    total_orders = stats.order_count()
     pending_orders = Order.query.filter_by(status='pending').count()
     total_products = Product.query.count()
     total_customers = User.query.filter_by(role='customer').count()
@@ -726,9 +739,8 @@ def admin_products():
         flash('Access denied', 'error')
         return redirect(url_for('main.index'))
 
-    page = request.args.get('page', 1, type=int)
-    products = Product.query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False)
+    products = keyset_paginate(
+        Product.query, (Product.created_at, Product.id), request.args.get('page'), per_page=20)
     categories = Category.query.all()
 
     return render_template('admin/products.html', products=products, categories=categories)
@@ -751,8 +763,7 @@ def admin_add_product():
         product.price = request.form.get('price', type=float)
         product.unit = request.form.get('unit')
         product.unit_tamil = request.form.get('unit_tamil')
-        # accept stock field posted as stock_quantity
-        product.stock_quantity = request.form.get('stock_quantity', type=float)
+        stock_quantity = request.form.get('stock_quantity', type=float)
         product.min_order_quantity = request.form.get('min_order_quantity', type=float)
         product.max_order_quantity = request.form.get('max_order_quantity', type=float)
         product.weight_options = json.dumps(request.form.getlist('weight_options'))
@@ -783,7 +794,13 @@ def admin_add_product():
         product.sku = product.generate_sku()
 
         db.session.add(product)
+        db.session.flush()
+        if stock_quantity is not None:
+            inventory.set_stock(product, stock_quantity, current_user.id, reason=inventory.IMPORT)
+        search_index.reindex([product.id])
         db.session.commit()
+        category_image_cache.invalidate()
+        typeahead.suggest_cache.invalidate()
 
         flash('Product added successfully!', 'success')
         return redirect(url_for('main.admin_products'))
@@ -802,6 +819,7 @@ def admin_edit_product(product_id):
     product = Product.query.get_or_404(product_id)
 
     if request.method == 'POST':
+        old_price = product.price
         product.name = request.form.get('name')
         product.name_tamil = request.form.get('name_tamil')
         product.description = request.form.get('description')
@@ -810,14 +828,13 @@ def admin_edit_product(product_id):
         product.price = request.form.get('price', type=float)
         product.unit = request.form.get('unit')
         product.unit_tamil = request.form.get('unit_tamil')
+        if product.price != old_price:
+            invalidate_for_product(product.id)
 
-        # normalize form -> model fields
+        # Stock counts entered on the form are recorded as ledger adjustments
         stock_quantity = request.form.get('stock_quantity', type=float)
         if stock_quantity is not None:
-            if hasattr(product, 'stock_kg'):
-                product.stock_kg = stock_quantity
-            else:
-                product.stock_quantity = stock_quantity
+            inventory.set_stock(product, stock_quantity, current_user.id)
 
         min_order_quantity = request.form.get('min_order_quantity', type=float)
         max_order_quantity = request.form.get('max_order_quantity', type=float)
@@ -870,7 +887,10 @@ def admin_edit_product(product_id):
             if image_url and image_url != product.image_url:
                 product.image_url = image_url
 
+        search_index.reindex([product.id])
         db.session.commit()
+        category_image_cache.invalidate()
+        typeahead.suggest_cache.invalidate()
         flash('Product updated successfully!', 'success')
         return redirect(url_for('main.admin_products'))
 
@@ -893,7 +913,10 @@ def admin_toggle_product_status(product_id):
     new_status = True if new_status_str == 'true' else False
 
     product.is_active = new_status
+    search_index.reindex([product.id])
     db.session.commit()
+    category_image_cache.invalidate()
+    typeahead.suggest_cache.invalidate()
 
     flash(f'Product {"activated" if product.is_active else "deactivated"} successfully!', 'success')
     return redirect(url_for('main.admin_products'))
@@ -917,7 +940,6 @@ def admin_duplicate_product(product_id):
         price=product.price,
         unit=product.unit,
         unit_tamil=getattr(product, 'unit_tamil', None),
-        stock_quantity=getattr(product, 'stock_quantity', None) if hasattr(product, 'stock_quantity') else getattr(product, 'stock_kg', None),
         min_order_quantity=getattr(product, 'min_order_quantity', None) or getattr(product, 'min_quantity_kg', None) or getattr(product, 'min_qty', None),
         max_order_quantity=getattr(product, 'max_order_quantity', None) or getattr(product, 'max_quantity_kg', None) or getattr(product, 'max_qty', None),
         weight_options=product.weight_options,
@@ -929,6 +951,10 @@ def admin_duplicate_product(product_id):
     dup.sku = dup.generate_sku()
 
     db.session.add(dup)
+    db.session.flush()
+    stock = inventory.stock_level(product.id)
+    if stock is not None:
+        inventory.set_stock(dup, stock, current_user.id, reason=inventory.IMPORT)
     db.session.commit()
 
     flash('Product duplicated successfully!', 'success')
@@ -944,8 +970,13 @@ def admin_delete_product(product_id):
 
     product = Product.query.get_or_404(product_id)
 
+    invalidate_for_product(product.id)
+    search_index.remove([product.id])
+    inventory.forget([product.id])
     db.session.delete(product)
     db.session.commit()
+    category_image_cache.invalidate()
+    typeahead.suggest_cache.invalidate()
 
     flash('Product deleted successfully!', 'success')
     return redirect(url_for('main.admin_products'))
@@ -975,18 +1006,29 @@ def admin_products_bulk_action():
 
     if action == 'activate':
         updated = q.update({Product.is_active: True}, synchronize_session=False)
+        search_index.reindex(product_ids)
         db.session.commit()
+        category_image_cache.invalidate()
+        typeahead.suggest_cache.invalidate()
         flash(f'Activated {updated} products.', 'success')
     elif action == 'deactivate':
         updated = q.update({Product.is_active: False}, synchronize_session=False)
+        search_index.remove(product_ids)
         db.session.commit()
+        category_image_cache.invalidate()
+        typeahead.suggest_cache.invalidate()
         flash(f'Deactivated {updated} products.', 'success')
     elif action == 'delete':
         deleted = 0
         for p in q.all():
+            invalidate_for_product(p.id)
             db.session.delete(p)
             deleted += 1
+        search_index.remove(product_ids)
+        inventory.forget(product_ids)
         db.session.commit()
+        category_image_cache.invalidate()
+        typeahead.suggest_cache.invalidate()
         flash(f'Deleted {deleted} products.', 'success')
     else:
         flash('Unknown bulk action.', 'error')
@@ -1003,17 +1045,16 @@ def admin_orders():
         flash('Access denied', 'error')
         return redirect(url_for('main.index'))
 
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status')
 
     query = Order.query
     if status:
         query = query.filter_by(status=status)
 
-    orders = query.order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False)
+    orders = keyset_paginate(query, (Order.created_at, Order.id), request.args.get('page'), per_page=20)
+    exports = InvoiceExport.query.order_by(InvoiceExport.id.desc()).limit(5).all()
 
-    return render_template('admin/orders.html', orders=orders, selected_status=status)
+    return render_template('admin/orders.html', orders=orders, selected_status=status, exports=exports)
 
 
 @main_bp.route('/admin/orders/<int:order_id>/update_status', methods=['POST'])
@@ -1034,20 +1075,27 @@ def admin_update_order_status(order_id):
     order.status = new_status
     order.updated_at = datetime.now()
 
-    db.session.commit()
-
-    # Email notification
+    # Cancelling puts the goods back; reopening a cancelled order takes them again
+    lines = [(item.product_id, item.quantity) for item in order.items]
     try:
-        from utils.email_sender import send_order_status_update_email
-        send_order_status_update_email(order, old_status, new_status)
-    except Exception as e:
-        logging.warning(f"Failed to send status update email: {str(e)}")
+        if new_status == 'cancelled' and old_status != 'cancelled':
+            inventory.record(lines, inventory.RETURN, order.order_number, current_user.id)
+        elif old_status == 'cancelled' and new_status != 'cancelled':
+            inventory.take(lines, inventory.SALE, order.order_number, current_user.id)
+    except inventory.InsufficientStock as e:
+        db.session.rollback()
+        flash(f'Cannot reopen order #{order.id}: {e}', 'error')
+        return redirect(url_for('main.admin_orders'))
+
+    if new_status != old_status:
+        notifications.queue_status_update(order, old_status, new_status)
+
+    db.session.commit()
 
     # Invoice generation on delivered
     if new_status == 'delivered' and old_status != 'delivered':
         try:
-            from utils.invoice_generator import generate_invoice
-            generate_invoice(order.id)
+            invoice_cache.invoice_path(order)
             flash(f'Order #{order.id} marked as delivered and invoice generated!', 'success')
         except Exception as e:
             flash(f'Order status updated but invoice generation failed: {str(e)}', 'warning')
@@ -1067,14 +1115,78 @@ def admin_download_invoice(order_id):
     order = Order.query.get_or_404(order_id)
 
     try:
-        from utils.invoice_generator import generate_invoice
-        invoice_path = generate_invoice(order_id)
-        return send_file(invoice_path, as_attachment=True, download_name=f'invoice_{order.id}.pdf')
+        return invoice_cache.send_invoice(order, f'invoice_{order.id}.pdf')
     except Exception as e:
         flash(f'Error generating invoice: {str(e)}', 'error')
         return redirect(url_for('main.admin_orders'))
 
 
+@main_bp.route('/admin/invoices/export', methods=['POST'])
+@login_required
+def admin_export_invoices():
+    if current_user.role not in ['admin', 'storekeeper']:
+        flash('Access denied', 'error')
+        return redirect(url_for('main.index'))
+
+    try:
+        date_from = datetime.strptime(request.form['date_from'], '%Y-%m-%d').date() \
+            if request.form.get('date_from') else None
+        date_to = datetime.strptime(request.form['date_to'], '%Y-%m-%d').date() \
+            if request.form.get('date_to') else None
+    except ValueError:
+        flash('Invalid date range', 'error')
+        return redirect(url_for('main.admin_orders'))
+
+    # Rendered by the scheduler's invoice_exports job or `python invoice_export.py run`;
+    # the orders page polls admin_invoice_export_status until it is ready
+    export = InvoiceExport(date_from=date_from, date_to=date_to,
+                           order_status=request.form.get('status') or None, created_by=current_user.id)
+    db.session.add(export)
+    db.session.commit()
+
+    flash(f'Invoice export #{export.id} queued. Its progress is shown under Invoice exports; '
+          f'the download link appears when rendering finishes.', 'success')
+    return redirect(url_for('main.admin_orders'))
+
+
+@main_bp.route('/admin/invoices/exports/<int:export_id>')
+@login_required
+def admin_invoice_export_status(export_id):
+    if current_user.role not in ['admin', 'storekeeper']:
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+
+    export = InvoiceExport.query.get_or_404(export_id)
+    return jsonify({
+        'success': True,
+        'status': export.status,
+        'total': export.total or 0,
+        'done': export.done or 0,
+        'failed': export.failed or 0,
+        'error': export.error_message,
+        'download_url': url_for('main.admin_download_invoice_export', export_id=export.id)
+        if export.status == 'ready' else None,
+    })
+
+
+@main_bp.route('/admin/invoices/exports/<int:export_id>/download')
+@login_required
+def admin_download_invoice_export(export_id):
+    if current_user.role not in ['admin', 'storekeeper']:
+        flash('Access denied', 'error')
+        return redirect(url_for('main.index'))
+
+    export = InvoiceExport.query.get_or_404(export_id)
+    if export.status != 'ready':
+        flash(f'Invoice export #{export.id} is not ready yet ({export.done or 0}/{export.total or 0}).', 'warning')
+        return redirect(url_for('main.admin_orders'))
+
+    return Response(
+        stream_with_context(invoice_export.stream_zip(export)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=invoices_{export.id}.zip'},
+    )
+
+
 @main_bp.route('/admin/orders/<int:order_id>/resend_email', methods=['POST'])
 @login_required
 def admin_resend_order_email(order_id):
@@ -1084,12 +1196,9 @@ def admin_resend_order_email(order_id):
 
     order = Order.query.get_or_404(order_id)
 
-    try:
-        from utils.email_sender import send_order_confirmation_email
-        send_order_confirmation_email(order)
-        flash(f'Order confirmation email resent to {order.customer_email}!', 'success')
-    except Exception as e:
-        flash(f'Error sending email: {str(e)}', 'error')
+    notifications.queue_order_confirmation(order)
+    db.session.commit()
+    flash(f'Order confirmation email queued for {order.user.email}!', 'success')
 
     return redirect(url_for('main.admin_orders'))
 
@@ -1131,7 +1240,7 @@ def track_order(order_id):
          'date': getattr(order, 'delivered_at', None)}
     ]
 
-    settings = StoreSettings.query.first()
+    settings = get_store_settings()
     return render_template(
         'track_order.html',
         order=order,
@@ -1150,10 +1259,25 @@ def admin_communications():
     if current_user.role != 'admin':
         return redirect(url_for('main.login'))
 
-    settings = StoreSettings.query.first()
+    settings = get_store_settings()
     campaigns = Campaign.query.order_by(Campaign.created_at.desc()).all()
+    audience_counts = segments.counts()
+
+    return render_template('admin/communications.html', settings=settings, campaigns=campaigns,
+                           audience_counts=audience_counts)
+
 
-    return render_template('admin/communications.html', settings=settings, campaigns=campaigns)
+@main_bp.route('/admin/campaign-audience-count')
+@login_required
+def admin_campaign_audience_count():
+    """Recipient count for the campaign form preview, answered from the segment index."""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+
+    audience = request.args.get('target_audience', 'all')
+    if audience not in segments.SEGMENTS:
+        return jsonify({'success': False, 'error': 'Unknown target audience'}), 400
+    return jsonify({'success': True, 'target_audience': audience, 'recipients_count': segments.count(audience)})
 
 
 @main_bp.route('/admin/update-email-settings', methods=['POST'])
@@ -1174,7 +1298,9 @@ def admin_update_email_settings():
     settings.smtp_use_tls = 'smtp_use_tls' in request.form
     settings.email_notifications_enabled = 'email_notifications_enabled' in request.form
 
+    notifications.queue_settings_update('Email', current_user, settings)
     db.session.commit()
+    settings_cache.invalidate()
     flash('Email settings updated successfully!', 'success')
     return redirect(url_for('main.admin_communications'))
 
@@ -1195,7 +1321,9 @@ def admin_update_whatsapp_settings():
     settings.whatsapp_number = request.form.get('whatsapp_number')
     settings.whatsapp_enabled = 'whatsapp_enabled' in request.form
 
+    notifications.queue_settings_update('WhatsApp', current_user, settings)
     db.session.commit()
+    settings_cache.invalidate()
     flash('WhatsApp settings updated successfully!', 'success')
     return redirect(url_for('main.admin_communications'))
 
@@ -1216,14 +1344,18 @@ def admin_create_campaign():
     )
 
     if 'send_immediately' in request.form:
-        campaign.status = 'sent'
-        campaign.sent_at = datetime.utcnow()
-        # TODO: send immediately
+        # Delivered in the background by the campaign worker (campaigns.py)
+        campaign.status = 'sending'
     elif request.form.get('scheduled_time'):
         campaign.status = 'scheduled'
         campaign.scheduled_time = datetime.strptime(request.form.get('scheduled_time'), '%Y-%m-%dT%H:%M')
 
+    if campaign.target_audience not in campaign_engine.AUDIENCES:
+        flash('Unknown target audience.', 'error')
+        return redirect(url_for('main.admin_communications'))
+
     db.session.add(campaign)
+    campaign.recipients_count = campaign_engine.count_recipients(campaign.target_audience)
     db.session.commit()
 
     flash('Campaign created successfully!', 'success')
@@ -1240,7 +1372,7 @@ def admin_test_email():
     try:
         from utils.email_sender import send_test_email
 
-        settings = StoreSettings.query.first()
+        settings = get_store_settings()
         if not settings or not settings.smtp_server:
             return jsonify({'success': False, 'error': 'SMTP settings not configured'})
 
@@ -1260,7 +1392,7 @@ def admin_test_whatsapp():
     try:
         from utils.whatsapp_service import send_test_message
 
-        settings = StoreSettings.query.first()
+        settings = get_store_settings()
         if not settings or not settings.twilio_account_sid:
             return jsonify({'success': False, 'error': 'WhatsApp settings not configured'})
 
@@ -1296,6 +1428,7 @@ def admin_update_invoice_settings():
 
     try:
         db.session.commit()
+        settings_cache.invalidate()
         current_app.logger.info(
             f"Invoice settings updated: logo={settings.invoice_logo_url}, upi_logo={settings.invoice_upi_logo_url}")
         flash('Invoice logo settings updated successfully!', 'success')
@@ -1324,6 +1457,7 @@ def admin_update_templates():
     settings.marketing_whatsapp_template = request.form.get('marketing_whatsapp_template')
 
     db.session.commit()
+    settings_cache.invalidate()
     flash('Message templates updated successfully!', 'success')
     return redirect(url_for('main.admin_communications'))
 
@@ -1334,7 +1468,7 @@ def admin_homepage_settings():
     if current_user.role != 'admin':
         return redirect(url_for('main.login'))
 
-    settings = StoreSettings.query.first()
+    settings = get_store_settings()
     return render_template('admin/homepage_settings.html', settings=settings)
 
 
@@ -1376,15 +1510,12 @@ def admin_update_homepage_settings():
     settings.upi_qr_image_url = request.form.get('upi_qr_image_url')
 
     try:
+        notifications.queue_settings_update('Homepage', current_user, settings)
         db.session.commit()
+        settings_cache.invalidate()
         current_app.logger.info(
             f"Homepage settings updated: store_name={settings.store_name}, upi_id={settings.upi_id}")
 
-        try:
-            send_settings_update_notification(settings)
-        except Exception as email_error:
-            current_app.logger.warning(f"Failed to send email notification: {email_error}")
-
         flash('Homepage settings updated successfully! Changes are now live on your homepage.', 'success')
         return redirect(url_for('main.admin_homepage_settings'))
     except Exception as e:
@@ -1393,115 +1524,6 @@ def admin_update_homepage_settings():
         flash(f'Error saving settings: {str(e)}', 'error')
         return redirect(url_for('main.admin_homepage_settings'))
 
-# =========================
-# Email Notification Helper
-# =========================
-
-def send_settings_update_notification(settings):
-    """Send email notification when homepage settings are updated"""
-    try:
-        from flask_mail import Message
-
-        admin_users = User.query.filter_by(role='admin').all()
-
-        for admin in admin_users:
-            if not admin.email:
-                continue
-
-            msg = Message(
-                subject=f"Homepage Settings Updated - {settings.store_name or 'Thaavaram'}",
-                sender=current_app.config.get('MAIL_DEFAULT_SENDER'),
-                recipients=[admin.email]
-            )
-
-            # Plain text
-            msg.body = f"""
-Homepage Settings Updated
-
-Store Name: {settings.store_name or 'Not set'}
-Store Name (Tamil): {settings.store_name_tamil or 'Not set'}
-Tagline: {settings.tagline or 'Not set'}
-Hero Subtitle: {settings.hero_subtitle or 'Not set'}
-
-Payment Settings:
-UPI ID: {settings.upi_id or 'Not set'}
-UPI QR Image URL: {settings.upi_qr_image_url or 'Not set'}
-
-Delivery Settings:
-Free Delivery Above: ₹{settings.free_delivery_amount or 500}
-Standard Delivery Charge: ₹{settings.delivery_charge or 50}
-
-Contact Information:
-Phone: {settings.phone or 'Not set'}
-Email: {settings.email or 'Not set'}
-Address: {settings.address or 'Not set'}
-
-Updated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-Visit your store: {request.host_url}
-Admin Panel: {request.host_url}admin
-            """.strip()
-
-            # HTML version
-            msg.html = f"""
-<!DOCTYPE html>
-<html>
-<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-        <h2 style="color: #4CAF50; border-bottom: 2px solid #4CAF50; padding-bottom: 10px;">
-            Homepage Settings Updated
-        </h2>
-
-        <div style="background-color: #f9f9f9; padding: 15px; border-radius: 5px; margin: 20px 0;">
-            <h3 style="color: #333; margin-top: 0;">Store Information</h3>
-            <p><strong>Store Name:</strong> {settings.store_name or 'Not set'}</p>
-            <p><strong>Store Name (Tamil):</strong> {settings.store_name_tamil or 'Not set'}</p>
-            <p><strong>Tagline:</strong> {settings.tagline or 'Not set'}</p>
-            <p><strong>Hero Subtitle:</strong> {settings.hero_subtitle or 'Not set'}</p>
-        </div>
-
-        <div style="background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin: 20px 0;">
-            <h3 style="color: #333; margin-top: 0;">Payment Settings</h3>
-            <p><strong>UPI ID:</strong> {settings.upi_id or 'Not set'}</p>
-            <p><strong>UPI QR Image URL:</strong> {settings.upi_qr_image_url or 'Not set'}</p>
-        </div>
-
-        <div style="background-color: #fff3e0; padding: 15px; border-radius: 5px; margin: 20px 0;">
-            <h3 style="color: #333; margin-top: 0;">Delivery Settings</h3>
-            <p><strong>Free Delivery Above:</strong> ₹{settings.free_delivery_amount or 500}</p>
-            <p><strong>Standard Delivery Charge:</strong> ₹{settings.delivery_charge or 50}</p>
-        </div>
-
-        <div style="background-color: #e3f2fd; padding: 15px; border-radius: 5px; margin: 20px 0;">
-            <h3 style="color: #333; margin-top: 0;">Contact Information</h3>
-            <p><strong>Phone:</strong> {settings.phone or 'Not set'}</p>
-            <p><strong>Email:</strong> {settings.email or 'Not set'}</p>
-            <p><strong>Address:</strong> {settings.address or 'Not set'}</p>
-        </div>
-
-        <div style="margin: 30px 0; text-align: center;">
-            <a href="{request.host_url}" style="background-color: #4CAF50; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; margin-right: 10px;">View Store</a>
-            <a href="{request.host_url}admin" style="background-color: #2196F3; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">Admin Panel</a>
-        </div>
-
-        <p style="color: #666; font-size: 12px; text-align: center; margin-top: 30px;">
-            Updated at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        </p>
-    </div>
-</body>
-</html>
-            """.strip()
-
-            try:
-                mail.send(msg)
-                current_app.logger.info(f"Settings update notification sent to {admin.email}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to send settings notification to {admin.email}: {e}")
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to send settings notification: {e}")
-        raise
-
 # =========================
 # Store Settings
 # =========================
@@ -1551,6 +1573,7 @@ def admin_store_settings():
                 settings.logo_url = f"/static/uploads/{filename}"
 
         db.session.commit()
+        settings_cache.invalidate()
         flash('Store settings updated successfully!', 'success')
         return redirect(url_for('main.admin_store_settings'))
 
@@ -1587,6 +1610,7 @@ def admin_template_editor():
         settings.custom_css = request.form.get('custom_css')
 
         db.session.commit()
+        settings_cache.invalidate()
         flash('Template settings updated successfully!', 'success')
         return redirect(url_for('main.admin_template_editor'))
 
@@ -1659,6 +1683,8 @@ def admin_edit_category(category_id):
         category.sort_order = request.form.get('sort_order', type=int)
         category.is_active = bool(request.form.get('is_active'))
 
+        db.session.flush()
+        search_index.reindex(pid for (pid,) in db.session.query(Product.id).filter_by(category_id=category.id))
         db.session.commit()
         flash('Category updated successfully!', 'success')
         return redirect(url_for('main.admin_categories'))
@@ -1713,8 +1739,7 @@ def admin_users():
         flash('Access denied', 'error')
         return redirect(url_for('main.index'))
 
-    page = request.args.get('page', 1, type=int)
-    users = User.query.order_by(User.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
+    users = keyset_paginate(User.query, (User.created_at, User.id), request.args.get('page'), per_page=20)
     return render_template('admin/users.html', users=users)
 
 
@@ -1744,7 +1769,45 @@ def admin_add_user():
     return redirect(url_for('main.admin_users'))
 
 # =========================
-# Error handlers & Context
+# Slow Query Log
+# =========================
+
+@main_bp.route('/admin/slow-queries')
+@login_required
+def admin_slow_queries():
+    if current_user.role != 'admin':
+        flash('Access denied', 'error')
+        return redirect(url_for('main.index'))
+
+    import slow_queries
+
+    days = request.args.get('days', 7, type=int)
+    view = request.args.get('view') or None
+    fingerprint = request.args.get('fingerprint')
+
+    selected, plan, plan_error = None, None, None
+    if fingerprint:
+        selected = slow_queries.samples(fingerprint)
+        if selected:
+            try:
+                plan = slow_queries.explain(selected[0].statement)
+            except Exception as e:
+                db.session.rollback()
+                plan_error = str(e)
+
+    return render_template(
+        'admin/slow_queries.html',
+        groups=slow_queries.aggregate(days=days, endpoint=view),
+        days=days,
+        view=view,
+        fingerprint=fingerprint,
+        selected=selected,
+        plan=plan,
+        plan_error=plan_error
+    )
+
+# =========================
+# Error handlers
 # =========================
 
 @main_bp.app_errorhandler(404)
@@ -1758,19 +1821,6 @@ def internal_error(error):
     return render_template('errors/500.html'), 500
 
 
-@main_bp.app_context_processor
-def inject_cart_count():
-    cart_count = 0
-    if current_user.is_authenticated:
-        cart_count = CartItem.query.filter_by(user_id=current_user.id).count()
-    return dict(cart_count=cart_count)
-
-
-@main_bp.app_context_processor
-def inject_settings():
-    settings = StoreSettings.query.first()
-    return dict(store_settings=settings)
-
 # =========================
 # URL Helper (smart url_for for templates)
 # =========================
@@ -1871,6 +1921,7 @@ def register_endpoint_aliases(state):
     alias('main.admin_toggle_category',         'admin.admin_toggle_category',        '/admin/categories/<int:category_id>/toggle')
 
     alias('main.admin_users',                   'admin.admin_users',                  '/admin/users')
+    alias('main.admin_slow_queries',            'admin.admin_slow_queries',           '/admin/slow-queries')
     alias('main.admin_add_user',                'admin.admin_add_user',               '/admin/user/add')
 
     alias('main.admin_communications',          'admin.admin_communications',         '/admin/communications')
@@ -0,0 +1,285 @@
+"""
+Periodic job scheduler.
+
+Jobs are registered in code with `@job(name, every=seconds)`; their state
+lives in `scheduled_job`, one row per job. Any number of processes may run
+the scheduler (a thread in each app worker, on unless SCHEDULER_ENABLED=false,
+or a standalone `python scheduler.py`): a job is claimed with one conditional
+UPDATE that moves `next_run_at` to the end of the claimer's lease, so only
+one process runs it, and a process that dies mid-run simply lets the lease
+expire. When the job finishes, `next_run_at` is set one interval ahead.
+
+Finding work is a range scan on the `next_run_at` index
+(`WHERE next_run_at <= now ORDER BY next_run_at LIMIT 1`), and between
+ticks the scheduler sleeps until the earliest `next_run_at` rather than
+polling the tables the jobs work on.
+
+    python scheduler.py            # run forever
+    python scheduler.py once       # run what is due, then exit
+    python scheduler.py status     # list jobs and their last runs
+"""
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from extensions import db
+from models import Campaign, ScheduledJob
+
+Job = namedtuple('Job', 'name fn interval lease')
+
+JOBS = {}
+
+DEFAULT_LEASE_SECONDS = 600
+MAX_SLEEP_SECONDS = 30
+
+_config = {
+    'cart_retention_days': 30,
+    'slow_query_retention_days': 30,
+}
+
+
+def job(name, every, lease=DEFAULT_LEASE_SECONDS):
+    """Register a periodic job running every `every` seconds (at most `lease` seconds per run)."""
+    def decorator(fn):
+        JOBS[name] = Job(name, fn, every, lease)
+        return fn
+    return decorator
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+# =========================
+# Jobs
+# =========================
+
+@job('campaigns', every=60, lease=3600)
+def _send_campaigns():
+    """Start scheduled campaigns that are due, then deliver everything waiting."""
+    import campaigns
+
+    now = datetime.utcnow()
+    started = db.session.execute(
+        update(Campaign)
+        .where(Campaign.status == 'scheduled', Campaign.scheduled_time <= now)
+        .values(status='sending')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    finished = campaigns.run_pending()
+    return f"{started} started, {len(finished)} finished"
+
+
+@job('notification_outbox', every=15)
+def _drain_outbox():
+    import notifications
+
+    sent, failed = notifications.drain()
+    return f"{sent} sent, {failed} failed"
+
+
+@job('release_reservations', every=60)
+def _release_reservations():
+    import inventory
+
+    released = inventory.release_expired()
+    db.session.commit()
+    return f"{released} products restocked"
+
+
+@job('inventory_compact', every=300)
+def _compact_inventory():
+    import inventory
+
+    return f"{inventory.compact()} products compacted"
+
+
+@job('invoice_exports', every=15, lease=3600)
+def _render_invoice_exports():
+    import invoice_export
+
+    return f"{len(invoice_export.run_pending())} exports rendered"
+
+
+@job('stats_rollup', every=3600)
+def _rollup_stats():
+    import stats
+
+    return f"{stats.rollup()} days rolled up"
+
+
+@job('cart_cleanup', every=86400)
+def _cleanup_carts():
+    from cart_summary import expire_stale_carts
+
+    return f"{expire_stale_carts(_config['cart_retention_days'])} stale carts emptied"
+
+
+@job('slow_query_prune', every=86400)
+def _prune_slow_queries():
+    import slow_queries
+
+    return f"{slow_queries.prune(_config['slow_query_retention_days'])} log rows removed"
+
+
+# =========================
+# Running
+# =========================
+
+def sync_jobs(now=None):
+    """Create rows for newly registered jobs (due immediately) and pick up interval changes."""
+    now = now or datetime.utcnow()
+    existing = {row.name: row for row in ScheduledJob.query}
+    for j in JOBS.values():
+        row = existing.get(j.name)
+        if row is None:
+            db.session.add(ScheduledJob(name=j.name, interval_seconds=j.interval, next_run_at=now, run_count=0))
+        elif row.interval_seconds != j.interval:
+            row.interval_seconds = j.interval
+            row.next_run_at = min(row.next_run_at, now + timedelta(seconds=j.interval))
+    try:
+        db.session.commit()
+    except Exception:
+        # Another process registered the same jobs
+        db.session.rollback()
+
+
+def _claim(now, owner):
+    """Claim the most overdue job; returns its name or None."""
+    names = list(JOBS)
+    while True:
+        name = db.session.execute(
+            select(ScheduledJob.name)
+            .where(ScheduledJob.next_run_at <= now, ScheduledJob.name.in_(names))
+            .order_by(ScheduledJob.next_run_at)
+            .limit(1)
+        ).scalar()
+        if name is None:
+            db.session.commit()
+            return None
+        lease_until = now + timedelta(seconds=JOBS[name].lease)
+        claimed = db.session.execute(
+            update(ScheduledJob)
+            .where(ScheduledJob.name == name, ScheduledJob.next_run_at <= now)
+            .values(next_run_at=lease_until, lease_until=lease_until, leased_by=owner, last_started_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return name
+        # Lost the race for this one; look for the next due job
+
+
+def _finish(name, owner, status, error=None):
+    finished = datetime.utcnow()
+    db.session.execute(
+        update(ScheduledJob)
+        .where(ScheduledJob.name == name, ScheduledJob.leased_by == owner)
+        .values(next_run_at=finished + timedelta(seconds=JOBS[name].interval), lease_until=None,
+                leased_by=None, last_finished_at=finished, last_status=status, last_error=error,
+                run_count=ScheduledJob.run_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def run_due(owner=None):
+    """Run every job that is due now. Returns [(name, status)]."""
+    owner = owner or worker_id()
+    ran = []
+    while True:
+        name = _claim(datetime.utcnow(), owner)
+        if name is None:
+            return ran
+        try:
+            summary = JOBS[name].fn()
+            logging.info(f"Job {name}: {summary}")
+            db.session.rollback()  # nothing a job left uncommitted should leak into _finish
+            _finish(name, owner, 'ok')
+            ran.append((name, 'ok'))
+        except Exception as e:
+            db.session.rollback()
+            logging.exception(f"Job {name} failed")
+            _finish(name, owner, 'error', f"{type(e).__name__}: {e}")
+            ran.append((name, 'error'))
+
+
+def seconds_until_next_run():
+    next_run = db.session.execute(
+        select(func.min(ScheduledJob.next_run_at)).where(ScheduledJob.name.in_(list(JOBS)))).scalar()
+    db.session.commit()
+    if next_run is None:
+        return MAX_SLEEP_SECONDS
+    return min(max((next_run - datetime.utcnow()).total_seconds(), 0), MAX_SLEEP_SECONDS)
+
+
+def run_forever(stop=None):
+    owner = worker_id()
+    sync_jobs()
+    while stop is None or not stop.is_set():
+        try:
+            run_due(owner)
+            wait = seconds_until_next_run()
+        except Exception:
+            db.session.rollback()
+            logging.exception('Scheduler tick failed')
+            wait = MAX_SLEEP_SECONDS
+        if stop is not None:
+            stop.wait(wait)
+        else:
+            time.sleep(wait)
+
+
+def _thread_main(app, stop):
+    with app.app_context():
+        run_forever(stop)
+
+
+def init_app(app):
+    _config.update(
+        cart_retention_days=app.config.get('CART_RETENTION_DAYS', _config['cart_retention_days']),
+        slow_query_retention_days=app.config.get('SLOW_QUERY_RETENTION_DAYS', _config['slow_query_retention_days']),
+    )
+    if app.testing:
+        return
+    if app.config.get('SCHEDULER_ENABLED'):
+        stop = threading.Event()
+        thread = threading.Thread(target=_thread_main, args=(app, stop), name='scheduler', daemon=True)
+        app.extensions['scheduler'] = stop
+        thread.start()
+    else:
+        logging.warning(
+            "Scheduler thread disabled (SCHEDULER_ENABLED=false): notification emails, campaigns, "
+            "invoice exports and inventory compaction need `python scheduler.py` running")
+
+
+if __name__ == '__main__':
+    # This process is the scheduler; the app must not start a second one in a thread
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    with app.app_context():
+        if command == 'run':
+            run_forever()
+        elif command == 'once':
+            sync_jobs()
+            for name, status in run_due():
+                print(f"{name}: {status}")
+        elif command == 'status':
+            sync_jobs()
+            for row in ScheduledJob.query.order_by(ScheduledJob.next_run_at):
+                print(f"{row.name:<24} next {row.next_run_at:%Y-%m-%d %H:%M:%S}  last {row.last_status or '-'}"
+                      f"  runs {row.run_count or 0}  {row.last_error or ''}")
+        else:
+            print(__doc__)
+            sys.exit(2)
@@ -0,0 +1,300 @@
+"""
+Product full-text search.
+
+Indexes name, name_tamil, description, description_tamil and the category
+name of every active product. On SQLite with FTS5 the index is a virtual
+table ranked with bm25(); elsewhere (Postgres, SQLite without FTS5) an
+in-process inverted index is used. Both see the same normalized text (see
+tamil_text.py), match every query word and treat the last word as a prefix
+so results show up while the user is still typing.
+
+Admin product writes call `search_index.reindex(ids)` / `search_index.remove(ids)`
+before committing.
+"""
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import tamil_text
+from extensions import db
+from models import Product, Category
+
+FIELDS = ('name', 'name_tamil', 'description', 'description_tamil', 'category_name')
+
+# Relative importance of a match in each field (same order as FIELDS)
+FIELD_WEIGHTS = (10.0, 10.0, 2.0, 2.0, 4.0)
+
+# A prefix word expands to at most this many vocabulary terms
+MAX_PREFIX_EXPANSIONS = 64
+
+# unicode61 splits words at combining marks; Tamil vowel signs, pulli and
+# the au length mark must stay inside the token (same words as tamil_text.tokenize)
+TAMIL_TOKENCHARS = ''.join(chr(c) for c in range(0x0BBE, 0x0BCE)) + '\u0BD7'
+FTS5_TOKENIZER = f"unicode61 remove_diacritics 2 tokenchars '{TAMIL_TOKENCHARS}'"
+
+
+def _product_rows(product_ids=None):
+    """(id, is_active, name, name_tamil, description, description_tamil, category_name, category_id) rows."""
+    query = (
+        db.session.query(
+            Product.id, Product.is_active, Product.name, Product.name_tamil,
+            Product.description, Product.description_tamil, Category.name,
+            Product.category_id,
+        )
+        .outerjoin(Category, Category.id == Product.category_id)
+    )
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    else:
+        query = query.filter(Product.is_active.is_(True))
+    return query.yield_per(1000)
+
+
+def _query_terms(query):
+    """Tokens of a search string; the last one is a prefix unless the query ends with a space."""
+    tokens = tamil_text.tokenize(query)
+    prefix = bool(tokens) and not query[-1:].isspace()
+    return tokens, prefix
+
+
+class FTS5Backend:
+    """SQLite FTS5 virtual table keyed by product id (rowid)."""
+
+    name = 'fts5'
+    table = 'product_search'
+
+    def create(self):
+        existing = db.session.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': self.table}
+        ).scalar()
+        if existing is not None and 'tokenchars' not in existing:
+            # Built with the old tokenizer; needs_rebuild() refills it
+            db.session.execute(text(f"DROP TABLE {self.table}"))
+        tokenizer = FTS5_TOKENIZER.replace("'", "''")
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{', '.join(FIELDS)}, tokenize = '{tokenizer}')"
+        ))
+        db.session.commit()
+
+    def needs_rebuild(self):
+        indexed = db.session.execute(text(f"SELECT count(*) FROM {self.table}")).scalar()
+        active = Product.query.filter(Product.is_active.is_(True)).count()
+        return indexed != active
+
+    def rebuild(self):
+        db.session.execute(text(f"DELETE FROM {self.table}"))
+        self._upsert(row for row in _product_rows())
+        db.session.commit()
+
+    def reindex(self, product_ids):
+        self.remove(product_ids)
+        self._upsert(row for row in _product_rows(product_ids) if row[1])
+
+    def remove(self, product_ids):
+        if product_ids:
+            db.session.execute(
+                text(f"DELETE FROM {self.table} WHERE rowid = :id"), [{'id': pid} for pid in product_ids]
+            )
+
+    def _upsert(self, rows):
+        stmt = text(
+            f"INSERT INTO {self.table} (rowid, {', '.join(FIELDS)}) "
+            f"VALUES (:id, {', '.join(':' + f for f in FIELDS)})"
+        )
+        batch = []
+        for row in rows:
+            params = {'id': row[0]}
+            params.update({field: tamil_text.normalize(value) for field, value in zip(FIELDS, row[2:7])})
+            batch.append(params)
+            if len(batch) >= 1000:
+                db.session.execute(stmt, batch)
+                batch = []
+        if batch:
+            db.session.execute(stmt, batch)
+
+    def search(self, query, limit, category_id=None):
+        tokens, prefix = _query_terms(query)
+        if not tokens:
+            return []
+        terms = ['"%s"' % t.replace('"', '""') for t in tokens]
+        if prefix:
+            terms[-1] += '*'
+        weights = ', '.join(str(w) for w in FIELD_WEIGHTS)
+        params = {'match': ' '.join(terms), 'limit': limit}
+        join = ''
+        if category_id is not None:
+            # Filter before LIMIT so a category's matches aren't crowded out by other categories
+            join = f"JOIN product ON product.id = {self.table}.rowid AND product.category_id = :category_id "
+            params['category_id'] = category_id
+        rows = db.session.execute(
+            text(
+                f"SELECT {self.table}.rowid FROM {self.table} {join}WHERE {self.table} MATCH :match "
+                f"ORDER BY bm25({self.table}, {weights}) LIMIT :limit"
+            ),
+            params,
+        )
+        return [row[0] for row in rows]
+
+
+class MemoryBackend:
+    """In-process inverted index: term -> {product_id: weighted term frequency}."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._categories = {}
+        self._vocab = []
+        self.built_at = 0.0
+
+    def create(self):
+        pass
+
+    def needs_rebuild(self):
+        return not self.built_at
+
+    def rebuild(self):
+        postings, doc_terms, categories = defaultdict(dict), {}, {}
+        for row in _product_rows():
+            doc_terms[row[0]] = self._add(postings, row)
+            categories[row[0]] = row[7]
+        with self._lock:
+            self._postings, self._doc_terms, self._categories = postings, doc_terms, categories
+            self._vocab = sorted(postings)
+            self.built_at = time.monotonic()
+
+    def reindex(self, product_ids):
+        rows = [row for row in _product_rows(product_ids) if row[1]]
+        with self._lock:
+            self.remove(product_ids)
+            for row in rows:
+                self._doc_terms[row[0]] = self._add(self._postings, row, self._vocab)
+                self._categories[row[0]] = row[7]
+
+    def remove(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._categories.pop(product_id, None)
+                for term in self._doc_terms.pop(product_id, ()):
+                    docs = self._postings.get(term)
+                    if docs is not None:
+                        docs.pop(product_id, None)
+
+    @staticmethod
+    def _add(postings, row, vocab=None):
+        product_id, terms = row[0], set()
+        for weight, value in zip(FIELD_WEIGHTS, row[2:7]):
+            for term in tamil_text.tokenize(value):
+                docs = postings[term]
+                if not docs and vocab is not None:
+                    i = bisect_left(vocab, term)
+                    if i == len(vocab) or vocab[i] != term:
+                        insort(vocab, term)
+                docs[product_id] = docs.get(product_id, 0.0) + weight
+                terms.add(term)
+        return terms
+
+    def _expand(self, term):
+        i = bisect_left(self._vocab, term)
+        expansions = []
+        while i < len(self._vocab) and self._vocab[i].startswith(term) and len(expansions) < MAX_PREFIX_EXPANSIONS:
+            expansions.append(self._vocab[i])
+            i += 1
+        return expansions
+
+    def search(self, query, limit, category_id=None):
+        tokens, prefix = _query_terms(query)
+        if not tokens:
+            return []
+        with self._lock:
+            categories = self._categories
+            total = max(len(self._doc_terms), 1)
+            scores = None
+            for n, token in enumerate(tokens):
+                terms = self._expand(token) if prefix and n == len(tokens) - 1 else [token]
+                token_scores = {}
+                for term in terms:
+                    docs = self._postings.get(term)
+                    if not docs:
+                        continue
+                    idf = math.log(1 + total / len(docs))
+                    for product_id, tf in docs.items():
+                        score = idf * tf / (tf + 1.0)
+                        if score > token_scores.get(product_id, 0.0):
+                            token_scores[product_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+                if category_id is not None:
+                    scores = {pid: s for pid, s in scores.items() if categories.get(pid) == category_id}
+                if not scores:
+                    return []
+        return sorted(scores, key=lambda pid: (-scores[pid], pid))[:limit]
+
+
+class ProductSearchIndex:
+    """Picks a backend on first use and keeps it built."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.backend = None
+        self.max_results = 500
+        self.ttl = 600
+        self.prefer_fts5 = True
+
+    def init_app(self, app):
+        self.max_results = app.config.get('SEARCH_MAX_RESULTS', 500)
+        self.ttl = app.config.get('SEARCH_INDEX_TTL', 600)
+        self.prefer_fts5 = app.config.get('SEARCH_USE_FTS5', True)
+        self.backend = None
+
+    def _ready(self):
+        with self._lock:
+            if self.backend is None:
+                self.backend = self._choose_backend()
+                if self.backend.needs_rebuild():
+                    self.backend.rebuild()
+            elif isinstance(self.backend, MemoryBackend) and time.monotonic() - self.backend.built_at > self.ttl:
+                # Other worker processes may have edited products since we built.
+                self.backend.rebuild()
+        return self.backend
+
+    def _choose_backend(self):
+        if self.prefer_fts5 and db.engine.dialect.name == 'sqlite':
+            backend = FTS5Backend()
+            try:
+                backend.create()
+                return backend
+            except OperationalError as e:
+                db.session.rollback()
+                logging.info(f"FTS5 unavailable, using in-process search index: {e}")
+        backend = MemoryBackend()
+        backend.create()
+        return backend
+
+    def search(self, query, limit=None, category_id=None):
+        """Ranked ids of active products matching `query` (best first), optionally within one category."""
+        return self._ready().search(query, limit or self.max_results, category_id)
+
+    def reindex(self, product_ids):
+        """Refresh the given products (inactive ones are dropped). Call before commit."""
+        self._ready().reindex(list(product_ids))
+
+    def remove(self, product_ids):
+        self._ready().remove(list(product_ids))
+
+    def rebuild(self):
+        self._ready().rebuild()
+
+
+search_index = ProductSearchIndex()
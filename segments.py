@@ -0,0 +1,300 @@
+"""
+Customer segments for campaign targeting.
+
+Segment membership is derived from `customer_activity`, one row per
+customer who has ordered (orders, first and last order time). `place_order`
+updates that row through `record_order()` in the same transaction as the
+order, so no segment ever needs to join or aggregate `order`.
+
+On top of the table each process keeps a SegmentIndex: sorted id arrays of
+the active customers and of those who have ordered, plus the sorted last
+order times. Counting a segment is a length or one bisect, and listing
+members is a bisect and a slice. The index is built once per
+SEGMENT_INDEX_TTL and caught up on every use with three range scans: new
+users by id, and users (deactivated, reactivated, role changed) and
+activity rows by their `updated_at`.
+
+`condition()` is the same segment as a SQL condition on User; the campaign
+worker pages through `members()` and re-checks each page with it, so a
+customer deactivated by a bulk UPDATE that did not stamp `updated_at` is
+still skipped.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from caching import CachedValue
+from extensions import db
+from models import CustomerActivity, Order, User
+
+RECENT_DAYS = 30
+
+# Activity rows are re-read this far behind the newest one seen, so a row
+# stamped before another process committed a later one is not missed
+CATCH_UP_SLACK = timedelta(seconds=60)
+
+# INSERT constructs that support ON CONFLICT DO UPDATE, by dialect name
+UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class UnknownSegment(ValueError):
+    pass
+
+
+def _recent_cutoff(now=None):
+    return (now or datetime.utcnow()) - timedelta(days=RECENT_DAYS)
+
+
+def _active_customer():
+    return (User.role == 'customer') & User._is_active.is_(True)
+
+
+def _has_activity(extra=None):
+    condition = CustomerActivity.user_id == User.id
+    if extra is not None:
+        condition = condition & extra
+    return exists().where(condition)
+
+
+# segment name -> extra condition on User (on top of "active customer")
+SEGMENTS = {
+    'all': lambda: None,
+    'customers_with_orders': lambda: _has_activity(),
+    'recent_customers': lambda: _has_activity(CustomerActivity.last_order_at >= _recent_cutoff()),
+    'no_orders': lambda: ~_has_activity(),
+}
+
+
+def _check(name):
+    if name not in SEGMENTS:
+        raise UnknownSegment(f"Unknown customer segment {name!r}")
+
+
+def condition(name):
+    """SQL condition on User selecting the members of segment `name`."""
+    _check(name)
+    extra = SEGMENTS[name]()
+    return _active_customer() if extra is None else _active_customer() & extra
+
+
+class SegmentIndex:
+    """Sorted id arrays for the segments of one process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.customers = array('i')   # active customer ids
+        self.ordered = array('i')     # customers with at least one order
+        self.last_order = {}          # user id -> last order time, for `ordered`
+        self.order_times = []         # sorted values of last_order
+        self.max_user_id = 0
+        self.watermark = None         # newest activity updated_at seen
+        self.user_watermark = None    # newest user updated_at seen
+
+    def _is_customer(self, user_id):
+        i = bisect_left(self.customers, user_id)
+        return i < len(self.customers) and self.customers[i] == user_id
+
+    def _load(self, user_ids, activity):
+        """Initial fill, sorting once instead of inserting row by row."""
+        self.customers.extend(user_ids)
+        for user_id, last_order_at in activity:
+            if last_order_at is not None and self._is_customer(user_id):
+                self.last_order[user_id] = last_order_at
+        self.ordered.extend(sorted(self.last_order))
+        self.order_times = sorted(self.last_order.values())
+
+    def _apply(self, user_id, last_order_at):
+        if last_order_at is None or not self._is_customer(user_id):
+            return
+        previous = self.last_order.get(user_id)
+        if previous == last_order_at:
+            return
+        if previous is None:
+            insort(self.ordered, user_id)
+        else:
+            del self.order_times[bisect_left(self.order_times, previous)]
+        self.last_order[user_id] = last_order_at
+        insort(self.order_times, last_order_at)
+
+    def _set_customer(self, user_id, is_customer, last_order_at):
+        i = bisect_left(self.customers, user_id)
+        present = i < len(self.customers) and self.customers[i] == user_id
+        if is_customer and not present:
+            self.customers.insert(i, user_id)
+            self._apply(user_id, last_order_at)
+        elif present and not is_customer:
+            del self.customers[i]
+            previous = self.last_order.pop(user_id, None)
+            if previous is not None:
+                del self.ordered[bisect_left(self.ordered, user_id)]
+                del self.order_times[bisect_left(self.order_times, previous)]
+
+    def catch_up(self):
+        """Pick up customers registered or changed and orders placed since the last call (in any process)."""
+        started = datetime.utcnow()
+        with self.lock:
+            max_user_id, watermark, user_watermark = self.max_user_id, self.watermark, self.user_watermark
+        user_ids = list(db.session.execute(
+            select(User.id).where(User.id > max_user_id, _active_customer()).order_by(User.id)).scalars())
+        changed = []
+        if user_watermark is not None:
+            changed = db.session.execute(
+                select(User.id, User.updated_at, _active_customer().label('is_customer'),
+                       CustomerActivity.last_order_at)
+                .outerjoin(CustomerActivity, CustomerActivity.user_id == User.id)
+                .where(User.id <= max_user_id, User.updated_at >= user_watermark - CATCH_UP_SLACK)
+            ).all()
+        activity_query = select(CustomerActivity.user_id, CustomerActivity.last_order_at,
+                                CustomerActivity.updated_at)
+        if watermark is not None:
+            activity_query = activity_query.where(CustomerActivity.updated_at >= watermark - CATCH_UP_SLACK)
+        activity = db.session.execute(activity_query).all()
+
+        with self.lock:
+            # Another thread may have caught up meanwhile; new ids are only ever appended
+            user_ids = [user_id for user_id in user_ids if user_id > self.max_user_id]
+            if self.watermark is None:
+                self._load(user_ids, ((row.user_id, row.last_order_at) for row in activity))
+            else:
+                self.customers.extend(user_ids)
+                for row in changed:
+                    self._set_customer(row.id, bool(row.is_customer), row.last_order_at)
+                for row in activity:
+                    self._apply(row.user_id, row.last_order_at)
+            if user_ids:
+                self.max_user_id = user_ids[-1]
+            newest_user = max((row.updated_at for row in changed if row.updated_at is not None), default=None)
+            if self.user_watermark is None:
+                # Changes from before this scan are already in the initial load
+                self.user_watermark = started
+            elif newest_user is not None and newest_user > self.user_watermark:
+                self.user_watermark = newest_user
+            newest = max((row.updated_at for row in activity if row.updated_at is not None), default=None)
+            if newest is not None and (self.watermark is None or newest > self.watermark):
+                self.watermark = newest
+            elif self.watermark is None:
+                self.watermark = datetime.utcnow()
+
+    def count(self, name, now=None):
+        with self.lock:
+            if name == 'all':
+                return len(self.customers)
+            if name == 'customers_with_orders':
+                return len(self.ordered)
+            if name == 'no_orders':
+                return len(self.customers) - len(self.ordered)
+            if name == 'recent_customers':
+                return len(self.order_times) - bisect_left(self.order_times, _recent_cutoff(now))
+        raise UnknownSegment(f"Unknown customer segment {name!r}")
+
+    def members(self, name, after_id=0, limit=None, now=None):
+        """Member ids greater than `after_id`, ascending, at most `limit` of them."""
+        with self.lock:
+            if name in ('all', 'customers_with_orders'):
+                ids = self.customers if name == 'all' else self.ordered
+                start = bisect_right(ids, after_id)
+                return ids[start:None if limit is None else start + limit].tolist()
+            if name == 'recent_customers':
+                ids, cutoff = self.ordered, _recent_cutoff(now)
+                wanted = lambda user_id: self.last_order[user_id] >= cutoff
+            elif name == 'no_orders':
+                ids = self.customers
+                wanted = lambda user_id: user_id not in self.last_order
+            else:
+                raise UnknownSegment(f"Unknown customer segment {name!r}")
+            found = []
+            for i in range(bisect_right(ids, after_id), len(ids)):
+                if wanted(ids[i]):
+                    found.append(ids[i])
+                    if limit is not None and len(found) >= limit:
+                        break
+            return found
+
+
+def _build_index():
+    index = SegmentIndex()
+    index.catch_up()
+    return index
+
+
+segment_cache = CachedValue(_build_index, ttl=300)
+
+
+def _index():
+    index = segment_cache.get()
+    index.catch_up()
+    return index
+
+
+def count(name):
+    """Number of customers in segment `name`, from the in-process index."""
+    _check(name)
+    return _index().count(name)
+
+
+def members(name, after_id=0, limit=None):
+    """Ids of the customers in segment `name` after `after_id`, ascending."""
+    _check(name)
+    return _index().members(name, after_id, limit)
+
+
+def counts():
+    """{segment name: member count} for every segment (campaign form preview)."""
+    index = _index()
+    return {name: index.count(name) for name in SEGMENTS}
+
+
+def record_order(user_id, placed_at=None):
+    """
+    Count a new order in the customer's activity row. Call before the order
+    is committed; the row is created on the customer's first order.
+    """
+    now = datetime.utcnow()
+    placed_at = placed_at or now
+    upsert = UPSERT_INSERTS.get(db.engine.dialect.name)
+    if upsert is not None:
+        # One statement, so two first orders from the same customer can't both try to insert
+        stmt = upsert(CustomerActivity).values(user_id=user_id, orders_count=1, first_order_at=placed_at,
+                                               last_order_at=placed_at, updated_at=now)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[CustomerActivity.user_id],
+            set_={'orders_count': CustomerActivity.orders_count + 1,
+                  'last_order_at': stmt.excluded.last_order_at, 'updated_at': stmt.excluded.updated_at},
+        ))
+        return
+    result = db.session.execute(
+        update(CustomerActivity)
+        .where(CustomerActivity.user_id == user_id)
+        .values(orders_count=CustomerActivity.orders_count + 1, last_order_at=placed_at, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.add(CustomerActivity(user_id=user_id, orders_count=1, first_order_at=placed_at,
+                                        last_order_at=placed_at, updated_at=now))
+
+
+def rebuild_customer_activity():
+    """Recompute every activity row from Order in one INSERT ... SELECT (backfill / repair)."""
+    db.session.execute(delete(CustomerActivity))
+    db.session.execute(
+        insert(CustomerActivity).from_select(
+            ['user_id', 'orders_count', 'first_order_at', 'last_order_at', 'updated_at'],
+            select(
+                Order.user_id,
+                func.count(Order.id),
+                func.min(Order.created_at),
+                func.max(Order.created_at),
+                literal(datetime.utcnow(), db.DateTime),
+            )
+            .group_by(Order.user_id)
+        )
+    )
+    segment_cache.invalidate()
+
+
+def init_app(app):
+    segment_cache.ttl = app.config.get('SEGMENT_INDEX_TTL', 300)
@@ -0,0 +1,127 @@
+"""
+Named sequence allocator.
+
+Counters live in `sequence_counter`, one row per sequence name (for example
+`order:20240601` for the day's order numbers). A value costs one atomic
+UPDATE .. RETURNING on that row, and each worker reserves a block of
+SEQUENCE_BLOCK_SIZE values at a time and hands them out from memory, so
+most allocations do not touch the database at all. Two workers can never
+receive the same value; numbers from a block a worker never uses (restart,
+rollback) are skipped, so sequences may have gaps and values from different
+workers interleave.
+
+Blocks are reserved in their own short transaction, which releases the
+counter row lock immediately instead of holding it until the request
+commits. SQLite locks the whole database for any write, so there the value
+is taken inside the caller's transaction without caching (a separate
+connection would wait on the caller's own write lock).
+
+When a counter row is first created, `start(conn)` supplies its first
+value; `next_after` continues after the highest existing code with a given
+prefix, so sequences can be introduced over data numbered the old way.
+"""
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import SequenceCounter
+
+DEFAULT_BLOCK_SIZE = 20
+
+_block_size = DEFAULT_BLOCK_SIZE
+_blocks = {}  # name -> [next, end) reserved by this process
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def _reserve(conn, name, count, start=None):
+    """Reserve `count` consecutive values of `name` on `conn`; returns the first."""
+    table = SequenceCounter.__table__
+    for _ in range(3):
+        now = datetime.utcnow()
+        if conn.dialect.update_returning:
+            end = conn.execute(
+                update(table).where(table.c.name == name)
+                .values(next_value=table.c.next_value + count, updated_at=now)
+                .returning(table.c.next_value)
+            ).scalar()
+        else:
+            end = conn.execute(select(table.c.next_value).where(table.c.name == name).with_for_update()).scalar()
+            if end is not None:
+                end += count
+                conn.execute(update(table).where(table.c.name == name).values(next_value=end, updated_at=now))
+        if end is not None:
+            return end - count
+
+        first = start(conn) if start else 1
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(table).values(name=name, next_value=first + count, updated_at=now))
+            return first
+        except IntegrityError:
+            # Another worker created the row first; take the values from it
+            continue
+    raise RuntimeError(f"Could not allocate from sequence {name!r}")
+
+
+def allocate(name, count=1, start=None):
+    """Reserve `count` consecutive values of the sequence `name`; returns a range."""
+    if db.engine.dialect.name == 'sqlite':
+        first = _reserve(db.session.connection(), name, count, start)
+        return range(first, first + count)
+
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            # Forked worker: blocks reserved by the parent belong to the parent
+            _blocks.clear()
+            _pid = os.getpid()
+        block = _blocks.get(name)
+        if block and block[1] - block[0] >= count:
+            first = block[0]
+            block[0] += count
+            return range(first, first + count)
+
+        size = max(count, _block_size)
+        with db.engine.begin() as conn:
+            first = _reserve(conn, name, size, start)
+        _blocks[name] = [first + count, first + size]
+        return range(first, first + count)
+
+
+def next_value(name, start=None):
+    return allocate(name, 1, start)[0]
+
+
+def next_after(column, prefix):
+    """
+    `start` callback continuing after the highest `column` value that is
+    `prefix` followed by digits (longest first, so 10000 sorts after 9999).
+    Runs once per sequence name, when its counter row is created.
+    """
+    def start(conn):
+        codes = conn.execute(
+            select(column).where(column.like(f'{prefix}%'))
+            .order_by(func.length(column).desc(), column.desc())
+        ).scalars()
+        for code in codes:
+            suffix = code[len(prefix):]
+            if code.startswith(prefix) and suffix.isdigit():
+                return int(suffix) + 1
+        return 1
+    return start
+
+
+def reset():
+    """Forget blocks reserved by this process (tests, after changing counters by hand)."""
+    with _lock:
+        _blocks.clear()
+
+
+def init_app(app):
+    global _block_size
+    _block_size = max(1, app.config.get('SEQUENCE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
@@ -0,0 +1,104 @@
+"""
+Slow query log reporting for the admin section.
+
+Rows are written by sql_instrumentation; this module aggregates them by
+statement fingerprint and produces EXPLAIN output for a sample statement.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from extensions import db
+from models import SlowQueryLog
+
+_PG_PARAM = re.compile(r'%\((\w+)\)s')
+
+
+def aggregate(days=7, endpoint=None, limit=100):
+    """Per-fingerprint stats over the last `days` days, worst total time first."""
+    since = datetime.utcnow() - timedelta(days=days)
+    base = db.session.query(SlowQueryLog).filter(SlowQueryLog.created_at >= since)
+    if endpoint:
+        base = base.filter(SlowQueryLog.endpoint == endpoint)
+
+    rows = (
+        base.with_entities(
+            SlowQueryLog.fingerprint,
+            func.count(SlowQueryLog.id).label('count'),
+            func.avg(SlowQueryLog.duration_ms).label('avg_ms'),
+            func.max(SlowQueryLog.duration_ms).label('max_ms'),
+            func.sum(SlowQueryLog.duration_ms).label('total_ms'),
+            func.max(SlowQueryLog.created_at).label('last_seen'),
+            func.max(SlowQueryLog.id).label('sample_id'),
+        )
+        .group_by(SlowQueryLog.fingerprint)
+        .order_by(func.sum(SlowQueryLog.duration_ms).desc())
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return []
+
+    fingerprints = [row.fingerprint for row in rows]
+    samples = dict(
+        db.session.query(SlowQueryLog.id, SlowQueryLog.statement)
+        .filter(SlowQueryLog.id.in_([row.sample_id for row in rows]))
+        .all()
+    )
+    endpoints = defaultdict(list)
+    for fp, ep, n in (
+        base.with_entities(SlowQueryLog.fingerprint, SlowQueryLog.endpoint, func.count(SlowQueryLog.id))
+        .filter(SlowQueryLog.fingerprint.in_(fingerprints))
+        .group_by(SlowQueryLog.fingerprint, SlowQueryLog.endpoint)
+    ):
+        endpoints[fp].append((ep, n))
+
+    return [
+        {
+            'fingerprint': row.fingerprint,
+            'count': row.count,
+            'avg_ms': row.avg_ms,
+            'max_ms': row.max_ms,
+            'total_ms': row.total_ms,
+            'last_seen': row.last_seen,
+            'statement': samples.get(row.sample_id, ''),
+            'endpoints': sorted(endpoints[row.fingerprint], key=lambda e: -e[1]),
+        }
+        for row in rows
+    ]
+
+
+def samples(fingerprint, limit=20):
+    return (
+        SlowQueryLog.query.filter_by(fingerprint=fingerprint)
+        .order_by(SlowQueryLog.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def explain(statement):
+    """
+    Plan for a logged statement with every parameter bound to NULL.
+    Only SELECTs are explained; returns None otherwise.
+    """
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite':
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, (None,) * statement.count('?'))
+    elif conn.dialect.paramstyle == 'pyformat':
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement, {name: None for name in _PG_PARAM.findall(statement)})
+    else:
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement)
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def prune(days=30):
+    """Delete log rows older than `days` days. Returns the number removed."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    removed = SlowQueryLog.query.filter(SlowQueryLog.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
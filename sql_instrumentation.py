@@ -0,0 +1,252 @@
+"""
+Per-request SQL instrumentation.
+
+Hooks the SQLAlchemy engine and records, for every request, the number of
+statements, total database time and the slowest statements. The result is
+sent back in a `Server-Timing` header and logged as one JSON line. A
+statement shape repeated many times in one request (the usual sign of a
+lazy load inside a loop) is reported as a probable N+1.
+
+Statements slower than SLOW_QUERY_MS are also written to the SlowQueryLog
+table (normalized SQL, parameter shape, endpoint, duration) at the end of
+the request; see slow_queries.py for the admin report.
+
+For tests, `query_budget(n)` fails when the wrapped block issues more than
+`n` statements:
+
+    with query_budget(6):
+        client.get('/products')
+"""
+import contextvars
+import hashlib
+import heapq
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request
+from sqlalchemy import event, insert
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+_active = contextvars.ContextVar('sql_collectors', default=())
+
+# Statements at or above this duration are kept for the slow query log (None = off)
+_slow_threshold_ms = None
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+
+def statement_shape(statement):
+    """Collapse whitespace and expanded IN-lists so equal query shapes compare equal."""
+    return _IN_LIST.sub('(...)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def fingerprint(statement):
+    return hashlib.sha1(statement_shape(statement).encode()).hexdigest()
+
+
+def params_shape(parameters, executemany=False):
+    """Types of the bound parameters, without their values."""
+    if executemany and parameters:
+        return f"{len(parameters)}x {params_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in sorted(parameters.items())) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(v).__name__ for v in parameters) + ')'
+    return ''
+
+
+class QueryStats:
+    def __init__(self, keep_slowest=3):
+        self.count = 0
+        self.total_ms = 0.0
+        self.shapes = Counter()
+        self.slowest = []
+        self.slow = []
+        self._keep = keep_slowest
+
+    def record(self, statement, duration_ms):
+        self.count += 1
+        self.total_ms += duration_ms
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        entry = (duration_ms, shape)
+        if len(self.slowest) < self._keep:
+            heapq.heappush(self.slowest, entry)
+        elif duration_ms > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def repeated(self, threshold):
+        """Shapes issued at least `threshold` times, most frequent first."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+    def slowest_first(self):
+        return sorted(self.slowest, reverse=True)
+
+
+@contextmanager
+def collect(keep_slowest=3):
+    """Record every statement issued inside the block (in this thread/context)."""
+    stats = QueryStats(keep_slowest)
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(max_queries):
+    """Test helper: raise QueryBudgetExceeded if the block issues more than `max_queries` statements."""
+    with collect(keep_slowest=5) as stats:
+        yield stats
+    if stats.count > max_queries:
+        lines = [f"{n}x {shape}" for shape, n in stats.shapes.most_common(10)]
+        raise QueryBudgetExceeded(
+            f"{stats.count} queries issued, budget is {max_queries}:\n  " + '\n  '.join(lines)
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+        if context is not None:
+            context._query_timed = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _active.get()
+    starts = conn.info.get('_query_start')
+    if not collectors or not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1000
+    slow = _slow_threshold_ms is not None and duration_ms >= _slow_threshold_ms
+    shape = params_shape(parameters, executemany) if slow else None
+    for stats in collectors:
+        stats.record(statement, duration_ms)
+        if slow:
+            stats.slow.append((statement, shape, duration_ms))
+
+
+def _handle_error(exception_context):
+    """A failed statement never reaches after_cursor_execute: drop its start time."""
+    context = exception_context.execution_context
+    if context is None or not getattr(context, '_query_timed', False):
+        return
+    starts = exception_context.connection.info.get('_query_start')
+    if starts:
+        starts.pop()
+
+
+class SQLInstrumentation:
+    def __init__(self, app=None):
+        self._engines = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global _slow_threshold_ms
+        if not app.config.get('SQL_INSTRUMENTATION', True):
+            return
+        self.n_plus_one_threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+        self.keep_slowest = app.config.get('SQL_SLOWEST_KEEP', 3)
+        _slow_threshold_ms = app.config.get('SLOW_QUERY_MS', 200)
+
+        with app.app_context():
+            engine = db.engine
+        if engine not in self._engines:
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+            self._engines.add(engine)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _start(self):
+        stats = QueryStats(self.keep_slowest)
+        g._sql_stats = stats
+        g._sql_token = _active.set(_active.get() + (stats,))
+
+    def _finish(self, response):
+        stats = g.get('_sql_stats')
+        if stats is None:
+            return response
+        response.headers.add(
+            'Server-Timing', f'db;dur={stats.total_ms:.2f};desc="{stats.count} queries"'
+        )
+        repeated = stats.repeated(self.n_plus_one_threshold)
+        record = {
+            'event': 'sql',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.total_ms, 2),
+            'slowest': [{'ms': round(ms, 2), 'sql': shape[:300]} for ms, shape in stats.slowest_first()],
+        }
+        if repeated:
+            record['n_plus_one'] = [{'count': n, 'sql': shape[:300]} for shape, n in repeated]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        if stats.slow:
+            self._write_slow_queries(stats.slow, request.endpoint)
+        return response
+
+    @staticmethod
+    def _write_slow_queries(slow, endpoint):
+        from models import SlowQueryLog
+        now = datetime.utcnow()
+        rows = [
+            {
+                'fingerprint': fingerprint(statement),
+                'statement': _WHITESPACE.sub(' ', statement).strip(),
+                'params_shape': shape[:255],
+                'endpoint': (endpoint or '')[:100],
+                'duration_ms': round(duration_ms, 3),
+                'created_at': now,
+            }
+            for statement, shape, duration_ms in slow
+        ]
+        # Separate connection so the log survives whatever the request's session does,
+        # and no collectors so the insert does not log itself.
+        token = _active.set(())
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(SlowQueryLog.__table__), rows)
+        except Exception as e:
+            logger.warning(f"Failed to write slow query log: {e}")
+        finally:
+            _active.reset(token)
+
+    def _teardown(self, exc):
+        token = g.pop('_sql_token', None)
+        if token is not None:
+            try:
+                _active.reset(token)
+            except ValueError:
+                # Token from a different context (e.g. streamed response); drop ours only
+                _active.set(tuple(s for s in _active.get() if s is not g.get('_sql_stats')))
+
+
+def current_request_stats():
+    """QueryStats for the request being handled (None outside a request)."""
+    return g.get('_sql_stats')
+
+
+sql_instrumentation = SQLInstrumentation()
@@ -0,0 +1,119 @@
+"""
+In-memory typeahead index for the storefront search box.
+
+Every active product contributes sorted keys for its English name, its
+Tamil name and a spelling-tolerant Latin transliteration of the Tamil name,
+one key per word position so "tomato" finds "Organic Tomato". A prefix
+query is a bisect into the sorted key array; one- and two-character
+prefixes are answered from precomputed top lists so short queries never
+scan a large range.
+"""
+import heapq
+from bisect import bisect_left
+from collections import namedtuple
+
+from sqlalchemy import func
+
+import tamil_text
+from caching import CachedValue
+from extensions import db
+from models import Product, OrderItem
+
+Suggestion = namedtuple('Suggestion', 'id name name_tamil price unit image_url')
+
+MAX_LIMIT = 20
+SHORT_PREFIX = 2
+MAX_SCAN = 5000
+
+
+def _word_suffixes(text):
+    words = text.split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def _keys(name, name_tamil):
+    keys = set()
+    if name:
+        keys.update(_word_suffixes(tamil_text.normalize(name)))
+    if name_tamil:
+        keys.update(_word_suffixes(tamil_text.normalize(name_tamil)))
+        keys.update(_word_suffixes(tamil_text.loose_latin(tamil_text.transliterate(name_tamil))))
+    return keys
+
+
+class SuggestIndex:
+    def __init__(self, products, popularity):
+        self.products = products
+        self.popularity = popularity
+        entries = sorted(
+            (key, pid)
+            for pid, product in products.items()
+            for key in _keys(product.name, product.name_tamil)
+        )
+        self.keys = [key for key, _ in entries]
+        self.ids = [pid for _, pid in entries]
+        self.short = {}
+        for key, pid in entries:
+            for n in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                self.short.setdefault(key[:n], set()).add(pid)
+        self.short = {prefix: self._top(pids, MAX_LIMIT) for prefix, pids in self.short.items()}
+
+    def _rank(self, pid):
+        return (self.popularity.get(pid, 0), -pid)
+
+    def _top(self, pids, limit):
+        return heapq.nlargest(limit, pids, key=self._rank)
+
+    def _range(self, prefix):
+        if len(prefix) <= SHORT_PREFIX:
+            return set(self.short.get(prefix, ()))
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo, min(lo + MAX_SCAN, len(self.keys)))
+        return set(self.ids[lo:hi])
+
+    def suggest(self, query, limit=8):
+        prefix = tamil_text.normalize(query).strip()
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_LIMIT))
+        pids = self._range(prefix)
+        if prefix.isascii():
+            pids |= self._range(tamil_text.loose_latin(prefix))
+        return [self.products[pid] for pid in self._top(pids, limit)]
+
+
+def _load_popularity():
+    return dict(
+        db.session.query(OrderItem.product_id, func.count(OrderItem.id))
+        .group_by(OrderItem.product_id)
+        .all()
+    )
+
+
+# Order counts change slowly; keep them much longer than the product list
+popularity_cache = CachedValue(_load_popularity, ttl=3600)
+
+
+def _build_index():
+    rows = (
+        db.session.query(
+            Product.id, Product.name, Product.name_tamil, Product.price, Product.unit, Product.image_url
+        )
+        .filter(Product.is_active.is_(True))
+        .all()
+    )
+    return SuggestIndex({row.id: Suggestion(*row) for row in rows}, popularity_cache.get())
+
+
+# Product writes must call suggest_cache.invalidate(); the index is rebuilt on next use
+suggest_cache = CachedValue(_build_index, ttl=300)
+
+
+def suggest(query, limit=8):
+    return suggest_cache.get().suggest(query, limit)
+
+
+def init_app(app):
+    suggest_cache.ttl = app.config.get('SUGGEST_INDEX_TTL', 300)
+    suggest_cache.invalidate()
+    popularity_cache.invalidate()
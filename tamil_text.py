@@ -0,0 +1,100 @@
+"""
+Text normalization and tokenization for mixed English/Tamil product text.
+
+Tamil vowel signs and the virama (pulli) are combining marks, which generic
+word regexes treat as separators; the tokenizer here keeps them inside the
+word. Normalization folds the different encodings users type for the same
+word (decomposed vowel signs, zero-width joiners, Tamil digits, case).
+"""
+import re
+import unicodedata
+
+# Zero-width characters that Tamil keyboards and copy/paste frequently insert
+_INVISIBLE = dict.fromkeys(map(ord, '\u200b\u200c\u200d\u2060\ufeff\u00ad'))
+
+# Tamil digits ௦-௯ -> 0-9
+_TAMIL_DIGITS = {0x0BE6 + i: str(i) for i in range(10)}
+
+# Letters, digits and the whole Tamil block (vowel signs, pulli, au length mark)
+_TOKEN_RE = re.compile(r'(?:[^\W_]|[\u0B80-\u0BFF])+')
+
+
+def normalize(text):
+    """NFC-normalize, strip zero-width characters, map Tamil digits and casefold."""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFC', text)
+    text = text.translate(_INVISIBLE).translate(_TAMIL_DIGITS)
+    return text.casefold()
+
+
+def tokenize(text):
+    """Normalized word tokens of `text`, in order."""
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def is_tamil(token):
+    return any('\u0B80' <= ch <= '\u0BFF' for ch in token)
+
+
+# --- Latin transliteration (for typeahead on romanized Tamil) ---
+
+_VOWELS = {
+    'அ': 'a', 'ஆ': 'aa', 'இ': 'i', 'ஈ': 'ii', 'உ': 'u', 'ஊ': 'uu',
+    'எ': 'e', 'ஏ': 'ee', 'ஐ': 'ai', 'ஒ': 'o', 'ஓ': 'oo', 'ஔ': 'au',
+}
+_VOWEL_SIGNS = {
+    'ா': 'aa', 'ி': 'i', 'ீ': 'ii', 'ு': 'u', 'ூ': 'uu',
+    'ெ': 'e', 'ே': 'ee', 'ை': 'ai', 'ொ': 'o', 'ோ': 'oo', 'ௌ': 'au',
+}
+_CONSONANTS = {
+    'க': 'k', 'ங': 'ng', 'ச': 's', 'ஞ': 'nj', 'ட': 't', 'ண': 'n', 'த': 'th',
+    'ந': 'n', 'ப': 'p', 'ம': 'm', 'ய': 'y', 'ர': 'r', 'ல': 'l', 'வ': 'v',
+    'ழ': 'zh', 'ள': 'l', 'ற': 'r', 'ன': 'n', 'ஜ': 'j', 'ஷ': 'sh', 'ஸ': 's',
+    'ஹ': 'h', 'ஶ': 'sh',
+}
+_PULLI = '்'
+_AAYTHAM = 'ஃ'
+
+# Spelling variants people use when romanizing Tamil; folded away in loose keys
+# (Tamil script does not distinguish voiced/unvoiced stops, so g/k, d/t, b/p, j/s fold too.)
+_LOOSE_FOLDS = (
+    ('zh', 'l'), ('th', 't'), ('dh', 't'), ('kh', 'k'), ('ch', 's'), ('sh', 's'), ('w', 'v'),
+    ('g', 'k'), ('d', 't'), ('b', 'p'), ('j', 's'),
+)
+_RUNS = re.compile(r'(.)\1+')
+
+
+def transliterate(text):
+    """Romanize Tamil script (other characters pass through), e.g. தக்காளி -> thakkaali."""
+    out = []
+    text = normalize(text)
+    for i, ch in enumerate(text):
+        if ch in _CONSONANTS:
+            out.append(_CONSONANTS[ch])
+            nxt = text[i + 1] if i + 1 < len(text) else ''
+            if nxt != _PULLI and nxt not in _VOWEL_SIGNS:
+                out.append('a')
+        elif ch in _VOWEL_SIGNS:
+            out.append(_VOWEL_SIGNS[ch])
+        elif ch in _VOWELS:
+            out.append(_VOWELS[ch])
+        elif ch == _AAYTHAM:
+            out.append('h')
+        elif ch == _PULLI or ch == 'ௗ':
+            continue
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+
+def loose_latin(text):
+    """
+    Spelling-tolerant key for romanized text: folds common variants
+    (th/t, zh/l, g/k, ...) and collapses doubled letters, so 'thakkaali',
+    'thakkali' and 'takali' all give the same key.
+    """
+    text = normalize(text)
+    for variant, canonical in _LOOSE_FOLDS:
+        text = text.replace(variant, canonical)
+    return _RUNS.sub(r'\1', text)
@@ -0,0 +1,117 @@
+"""
+Test fixtures.
+
+The app is created once per session (app.py builds it at import) over a
+SQLite file in a temporary directory. The schema and a StoreSettings row
+are created first, the way benchmarks/micro does, then create_app() seeds
+the admin and demo customer (password "123"). Tests add the rows they need
+with unique names, so they can share the database.
+"""
+import itertools
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = '123'
+ADMIN_EMAIL = 'admin@thaavaram.com'
+CUSTOMER_EMAIL = 'customer@test.com'
+
+_serial = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    from benchmarks import seed
+
+    root = tmp_path_factory.mktemp('app')
+    url = 'sqlite:///' + str(root / 'test.db')
+    seed_app = seed.make_app(url)
+    with seed_app.app_context():
+        import migrations
+        from extensions import db
+        from models import StoreSettings
+        fresh = migrations.is_fresh_database()
+        db.create_all()
+        migrations.upgrade(fresh=fresh)
+        db.session.add(StoreSettings(store_name='Thaavaram', store_name_tamil='தாவரம்',
+                                     email='info@thaavaram.com', gst_number='33AAAAA0000A1Z5',
+                                     upi_id='store@upi', free_delivery_amount=500.0, delivery_charge=50.0))
+        db.session.commit()
+
+    os.environ['DATABASE_URL'] = url
+    os.environ['INVOICE_CACHE_DIR'] = str(root / 'invoice_cache')
+    os.environ['SQL_INSTRUMENTATION'] = 'false'
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+    from app import app as application
+    application.config['WTF_CSRF_ENABLED'] = False
+    return application
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+        from extensions import db
+        db.session.rollback()
+
+
+@pytest.fixture
+def login(app):
+    """login(email) -> a test client signed in as that user."""
+    def _login(email=CUSTOMER_EMAIL):
+        client = app.test_client()
+        client.post('/login', data={'email': email, 'password': PASSWORD})
+        return client
+    return _login
+
+
+@pytest.fixture
+def make_product(ctx):
+    from extensions import db
+    from models import Category, Product
+
+    def _make(name='Tomato', name_tamil='தக்காளி', price=40.0, **fields):
+        n = next(_serial)
+        if 'category_id' not in fields:
+            category = Category(name=f'Category {n}', name_tamil='வகை')
+            db.session.add(category)
+            db.session.flush()
+            fields['category_id'] = category.id
+        fields.setdefault('sku', f'T{n:06d}')
+        fields.setdefault('gst_rate', 5)
+        product = Product(name=name, name_tamil=name_tamil, price=price, **fields)
+        db.session.add(product)
+        db.session.commit()
+        return product
+    return _make
+
+
+@pytest.fixture
+def make_order(ctx):
+    """make_order(lines=[(product, quantity)], **order fields) -> committed Order."""
+    from extensions import db
+    from models import Order, OrderItem, User
+
+    def _make(lines, **fields):
+        customer = User.query.filter_by(email=CUSTOMER_EMAIL).one()
+        subtotal = sum(product.price * quantity for product, quantity in lines)
+        values = dict(order_number=f'TST{next(_serial):08d}', user_id=customer.id, subtotal=subtotal,
+                      total_amount=subtotal, delivery_name='Test Customer', delivery_phone='9876543210',
+                      delivery_address='1 Test Street', delivery_city='Chennai', delivery_state='Tamil Nadu',
+                      delivery_pincode='600001')
+        values.update(fields)
+        order = Order(**values)
+        db.session.add(order)
+        db.session.flush()
+        for product, quantity in lines:
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, product_name=product.name,
+                                     product_name_tamil=product.name_tamil, product_sku=product.sku,
+                                     price=product.price, quantity=quantity, unit=product.unit,
+                                     gst_rate=product.gst_rate))
+        db.session.commit()
+        return order
+    return _make
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import inventory
+from extensions import db
+from models import InventoryMovement, StockReservation, StockSnapshot, User
+from tests.conftest import CUSTOMER_EMAIL
+
+
+def _stocked(make_product, quantity, name='Ragi Flour'):
+    product = make_product(name, 'கேழ்வரகு மாவு')
+    inventory.set_stock(product, quantity)
+    db.session.commit()
+    return product
+
+
+def _customer():
+    return User.query.filter_by(email=CUSTOMER_EMAIL).one()
+
+
+def test_take_refuses_to_oversell_and_appends_nothing(make_product):
+    flour, rice = _stocked(make_product, 5), _stocked(make_product, 2, 'Rice')
+    before = InventoryMovement.query.count()
+
+    with pytest.raises(inventory.InsufficientStock) as excinfo:
+        inventory.take([(flour.id, 3), (rice.id, 2.5)])
+    assert excinfo.value.shortages == [(rice.id, 'Rice', 2.5, 2)]
+    assert InventoryMovement.query.count() == before
+
+    inventory.take([(flour.id, 3), (flour.id, 2), (rice.id, 2)])  # lines for one product are merged
+    assert inventory.stock_levels([flour.id, rice.id]) == {flour.id: 0, rice.id: 0}
+    with pytest.raises(inventory.InsufficientStock):
+        inventory.take([(flour.id, 0.001)])
+
+
+def test_untracked_products_are_never_short(make_product):
+    product = make_product('Banana Leaf', 'வாழை இலை')
+    inventory.take([(product.id, 1000)])
+    assert inventory.stock_level(product.id) is None
+
+
+def test_reserve_cart_holds_what_it_can(make_product):
+    user = _customer()
+    flour, rice = _stocked(make_product, 5), _stocked(make_product, 2, 'Rice')
+
+    skipped = inventory.reserve_cart(user.id, [(flour.id, 3), (rice.id, 4)], minutes=15)
+    db.session.commit()
+    assert skipped == [rice.id]
+    assert inventory.stock_levels([flour.id, rice.id]) == {flour.id: 2, rice.id: 2}
+    held = db.session.query(StockReservation.product_id, StockReservation.quantity).filter_by(user_id=user.id)
+    assert held.all() == [(flour.id, 3)]
+
+    # Reserving again replaces the earlier hold instead of adding to it
+    inventory.reserve_cart(user.id, [(flour.id, 4)], minutes=15)
+    db.session.commit()
+    assert inventory.stock_level(flour.id) == 1
+
+    # The owner's checkout can use its own reservation
+    inventory.commit_stock(user.id, [(flour.id, 5)])
+    db.session.commit()
+    assert inventory.stock_level(flour.id) == 0
+    assert StockReservation.query.filter_by(user_id=user.id).count() == 0
+
+
+def test_release_expired_restocks_only_expired_reservations(make_product):
+    user = _customer()
+    flour, rice = _stocked(make_product, 5), _stocked(make_product, 5, 'Rice')
+    inventory.reserve_cart(user.id, [(flour.id, 2), (rice.id, 1)], minutes=15)
+    StockReservation.query.filter_by(user_id=user.id, product_id=rice.id).update(
+        {'expires_at': datetime.utcnow() + timedelta(hours=2)})
+    db.session.commit()
+
+    assert inventory.release_expired(datetime.utcnow() + timedelta(minutes=30)) == 1
+    db.session.commit()
+    assert inventory.stock_levels([flour.id, rice.id]) == {flour.id: 5, rice.id: 4}
+    held = db.session.query(StockReservation.product_id).filter_by(user_id=user.id)
+    assert held.scalar() == rice.id
+
+    inventory.release_for_user(user.id)
+    db.session.commit()
+
+
+def test_compact_folds_the_ledger_into_the_snapshot(make_product):
+    flour = _stocked(make_product, 10)
+    inventory.take([(flour.id, 4)])
+    inventory.record([(flour.id, 1.5)], inventory.RETURN)
+    db.session.commit()
+    assert inventory.stock_level(flour.id) == 7.5
+    assert flour.stock_kg == 10  # mirrored only by compaction
+
+    assert inventory.compact() >= 1
+    snapshot = db.session.get(StockSnapshot, flour.id)
+    db.session.refresh(snapshot)
+    db.session.refresh(flour)
+    assert snapshot.quantity == 7.5
+    assert snapshot.movement_id == db.session.query(db.func.max(InventoryMovement.id)).filter_by(
+        product_id=flour.id).scalar()
+    assert flour.stock_kg == flour.stock_quantity == 7.5
+    assert inventory.stock_level(flour.id) == 7.5
+
+    inventory.take([(flour.id, 0.5)])
+    db.session.commit()
+    assert inventory.stock_level(flour.id) == 7  # snapshot plus the new tail
+
+
+def test_history_pages_and_stock_at_a_past_moment(make_product):
+    flour = _stocked(make_product, 10)
+    before_sales = datetime.utcnow()
+    InventoryMovement.query.filter_by(product_id=flour.id).update(
+        {'created_at': before_sales - timedelta(minutes=1)})
+    for quantity in (1, 2, 3):
+        inventory.take([(flour.id, quantity)])
+    db.session.commit()
+
+    newest = inventory.history(flour.id, limit=2)
+    assert [m.delta for m in newest] == [-3, -2]
+    older = inventory.history(flour.id, limit=2, before_id=newest[-1].id)
+    assert [(m.delta, m.reason) for m in older] == [(-1, inventory.SALE), (10, inventory.ADJUSTMENT)]
+    assert inventory.stock_at(flour.id, before_sales) == 10
+    assert inventory.stock_level(flour.id) == 4
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import invoice_cache
+from caching import get_store_settings
+from extensions import db
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Count calls to the real renderer."""
+    calls = []
+    render = invoice_cache.render
+
+    def counting(order, settings):
+        calls.append(order.id)
+        return render(order, settings)
+    monkeypatch.setattr(invoice_cache, 'render', counting)
+    return calls
+
+
+def test_miss_renders_and_hit_reuses_the_file(make_product, make_order, renders):
+    order = make_order([(make_product(price=25.0), 3)], status='delivered')
+
+    path, key = invoice_cache.invoice_path(order)
+    with open(path, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+    assert renders == [order.id]
+
+    assert invoice_cache.invoice_path(order) == (path, key)
+    assert renders == [order.id]
+
+
+def test_order_change_gives_a_new_key(make_product, make_order, renders):
+    order = make_order([(make_product(price=25.0), 1)])
+    _, key = invoice_cache.invoice_path(order)
+
+    order.payment_status = 'paid'
+    db.session.commit()
+    _, new_key = invoice_cache.invoice_path(order)
+    assert new_key != key
+    assert new_key[0] == key[0]
+    assert renders == [order.id, order.id]
+
+
+def test_same_order_renders_identical_bytes(make_product, make_order):
+    order = make_order([(make_product(price=19.99), 2.5)])
+    settings = get_store_settings()
+    assert invoice_cache.render(order, settings) == invoice_cache.render(order, settings)
+
+
+def test_download_answers_304_for_current_etag(app, login, make_product, make_order, renders):
+    order = make_order([(make_product(price=40.0), 2)])
+    client = login()
+
+    first = client.get(f'/invoice/{order.id}/pdf')
+    assert first.status_code == 200
+    assert first.mimetype == 'application/pdf'
+    assert first.data.startswith(b'%PDF-')
+    etag = first.headers['ETag']
+
+    again = client.get(f'/invoice/{order.id}/pdf', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert renders == [order.id]
+
+
+def test_evict_removes_least_recently_used(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(invoice_cache._config, 'directory', str(tmp_path))
+    monkeypatch.setitem(invoice_cache._config, 'max_bytes', 2500)
+    monkeypatch.setitem(invoice_cache._state, 'size', 0)
+
+    old, older = ('settings', 'old'), ('settings', 'older')
+    for n, key in enumerate([old, older]):
+        os.utime(invoice_cache.store(key, b'x' * 1000), (2000 - n, 2000 - n))
+    # A hit refreshes the mtime, leaving `older` as the least recently used
+    assert invoice_cache.lookup(older) is not None
+
+    invoice_cache.store(('settings', 'new'), b'x' * 1000)  # 3000 bytes: over the limit
+    assert invoice_cache.lookup(old) is None
+    assert invoice_cache.lookup(older) is not None
+    assert invoice_cache.lookup(('settings', 'new')) is not None
+    assert invoice_cache._state['size'] <= 2500 * 0.9
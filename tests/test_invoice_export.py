@@ -0,0 +1,42 @@
+import io
+import zipfile
+
+import invoice_export
+from models import InvoiceExport
+from tests.conftest import ADMIN_EMAIL
+
+
+def test_orders_page_has_export_form_and_poller(login):
+    page = login(ADMIN_EMAIL).get('/admin/orders').get_data(as_text=True)
+    assert 'action="/admin/invoices/export"' in page
+    assert 'invoice_export.py run' in page
+    assert '.invoice-export' in page
+
+
+def test_export_renders_and_streams_a_zip(app, login, make_product, make_order):
+    product = make_product(price=12.5)
+    orders = [make_order([(product, n)], status='packed') for n in (1, 2)]
+    client = login(ADMIN_EMAIL)
+
+    response = client.post('/admin/invoices/export', data={'status': 'packed'})
+    assert response.status_code == 302
+    with app.app_context():
+        export = InvoiceExport.query.order_by(InvoiceExport.id.desc()).first()
+        assert export.status == 'pending'
+        export_id = export.id
+    page = client.get('/admin/orders').get_data(as_text=True)
+    assert f'/admin/invoices/exports/{export_id}' in page
+
+    with app.app_context():
+        assert invoice_export.render_export(export_id)
+
+    status = client.get(f'/admin/invoices/exports/{export_id}').get_json()
+    assert status['status'] == 'ready'
+    assert (status['done'], status['failed'], status['total']) == (2, 0, 2)
+
+    download = client.get(status['download_url'])
+    assert download.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(download.data)) as archive:
+        assert sorted(archive.namelist()) == sorted(f'invoice_{order.order_number}.pdf' for order in orders)
+        for name in archive.namelist():
+            assert archive.read(name).startswith(b'%PDF-')
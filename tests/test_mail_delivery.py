@@ -0,0 +1,107 @@
+"""mail_delivery.deliver against a local aiosmtpd server."""
+import socket
+
+import pytest
+
+import mail_delivery
+import notifications
+from extensions import db
+from mail_delivery import OutgoingMail
+from models import NotificationLog, User
+from tests.conftest import ADMIN_EMAIL
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller  # noqa: E402
+
+
+class Recorder:
+    """aiosmtpd handler: records (session, recipient, subject); can refuse or drop."""
+
+    def __init__(self, refuse=(), drop_on=()):
+        self.refuse = set(refuse)
+        self.drop_on = set(drop_on)
+        self.received = []
+        self.contents = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        recipient = envelope.rcpt_tos[0]
+        if recipient in self.drop_on:
+            self.drop_on.discard(recipient)
+            server.transport.close()
+            return '421 Closing connection'
+        self.received.append((id(session), recipient))
+        self.contents.append(envelope.content.decode())
+        return '250 Message accepted'
+
+
+@pytest.fixture
+def smtp_server(app, monkeypatch):
+    servers = []
+
+    def start(handler):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        servers.append(controller)
+        state = app.extensions['mail']
+        for name, value in dict(server='127.0.0.1', port=port,
+                                use_tls=False, use_ssl=False, username=None, password=None,
+                                suppress=False, default_sender='store@test.com', max_emails=None).items():
+            monkeypatch.setattr(state, name, value)
+        return handler
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def _batch(*recipients):
+    return [OutgoingMail(n, recipient, f'Subject {n}', f'Body {n}', f'<p>Body {n}</p>')
+            for n, recipient in enumerate(recipients)]
+
+
+def test_batch_goes_over_one_connection(ctx, smtp_server):
+    handler = smtp_server(Recorder())
+    results = mail_delivery.deliver(_batch('a@test.com', 'b@test.com', 'c@test.com'))
+    assert results == {0: None, 1: None, 2: None}
+    assert [recipient for _, recipient in handler.received] == ['a@test.com', 'b@test.com', 'c@test.com']
+    assert len({session for session, _ in handler.received}) == 1
+
+
+def test_rejected_recipient_fails_only_itself(ctx, smtp_server):
+    handler = smtp_server(Recorder(refuse={'gone@test.com'}))
+    results = mail_delivery.deliver(_batch('a@test.com', 'gone@test.com', 'c@test.com'))
+    assert results[0] is None and results[2] is None
+    assert 'gone@test.com' in results[1]
+    assert [recipient for _, recipient in handler.received] == ['a@test.com', 'c@test.com']
+    assert len({session for session, _ in handler.received}) == 1
+
+
+def test_reconnects_after_the_server_drops_the_session(ctx, smtp_server):
+    handler = smtp_server(Recorder(drop_on={'b@test.com'}))
+    results = mail_delivery.deliver(_batch('a@test.com', 'b@test.com', 'c@test.com'))
+    assert results == {0: None, 1: None, 2: None}
+    assert [recipient for _, recipient in handler.received] == ['a@test.com', 'b@test.com', 'c@test.com']
+    first, second, third = (session for session, _ in handler.received)
+    assert first != second == third
+
+
+def test_worker_sends_text_and_html_bodies(ctx, smtp_server):
+    handler = smtp_server(Recorder())
+    NotificationLog.query.filter_by(status='pending').update({'status': 'sent'})
+    notifications.queue_settings_update('Email', User.query.filter_by(email=ADMIN_EMAIL).one())
+    db.session.commit()
+
+    sent, failed = notifications.drain()
+    assert (sent, failed) == (len(handler.received), 0)
+    content = handler.contents[0]
+    assert 'Content-Type: multipart/alternative' in content
+    assert 'Content-Type: text/html' in content
+    assert 'Email Settings Updated' in content
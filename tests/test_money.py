@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import text
+
+from extensions import db
+from models import Product
+from money import format_rupees, from_paise, line_paise, line_total, percent_paise, round_half_up, to_paise
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0, 0), (0.4999, 0), (0.5, 1), (2.5, 3), (1012.5, 1013),
+    (-0.4999, 0), (-0.5, -1), (-2.5, -3), (-1012.5, -1013),
+])
+def test_round_half_up_rounds_halves_away_from_zero(value, expected):
+    assert round_half_up(value) == expected
+
+
+def test_to_paise_uses_the_shortest_float_repr():
+    assert to_paise(0.1 + 0.2) == 30
+    assert to_paise(2.675) == 268  # binary 2.67499999... but written 2.675
+    assert to_paise('19.995') == 2000
+    assert to_paise(None) is None
+
+
+def test_line_paise_rounds_fractional_quantities_once():
+    assert line_paise(4050, 0.25) == 1013  # 1012.5
+    assert line_paise(3333, 0.75) == 2500  # 2499.75
+    assert line_paise(-4050, 0.25) == -1013
+    assert line_total(40.5, 0.25) == 10.13
+
+
+@pytest.mark.parametrize('paise, rate, expected', [
+    (1050, 5, 53),     # 52.5
+    (1049, 5, 52),     # 52.45
+    (2500, 12, 300),
+    (999, 18, 180),    # 179.82
+    (-1050, 5, -53),
+    (1050, 0, 0),
+])
+def test_percent_paise(paise, rate, expected):
+    assert percent_paise(paise, rate) == expected
+
+
+def test_rupee_round_trip_and_formatting():
+    assert from_paise(123456) == 1234.56
+    assert format_rupees(123456) == '₹1,234.56'
+    assert format_rupees(-5) == '-₹0.05'
+
+
+def test_money_column_stores_whole_paise(make_product):
+    product = make_product(price=33.335)
+    db.session.expire(product)
+    assert product.price == 33.34
+    stored = db.session.execute(text('SELECT price FROM product WHERE id = :id'), {'id': product.id}).scalar()
+    assert stored == 3334
+    assert db.session.get(Product, product.id).price == 33.34
@@ -0,0 +1,41 @@
+import notifications
+from extensions import db
+from models import NotificationLog, StoreSettings, User
+from tests.conftest import ADMIN_EMAIL, CUSTOMER_EMAIL
+
+
+def test_admin_notification_goes_to_store_email_and_every_active_admin(ctx):
+    second = User(username='admin2', email='admin2@test.com', password_hash='x', role='admin', is_active=True)
+    retired = User(username='admin3', email='admin3@test.com', password_hash='x', role='admin', is_active=False)
+    db.session.add_all([second, retired])
+    db.session.flush()
+    settings = StoreSettings.query.first()
+    assert settings.email
+
+    customer = User.query.filter_by(email=CUSTOMER_EMAIL).one()
+    notifications.queue_settings_update('Payment', customer)
+    rows = NotificationLog.query.filter(NotificationLog.subject == 'Payment Settings Updated - Thaavaram').all()
+    assert sorted(row.recipient for row in rows) == sorted([settings.email, ADMIN_EMAIL, 'admin2@test.com'])
+
+
+def test_homepage_settings_change_is_queued_not_sent(app, login):
+    client = login(ADMIN_EMAIL)
+    with app.app_context():
+        settings = StoreSettings.query.first()
+        form = {'store_name': settings.store_name, 'email': settings.email, 'phone': settings.phone or '',
+                'upi_id': 'new-shop@upi', 'free_delivery_amount': '750', 'delivery_charge': '50'}
+    response = client.post('/admin/update-homepage-settings', data=form)
+    assert response.status_code == 302
+    assert '/admin/homepage-settings' in response.location
+    with app.app_context():
+        rows = NotificationLog.query.filter(
+            NotificationLog.subject == 'Homepage Settings Updated - Thaavaram').all()
+        assert ADMIN_EMAIL in {row.recipient for row in rows}
+        assert {row.status for row in rows} == {'pending'}
+        row = rows[-1]
+        # The new values, in both bodies
+        assert 'UPI ID: new-shop@upi' in row.message
+        assert 'Free Delivery Above: ₹750' in row.message
+        assert 'Visit your store: http://localhost/' in row.message
+        assert '<strong>UPI ID:</strong> new-shop@upi' in row.html_message
+        assert 'href="http://localhost/admin"' in row.html_message
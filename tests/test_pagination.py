@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+from models import Order
+from pagination import decode_cursor, encode_cursor, keyset_paginate
+from tests.conftest import ADMIN_EMAIL
+
+KEYS = (Order.created_at, Order.id)
+
+
+def _token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trips_against_its_keys(make_order, make_product):
+    order = make_order([(make_product(), 1)])
+    token = encode_cursor('n', 2, [order.created_at, order.id])
+    assert decode_cursor(token, KEYS) == ('n', 2, [order.created_at, order.id])
+
+
+@pytest.mark.parametrize('payload', [
+    ['n', 2, []],
+    ['n', 2, [{'dt': '2026-01-01T00:00:00'}]],
+    ['n', 2, [{'dt': '2026-01-01T00:00:00'}, 5, 6]],
+    ['n', 2, [5, {'dt': '2026-01-01T00:00:00'}]],
+    ['n', 2, [{'dt': 'yesterday'}, 5]],
+    ['n', 2, [{'dt': '2026-01-01T00:00:00'}, 'five']],
+    ['n', 2, [{'dt': '2026-01-01T00:00:00'}, [5]]],
+    ['p', 'two', [{'dt': '2026-01-01T00:00:00'}, 5]],
+])
+def test_crafted_cursor_is_rejected(payload):
+    assert decode_cursor(_token(payload), KEYS) is None
+
+
+def test_crafted_cursor_falls_back_to_the_first_page(ctx, make_order, make_product):
+    make_order([(make_product(), 1)])
+    first = keyset_paginate(Order.query, KEYS, None, per_page=5)
+    crafted = keyset_paginate(Order.query, KEYS, _token(['n', 9, [1]]), per_page=5)
+    assert crafted.page == 1
+    assert [o.id for o in crafted.items] == [o.id for o in first.items]
+
+
+def test_admin_orders_survives_a_crafted_cursor(login):
+    client = login(ADMIN_EMAIL)
+    for payload in (['n', 3, []], ['p', 3, ['x', {'dt': 'bad'}]], ['n', 3, [{'d': '2026-01-01'}, 1.5]]):
+        assert client.get('/admin/orders', query_string={'page': _token(payload)}).status_code == 200
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from extensions import db
+from models import CartItem, Order, StoreSettings, User
+from money import line_paise, percent_paise, to_paise
+from pricing import CartPricing, price_cart, price_session_cart
+from tests.conftest import CUSTOMER_EMAIL
+
+SETTINGS = SimpleNamespace(free_delivery_amount=500.0, delivery_charge=50.0)
+
+DELIVERY = {'delivery_name': 'Test Customer', 'delivery_phone': '9876543210', 'delivery_address': '1 Test Street',
+            'delivery_city': 'Chennai', 'delivery_state': 'Tamil Nadu', 'delivery_pincode': '600001'}
+
+
+def _line(price, quantity, gst_rate, product_id=1):
+    return SimpleNamespace(product=SimpleNamespace(id=product_id, price=price, gst_rate=gst_rate), quantity=quantity)
+
+
+def test_totals_are_sums_of_rounded_lines():
+    pricing = CartPricing([_line(33.33, 0.75, 5, 1), _line(40.5, 0.25, 12, 2)], SETTINGS)
+    assert list(pricing.line_totals) == [2500, 1013]  # 2499.75, 1012.5
+    assert list(pricing.line_gst) == [125, 122]  # 125.0, 121.56
+    assert (pricing.subtotal, pricing.gst_amount, pricing.delivery_charge) == (35.13, 2.47, 50.0)
+    assert pricing.total == 87.6
+    assert pricing.total_paise == pricing.subtotal_paise + pricing.gst_paise + pricing.delivery_paise
+
+
+def test_delivery_is_free_from_the_threshold():
+    assert CartPricing([_line(250.0, 2, 0)], SETTINGS).delivery_charge == 0
+    assert CartPricing([_line(249.99, 2, 0)], SETTINGS).delivery_charge == 50.0
+    assert not CartPricing([], SETTINGS)
+
+
+def test_guest_cart_drops_unknown_products(make_product):
+    product = make_product('Millet', 'தினை', 12.5)
+    pricing = price_session_cart({str(product.id): 2, '999999': 1}, SETTINGS)
+    assert [item.id for item in pricing.items] == [product.id]
+    assert pricing.subtotal == 25.0
+
+
+def test_placed_order_stores_the_cart_pricing(app, login, make_product):
+    client = login(CUSTOMER_EMAIL)
+    with app.app_context():
+        customer = User.query.filter_by(email=CUSTOMER_EMAIL).one()
+        CartItem.query.filter_by(user_id=customer.id).delete()
+        lines = [(make_product('Ragi', 'கேழ்வரகு', 33.33, gst_rate=5), 0.75),
+                 (make_product('Cashew', 'முந்திரி', 40.5, gst_rate=12), 0.25),
+                 (make_product('Jaggery', 'வெல்லம்', 19.99, gst_rate=18), 3)]
+        for product, quantity in lines:
+            db.session.add(CartItem(user_id=customer.id, product_id=product.id, quantity=quantity))
+        db.session.commit()
+        expected = price_cart(customer.id, StoreSettings.query.first())
+        last_id = db.session.query(db.func.max(Order.id)).scalar() or 0
+
+    response = client.post('/place_order', data=DELIVERY)
+    assert response.status_code == 302 and '/order_confirmation/' in response.location
+
+    with app.app_context():
+        order = Order.query.filter(Order.user_id == customer.id, Order.id > last_id).one()
+        assert (order.subtotal, order.gst_amount, order.delivery_charge, order.total_amount) == (
+            expected.subtotal, expected.gst_amount, expected.delivery_charge, expected.total)
+        # The stored lines reproduce the stored totals
+        line_totals = [line_paise(to_paise(item.price), item.quantity) for item in order.items]
+        assert to_paise(order.subtotal) == sum(line_totals)
+        assert to_paise(order.gst_amount) == sum(
+            percent_paise(total, item.gst_rate) for total, item in zip(line_totals, order.items))
+        assert CartItem.query.filter_by(user_id=customer.id).count() == 0
@@ -0,0 +1,66 @@
+from sqlalchemy import text
+
+from extensions import db
+from search import FTS5Backend, MemoryBackend, search_index
+
+
+def _tamil_products(make_product):
+    tomato = make_product(name='Tomato', name_tamil='தக்காளி')
+    other = make_product(name='Takkolam', name_tamil='தக்கோலம்')
+    search_index.reindex([tomato.id, other.id])
+    db.session.commit()
+    return tomato, other
+
+
+def test_tamil_prefix_keeps_vowel_signs(make_product):
+    tomato, other = _tamil_products(make_product)
+    takko, takka = search_index.search('தக்கோ'), search_index.search('தக்கா')
+    assert other.id in takko and tomato.id not in takko
+    assert tomato.id in takka and other.id not in takka
+    assert {tomato.id, other.id} <= set(search_index.search('தக்'))
+
+
+def test_memory_backend_agrees_on_tamil_prefixes(make_product):
+    tomato, other = _tamil_products(make_product)
+    backend = MemoryBackend()
+    backend.rebuild()
+    takko, takka = backend.search('தக்கோ', 10), backend.search('தக்கா', 10)
+    assert other.id in takko and tomato.id not in takko
+    assert tomato.id in takka and other.id not in takka
+
+
+def test_table_built_with_old_tokenizer_is_recreated(make_product):
+    make_product(name='Okra', name_tamil='வெண்டைக்காய்')
+    backend = FTS5Backend()
+    db.session.execute(text(f"DROP TABLE IF EXISTS {backend.table}"))
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE {backend.table} USING fts5("
+        f"name, name_tamil, description, description_tamil, category_name, "
+        f"tokenize = 'unicode61 remove_diacritics 2')"))
+    db.session.commit()
+
+    backend.create()
+    sql = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE name = :name"), {'name': backend.table}).scalar()
+    assert 'tokenchars' in sql
+    assert backend.needs_rebuild()
+    backend.rebuild()
+    assert not backend.needs_rebuild()
+    search_index.backend = None  # let the shared index pick the rebuilt table up again
+
+
+def _same_name_in_three_categories(make_product):
+    products = [make_product(name='Zucchini', name_tamil='சீமை சுரைக்காய்') for _ in range(3)]
+    search_index.reindex([p.id for p in products])
+    db.session.commit()
+    return products
+
+
+def test_category_filter_applies_before_the_limit(make_product):
+    products = _same_name_in_three_categories(make_product)
+    memory = MemoryBackend()
+    memory.rebuild()
+    for product in products:
+        assert search_index.search('zucchini', limit=1, category_id=product.category_id) == [product.id]
+        assert memory.search('zucchini', 1, product.category_id) == [product.id]
+
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import segments
+from extensions import db
+from models import CustomerActivity, User
+from tests.conftest import ADMIN_EMAIL
+
+
+def _customer(name):
+    user = User(username=name, email=f'{name}@test.com', password_hash='x', role='customer', is_active=True)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_index_follows_deactivation_and_role_changes(ctx):
+    segments.segment_cache.invalidate()
+    user = _customer('segment-member')
+    assert user.id in segments.members('all')
+    before = segments.count('all')
+
+    user.is_active = False
+    db.session.commit()
+    assert segments.count('all') == before - 1
+    assert user.id not in segments.members('no_orders')
+
+    user.is_active = True
+    db.session.commit()
+    assert segments.count('all') == before
+    assert user.id in segments.members('no_orders')
+
+    user.role = 'storekeeper'
+    db.session.commit()
+    assert user.id not in segments.members('all')
+
+
+def test_communications_page_shows_audience_counts(app, login):
+    with app.app_context():
+        counts = segments.counts()
+    client = login(ADMIN_EMAIL)
+    page = client.get('/admin/communications').get_data(as_text=True)
+    assert 'id="audience-counts"' in page
+    assert f'<strong id="audience-count">{counts["all"]}</strong>' in page
+    assert '/admin/campaign-audience-count' in page
+
+    response = client.get('/admin/campaign-audience-count?target_audience=no_orders')
+    assert response.get_json() == {'success': True, 'target_audience': 'no_orders',
+                                   'recipients_count': counts['no_orders']}
+
+
+def test_record_order_creates_then_counts_the_activity_row(ctx):
+    user = _customer('segment-orders')
+    first, second = datetime(2026, 1, 1, 9), datetime(2026, 2, 1, 9)
+    segments.record_order(user.id, first)
+    segments.record_order(user.id, second)
+    db.session.commit()
+
+    row = db.session.get(CustomerActivity, user.id)
+    assert (row.orders_count, row.first_order_at, row.last_order_at) == (2, first, second)
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import sequences
+from extensions import db
+from models import Category, Order, Product, SequenceCounter
+
+
+def _forget(name):
+    SequenceCounter.query.filter_by(name=name).delete()
+    db.session.commit()
+    sequences.reset()
+
+
+def test_counter_starts_after_the_highest_existing_code(make_order, make_product):
+    product = make_product()
+    for number in ('TSTSEQ0009', 'TSTSEQ0010', 'TSTSEQX0099', 'TSTSEQ'):
+        make_order([(product, 1)], order_number=number)
+    start = sequences.next_after(Order.order_number, 'TSTSEQ')
+
+    assert sequences.next_value('test:seeded', start) == 11  # 0010 beats 0009; non-digit suffixes are ignored
+    assert list(sequences.allocate('test:seeded', 3, start)) == [12, 13, 14]
+    assert sequences.next_value('test:empty', sequences.next_after(Order.order_number, 'NOSUCH')) == 1
+
+
+def test_order_numbers_continue_the_days_existing_numbers(make_order, make_product):
+    today = datetime.now().strftime('%Y%m%d')
+    _forget(f'order:{today}')
+    make_order([(make_product(), 1)], order_number=f'THV{today}0041')
+
+    numbers = [Order().generate_order_number() for _ in range(3)]
+    assert numbers == [f'THV{today}{n:04d}' for n in (42, 43, 44)]
+
+
+def test_blocks_never_hand_out_a_value_twice(ctx, monkeypatch):
+    # The block cache is skipped on SQLite; run its path against the test database
+    monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+    monkeypatch.setattr(sequences, '_block_size', 3)
+    _forget('test:blocks')
+
+    first_worker = [sequences.next_value('test:blocks') for _ in range(2)]
+    sequences.reset()  # another worker: the rest of the first block is never used
+    second_worker = [sequences.next_value('test:blocks') for _ in range(2)]
+    bulk = list(sequences.allocate('test:blocks', 5))
+
+    values = first_worker + second_worker + bulk
+    assert values == [1, 2, 4, 5, 7, 8, 9, 10, 11]
+    assert db.session.get(SequenceCounter, 'test:blocks').next_value == 12
+    sequences.reset()
+
+
+def test_skus_continue_after_existing_codes_in_the_category(make_product):
+    category = Category(name='Quinoa Zest', name_tamil='வகை')
+    db.session.add(category)
+    db.session.flush()
+    assert Product.sku_prefix(category) == 'THVQUI'
+    for sku in ('THVQUI9999', 'THVQUI10000', 'THVQUIOLD'):
+        make_product(sku=sku, category_id=category.id)
+    _forget('sku:THVQUI')
+
+    product = Product(category_id=category.id)
+    assert product.generate_sku() == 'THVQUI10001'
+    skus = Product.allocate_skus(category.id, 500, category=category)
+    assert len(set(skus)) == 500 and skus[0] == 'THVQUI10002' and skus[-1] == 'THVQUI10501'
+    assert not set(skus) & {p.sku for p in Product.query.filter_by(category_id=category.id)}
@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+import sql_instrumentation
+from sql_instrumentation import collect
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    event.listen(engine, 'before_cursor_execute', sql_instrumentation._before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', sql_instrumentation._after_cursor_execute)
+    event.listen(engine, 'handle_error', sql_instrumentation._handle_error)
+    yield engine
+    engine.dispose()
+
+
+def test_failed_statement_does_not_leave_a_start_time(engine):
+    with engine.connect() as conn, collect() as stats:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+        assert conn.info.get('_query_start') == []
+        conn.execute(text("SELECT 1"))
+        assert conn.info['_query_start'] == []
+    assert stats.count == 1